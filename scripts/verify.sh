@@ -3,8 +3,14 @@
 # Depends on gpgv
 # Arguments:
 #   verify.sh <directory of old policy> <directory of new policy>
+#             [<status file> [<old signature date> <old signature key>]]
 # Verifies signature on both old and new policy, and ensures
 # timestamp on new policy is higher.
+# If <status file> is given, the gpgv status output for the new policy
+# is copied there.  A caller that recorded the signature date (seconds
+# since the epoch) and key fingerprint of the old policy when it last
+# verified it, and knows the files haven't changed since, can pass them
+# to skip verifying the old policy again.
 
 set -e
 
@@ -13,6 +19,9 @@ SIG_FILE="$JSON_FILE.asc"
 
 OLD_DIR=$1
 NEW_DIR=$2
+STATUS_FILE=$3
+OLD_SIG_EPOCH=$4
+OLD_SIG_FINGERPRINT=$5
 
 AUTHORITY_FINGERPRINT="B693F33372E965D76D55368616EEA65D03326C9D"
 
@@ -67,14 +76,21 @@ EOF
 
 # Check that we can perform the update safely
 gpgv --status-fd 3 3>"$TMP_DIR/gpgv.status" --keyring="$TMP_DIR/authority.key" "$NEW_DIR/$SIG_FILE" "$NEW_DIR/$JSON_FILE"
+if [ -n "$STATUS_FILE" ] ; then
+    cp "$TMP_DIR/gpgv.status" "$STATUS_FILE"
+fi
 
 get_sig_epoch_date() {
     awk '($1 == "[GNUPG:]" && $2 == "VALIDSIG" && $12 == "'$AUTHORITY_FINGERPRINT'") { print $5 }'
 }
 
 if [ -r "$OLD_DIR/$JSON_FILE" ] && [ -r "$OLD_DIR/$SIG_FILE" ] ; then
-    gpgv --status-fd 3 3>"$TMP_DIR/gpgv.old.status" --keyring="$TMP_DIR/authority.key" "$OLD_DIR/$SIG_FILE" "$OLD_DIR/$JSON_FILE"
-    OLD_DATE=$(get_sig_epoch_date < "$TMP_DIR/gpgv.old.status")
+    if [ -n "$OLD_SIG_EPOCH" ] && [ "$OLD_SIG_FINGERPRINT" = "$AUTHORITY_FINGERPRINT" ] ; then
+        OLD_DATE=$OLD_SIG_EPOCH
+    else
+        gpgv --status-fd 3 3>"$TMP_DIR/gpgv.old.status" --keyring="$TMP_DIR/authority.key" "$OLD_DIR/$SIG_FILE" "$OLD_DIR/$JSON_FILE"
+        OLD_DATE=$(get_sig_epoch_date < "$TMP_DIR/gpgv.old.status")
+    fi
     NEW_DATE=$(get_sig_epoch_date < "$TMP_DIR/gpgv.status")
     if [ $NEW_DATE -lt $OLD_DATE ] ; then
         printf "Rollback detected (old date %d, new date %d)!\n" "$OLD_DATE" "$NEW_DATE" >&2
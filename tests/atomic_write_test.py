@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import unittest
+
+ROOT_DIR, _ = os.path.split(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "tools"))
+
+from AtomicWrite import atomic_write
+
+
+def mode(path):
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+
+class TestAtomicWrite(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "file")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def read(self):
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def test_new_file(self):
+        atomic_write(self.path, b"data")
+        self.assertEqual(self.read(), b"data")
+        self.assertEqual(mode(self.path), 0o644)
+        self.assertEqual(os.listdir(self.tmpdir), ["file"])
+
+    def test_mode(self):
+        atomic_write(self.path, b"data", 0o600)
+        self.assertEqual(mode(self.path), 0o600)
+        # The mode of the file replaced is kept unless one is given.
+        atomic_write(self.path, b"more")
+        self.assertEqual(mode(self.path), 0o600)
+        atomic_write(self.path, b"more", 0o640)
+        self.assertEqual(mode(self.path), 0o640)
+
+    def test_failure_keeps_old_file(self):
+        atomic_write(self.path, b"old")
+        with self.assertRaises(TypeError):
+            atomic_write(self.path, "not bytes")
+        self.assertEqual(self.read(), b"old")
+        self.assertEqual(os.listdir(self.tmpdir), ["file"])
+
+    def test_synced(self):
+        synced = []
+        fsync = os.fsync
+        os.fsync = lambda fd: synced.append(os.fstat(fd).st_ino)
+        try:
+            atomic_write(self.path, b"data")
+        finally:
+            os.fsync = fsync
+        # The new file before it is renamed into place, then the directory.
+        self.assertEqual(synced, [os.stat(self.path).st_ino,
+                                  os.stat(self.tmpdir).st_ino])
+
+
+if __name__ == '__main__':
+    unittest.main()
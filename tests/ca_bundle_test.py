@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import ssl
+import sys
+import tempfile
+import unittest
+
+ROOT_DIR, _ = os.path.split(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "tools"))
+
+from CABundle import CABundle, CABundleError
+from testcerts import der, make_cert, pem
+
+
+class TestCABundle(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.ca_dir = os.path.join(self.tmp_dir, "mozilla")
+        os.mkdir(self.ca_dir)
+        self.ca_file = os.path.join(self.tmp_dir, "CAfile")
+        self.roots = [make_cert("Root %d" % i, ca=True)[0] for i in range(3)]
+        self.write("a.crt", pem(self.roots[0]))
+        # Two in one file, one of them a repeat.
+        self.write("b.crt", pem(self.roots[1]) + pem(self.roots[0]))
+        self.write("c.crt", der(self.roots[2]))
+        self.write("README", b"not a certificate")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, name, data):
+        with open(os.path.join(self.ca_dir, name), "wb") as f:
+            f.write(data)
+
+    def test_build(self):
+        bundle = CABundle.from_directory(self.ca_dir)
+        self.assertEqual(bundle.count, 3)
+        self.assertEqual(len(bundle.paths), 3)
+        context = ssl.create_default_context(cadata=bundle.data.decode())
+        self.assertEqual(sorted(context.get_ca_certs(binary_form=True)),
+                         sorted(der(root) for root in self.roots))
+
+    def test_install_only_when_changed(self):
+        bundle = CABundle.from_directory(self.ca_dir)
+        self.assertTrue(bundle.install(self.ca_file))
+        inode = os.stat(self.ca_file).st_ino
+        self.assertFalse(CABundle.from_directory(self.ca_dir).install(
+            self.ca_file))
+        self.assertEqual(os.stat(self.ca_file).st_ino, inode)
+
+        # The same roots, in another file, make the same bundle.
+        self.write("d.crt", pem(self.roots[1]))
+        self.assertFalse(CABundle.from_directory(self.ca_dir).install(
+            self.ca_file))
+
+        self.write("e.crt", pem(make_cert("New root", ca=True)[0]))
+        bundle = CABundle.from_directory(self.ca_dir)
+        self.assertTrue(bundle.install(self.ca_file))
+        self.assertNotEqual(os.stat(self.ca_file).st_ino, inode)
+        with open(self.ca_file, "rb") as f:
+            self.assertEqual(f.read(), bundle.data)
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)),
+                         ["CAfile", "mozilla"])
+
+    def test_no_certificates(self):
+        self.assertRaises(CABundleError, CABundle.from_directory,
+                          os.path.join(self.tmp_dir, "missing"))
+        self.assertRaises(CABundleError, CABundle,
+                          [os.path.join(self.ca_dir, "README")])
+
+
+if __name__ == '__main__':
+    unittest.main()
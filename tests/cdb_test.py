@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT_DIR, _ = os.path.split(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "tools"))
+
+from Cdb import Cdb, CdbError, CdbWriter, cdb_hash, write_cdb
+
+
+class TestCdb(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "table.cdb")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_hash(self):
+        # h = ((h << 5) + h) ^ c from 5381, as cdb.txt defines it.
+        self.assertEqual(cdb_hash(b""), 5381)
+        self.assertEqual(cdb_hash(b"a"), 177604)
+
+    def test_round_trip(self):
+        items = [(b"domain%d.example" % i, b"secure match=mx%d" % i)
+                 for i in range(5000)]
+        items.append((b"", b"empty key"))
+        write_cdb(self.path, items)
+        with Cdb(self.path) as cdb:
+            for key, value in items:
+                self.assertEqual(cdb.get(key), value)
+            self.assertIsNone(cdb.get(b"missing.example"))
+            self.assertEqual(list(cdb), items)
+        self.assertEqual(os.listdir(self.tmp_dir), ["table.cdb"])
+
+    def test_known_file(self):
+        # One record, in the layout cdb.txt describes.
+        f = io.BytesIO()
+        writer = CdbWriter(f)
+        writer.add(b"a", b"b")
+        writer.finish()
+        data = f.getvalue()
+        self.assertEqual(len(data), 2048 + 10 + 16)
+        table = 177604 & 0xff
+        self.assertEqual(data[8 * table:8 * table + 8],
+                         (2058).to_bytes(4, "little") + b"\2\0\0\0")
+        self.assertEqual(data[2048:2058], b"\1\0\0\0\1\0\0\0ab")
+
+    def test_empty(self):
+        write_cdb(self.path, [])
+        with Cdb(self.path) as cdb:
+            self.assertIsNone(cdb.get(b"a"))
+            self.assertEqual(list(cdb), [])
+
+    def test_failed_write_keeps_file(self):
+        write_cdb(self.path, [(b"a", b"1")])
+
+        def items():
+            yield b"a", b"2"
+            raise RuntimeError("stop")
+        self.assertRaises(RuntimeError, write_cdb, self.path, items())
+        with Cdb(self.path) as cdb:
+            self.assertEqual(cdb.get(b"a"), b"1")
+        self.assertEqual(os.listdir(self.tmp_dir), ["table.cdb"])
+
+    def test_not_a_cdb(self):
+        for data in (b"", b"short"):
+            with open(self.path, "wb") as f:
+                f.write(data)
+            self.assertRaises(CdbError, Cdb, self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
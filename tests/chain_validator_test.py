@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+from cryptography.x509.oid import ExtendedKeyUsageOID
+
+ROOT_DIR, _ = os.path.split(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "tools"))
+
+from ChainValidator import InvalidChain, TrustStore
+from testcerts import der, make_cert, pem
+
+DAY = 24 * 60 * 60
+
+
+class TestTrustStore(unittest.TestCase):
+    def setUp(self):
+        self.ca_dir = tempfile.mkdtemp()
+        self.root = make_cert("Test Root", ca=True, days=3650)
+        self.intermediate = make_cert("Test Intermediate", issuer=self.root,
+                                      ca=True, days=3650)
+        self.cafile = os.path.join(self.ca_dir, "roots.pem")
+        with open(self.cafile, "wb") as f:
+            f.write(pem(self.root[0]))
+        self.store = TrustStore(cafile=self.cafile)
+
+    def tearDown(self):
+        shutil.rmtree(self.ca_dir)
+
+    def chain(self, **kwargs):
+        leaf = make_cert("mx.example.com", issuer=self.intermediate, **kwargs)
+        return [der(leaf[0]), der(self.intermediate[0])]
+
+    def test_valid_chain(self):
+        self.assertIsNone(self.store.verify(self.chain()))
+        self.assertTrue(self.store.is_valid(self.chain(
+            usages=[ExtendedKeyUsageOID.SERVER_AUTH])))
+
+    def test_missing_intermediate(self):
+        self.assertFalse(self.store.is_valid(self.chain()[:1]))
+
+    def test_untrusted_root(self):
+        other_root = os.path.join(self.ca_dir, "other.pem")
+        with open(other_root, "wb") as f:
+            f.write(pem(make_cert("Other Root", ca=True)[0]))
+        other = TrustStore(cafile=other_root)
+        self.assertFalse(other.is_valid(self.chain()))
+
+    def test_purpose(self):
+        chain = self.chain(usages=[ExtendedKeyUsageOID.CLIENT_AUTH])
+        with self.assertRaises(InvalidChain) as cm:
+            self.store.verify(chain)
+        self.assertIn("purpose", str(cm.exception))
+
+    def test_at_time(self):
+        chain = self.chain(days=10)
+        self.assertTrue(self.store.is_valid(chain))
+        self.assertFalse(self.store.is_valid(chain, time.time() + 20 * DAY))
+        self.assertFalse(self.store.is_valid(chain, time.time() - 5 * DAY))
+        # The cached verdict from the first verification still honours time.
+        self.assertTrue(self.store.is_valid(chain, time.time() + 5 * DAY))
+
+    def test_empty_chain(self):
+        self.assertFalse(self.store.is_valid([]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT_DIR, _ = os.path.split(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "tools"))
+
+from CheckpointStore import CheckpointError, CheckpointStore
+
+
+class TestCheckpointStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.store = CheckpointStore(os.path.join(self.tmp_dir, "checkpoints"),
+                                     max_checkpoints=3)
+        self.paths = [os.path.join(self.tmp_dir, name)
+                      for name in ("main.cf", "policy.cdb", "CAfile")]
+        self.write("main.cf", "v1")
+        self.write("CAfile", "roots")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, name, data):
+        with open(os.path.join(self.tmp_dir, name), "w") as f:
+            f.write(data)
+
+    def read(self, name):
+        try:
+            with open(os.path.join(self.tmp_dir, name)) as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def run_once(self, title, **files):
+        self.store.begin(self.store.snapshot(self.paths))
+        for name, data in files.items():
+            self.write(name.replace("_", "."), data)
+        after = self.store.snapshot(self.paths)
+        return self.store.finish(after, title) != after
+
+    def objects(self):
+        return len(os.listdir(self.store.objects))
+
+    def test_unchanged_run(self):
+        self.assertFalse(self.run_once("noop"))
+        self.assertEqual(self.store.checkpoints(), [])
+        self.assertIsNone(self.store.pending())
+        # The current files are kept, once each.
+        self.assertEqual(self.objects(), 2)
+        self.assertFalse(self.run_once("noop", main_cf="v1"))
+        self.assertEqual(self.objects(), 2)
+
+    def test_rollback(self):
+        self.assertTrue(self.run_once("one", main_cf="v2", policy_cdb="t1"))
+        self.assertTrue(self.run_once("two", main_cf="v3"))
+        self.assertTrue(self.run_once("three", main_cf="v2"))
+        self.assertEqual([c["title"] for c in self.store.checkpoints()],
+                         ["one", "two", "three"])
+        # v2 is stored once however many snapshots refer to it.
+        self.assertEqual(self.objects(), 5)
+
+        self.assertEqual(self.store.rollback(1),
+                         [os.path.join(self.tmp_dir, "main.cf")])
+        self.assertEqual(self.read("main.cf"), "v3")
+        self.assertEqual(self.store.rollback(2), sorted(
+            [os.path.join(self.tmp_dir, "main.cf"),
+             os.path.join(self.tmp_dir, "policy.cdb")]))
+        self.assertEqual(self.read("main.cf"), "v1")
+        self.assertIsNone(self.read("policy.cdb"))
+        self.assertEqual(self.store.checkpoints(), [])
+        self.assertEqual(self.objects(), 2)
+        self.assertRaises(CheckpointError, self.store.rollback, 1)
+
+    def test_checkpoints_are_bounded(self):
+        for i in range(5):
+            self.run_once("run %d" % i, main_cf="v%d" % (i + 2))
+        self.assertEqual([c["title"] for c in self.store.checkpoints()],
+                         ["run 2", "run 3", "run 4"])
+        self.assertEqual(self.objects(), 5)
+
+    def test_recover(self):
+        self.run_once("one", main_cf="v2")
+        self.store.begin(self.store.snapshot(self.paths))
+        self.write("main.cf", "half done")
+        # A second begin() keeps the snapshot from before the first.
+        self.store.begin(self.store.snapshot(self.paths))
+        self.write("CAfile", "new roots")
+        self.assertEqual(self.store.recover(), sorted(
+            [os.path.join(self.tmp_dir, "CAfile"),
+             os.path.join(self.tmp_dir, "main.cf")]))
+        self.assertEqual(self.read("main.cf"), "v2")
+        self.assertEqual(self.read("CAfile"), "roots")
+        self.assertIsNone(self.store.pending())
+        self.assertEqual(self.store.recover(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
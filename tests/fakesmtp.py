@@ -0,0 +1,152 @@
+"""Simulated MX hosts with configurable STARTTLS behaviour.
+
+Every host gets its own loopback address (127.1.0.0/16 and up), so that
+per-address limits in the scanner behave as they would against real hosts,
+and all of them listen on one port.  A connection's behaviour is picked by
+the local address it arrived on:
+
+  ok                 STARTTLS with a chain issued by the farm's root
+  tarpit             as ok, after holding back the banner for a while
+  reject             554 banner
+  no_starttls        EHLO reply without STARTTLS
+  handshake_failure  agrees to STARTTLS, then sends a TLS alert
+  expired            as ok, but the leaf has expired
+  self_signed        as ok, but the leaf is self-signed
+"""
+
+import asyncio
+import os
+import resource
+import socket
+import ssl
+
+from stubdns import StubDNSServer
+from testcerts import key_pem, make_cert, pem
+
+BEHAVIOURS = ("ok", "tarpit", "reject", "no_starttls", "handshake_failure",
+              "expired", "self_signed")
+
+# A fatal handshake_failure alert.
+TLS_ALERT = b"\x15\x03\x01\x00\x02\x02\x28"
+
+
+def loopback_address(i):
+    return "127.%d.%d.%d" % (1 + i // 65024, i // 254 % 256, i % 254 + 1)
+
+
+class MailFarm(object):
+    """Serve @hosts, a {hostname: behaviour} dict, from one process.
+
+    Certificates are written under @cert_dir.  Tarpits wait @tarpit_delay
+    seconds before their banner.
+    """
+
+    def __init__(self, cert_dir, hosts, tarpit_delay=5):
+        self.tarpit_delay = tarpit_delay
+        self.hosts = hosts
+        self.addresses = dict((host, loopback_address(i))
+                              for i, host in enumerate(sorted(hosts)))
+        self.behaviours = dict((self.addresses[host], behaviour)
+                               for host, behaviour in hosts.items())
+        root = make_cert("Bench Root", ca=True, days=3650)
+        self.root_pem = pem(root[0])
+        leaves = {
+            "ok": make_cert("*.bench.test", issuer=root),
+            "expired": make_cert("*.bench.test", issuer=root, days=-0.5),
+            "self_signed": make_cert("*.bench.test"),
+        }
+        self.contexts = {}
+        for behaviour, (cert, key) in leaves.items():
+            chain_file = os.path.join(cert_dir, behaviour + ".pem")
+            key_file = os.path.join(cert_dir, behaviour + ".key")
+            with open(chain_file, "wb") as f:
+                f.write(pem(cert))
+            with open(key_file, "wb") as f:
+                f.write(key_pem(key))
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(chain_file, key_file)
+            self.contexts[behaviour] = context
+        self.contexts["tarpit"] = self.contexts["ok"]
+        self.servers = []
+        self.dns = None
+
+    def records(self, domains):
+        """DNS records for the hosts and for @domains, {domain: [mx hosts]}."""
+        records = {}
+        for host, address in self.addresses.items():
+            records[(host, "A")] = [address]
+        for domain, mx_hosts in domains.items():
+            records[(domain, "MX")] = ["%d %s." % (10 * (i + 1), host)
+                                       for i, host in enumerate(mx_hosts)]
+        return records
+
+    async def handle(self, reader, writer):
+        behaviour = self.behaviours.get(
+            writer.get_extra_info("sockname")[0], "ok")
+        try:
+            if behaviour == "tarpit":
+                await asyncio.sleep(self.tarpit_delay)
+            if behaviour == "reject":
+                writer.write(b"554 no SMTP service here\r\n")
+                await writer.drain()
+                return
+            writer.write(b"220 bench ESMTP\r\n")
+            await reader.readline()
+            if behaviour == "no_starttls":
+                writer.write(b"250-bench\r\n250 PIPELINING\r\n")
+                await writer.drain()
+                await reader.readline()
+                return
+            writer.write(b"250-bench\r\n250 STARTTLS\r\n")
+            await writer.drain()
+            await reader.readline()
+            writer.write(b"220 go ahead\r\n")
+            if behaviour == "handshake_failure":
+                await reader.read(1)
+                writer.write(TLS_ALERT)
+                await writer.drain()
+                return
+            await writer.drain()
+            transport = await asyncio.get_running_loop().start_tls(
+                writer.transport, writer.transport.get_protocol(),
+                self.contexts[behaviour], server_side=True)
+            transport.close()
+        except (OSError, ssl.SSLError, asyncio.TimeoutError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, domains):
+        """Start the DNS stub and every listener.
+
+        Returns (SMTP port, DNS port).
+        """
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        self.dns = StubDNSServer(self.records(domains))
+        resolver = await self.dns.start()
+        addresses = [self.addresses[host] for host in sorted(self.hosts)]
+        while True:
+            sockets = []
+            try:
+                port = 0
+                for address in addresses:
+                    sock = socket.socket()
+                    sockets.append(sock)
+                    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                    sock.bind((address, port))
+                    port = sock.getsockname()[1]
+                break
+            except OSError:
+                # Another process has the port on one of our addresses.
+                for sock in sockets:
+                    sock.close()
+        for sock in sockets:
+            self.servers.append(await asyncio.start_server(
+                self.handle, sock=sock, backlog=1024))
+        return port, resolver.port
+
+    def close(self):
+        for server in self.servers:
+            server.close()
+        self.dns.close()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+
+import gzip
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT_DIR, _ = os.path.split(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "tools"))
+
+import LogReader as log_reader
+from LogReader import LogReader
+
+
+class TestLogReader(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.log = os.path.join(self.tmpdir, "mail.log")
+        self.checkpoint = os.path.join(self.tmpdir, "state", "checkpoint.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def append(self, data, path=None):
+        with open(path or self.log, "ab") as f:
+            f.write(data)
+
+    def run_reader(self, chunk_size=4):
+        reader = LogReader(self.log, self.checkpoint, chunk_size=chunk_size)
+        lines = list(reader.lines())
+        reader.save()
+        reader.close()
+        return lines, reader
+
+    def test_reads_only_new_lines(self):
+        self.append(b"one\ntwo\nthr")
+        lines, reader = self.run_reader()
+        self.assertEqual(lines, [b"one\n", b"two\n"])
+        with open(self.checkpoint) as f:
+            checkpoint = json.load(f)
+        self.assertEqual(checkpoint["offset"], 8)
+        self.assertEqual(checkpoint["inode"], os.stat(self.log).st_ino)
+
+        self.append(b"ee\nfour\n")
+        self.assertEqual(self.run_reader()[0], [b"three\n", b"four\n"])
+        self.assertEqual(self.run_reader()[0], [])
+
+    def test_no_checkpoint_file(self):
+        self.append(b"one\n")
+        reader = LogReader(self.log)
+        self.assertEqual(list(reader.lines()), [b"one\n"])
+        reader.save()
+        reader.close()
+        self.assertEqual(list(LogReader(self.log).lines()), [b"one\n"])
+
+    def test_missing_log(self):
+        lines, reader = self.run_reader()
+        self.assertEqual(lines, [])
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_unchanged_checkpoint_not_rewritten(self):
+        self.append(b"one\n")
+        self.run_reader()
+        inode = os.stat(self.checkpoint).st_ino
+        self.assertEqual(self.run_reader()[0], [])
+        self.assertEqual(os.stat(self.checkpoint).st_ino, inode)
+        self.append(b"two\n")
+        self.assertEqual(self.run_reader()[0], [b"two\n"])
+        self.assertNotEqual(os.stat(self.checkpoint).st_ino, inode)
+
+    def test_corrupt_checkpoint(self):
+        self.append(b"one\n")
+        os.makedirs(os.path.dirname(self.checkpoint))
+        with open(self.checkpoint, "w") as f:
+            f.write("{")
+        with self.assertLogs("LogReader", "WARNING"):
+            self.assertEqual(self.run_reader()[0], [b"one\n"])
+
+    def test_rotated(self):
+        self.append(b"one\ntwo\n")
+        self.run_reader()
+        self.append(b"three\nfour")
+        os.rename(self.log, self.log + ".1")
+        self.append(b"five\n")
+        lines, reader = self.run_reader()
+        self.assertEqual(lines, [b"three\n", b"four", b"five\n"])
+        self.assertFalse(reader.skipped)
+        self.assertEqual(self.run_reader()[0], [])
+
+    def test_rotated_compressed(self):
+        self.append(b"one\ntwo\n")
+        self.run_reader()
+        self.append(b"three\n")
+        with open(self.log, "rb") as f, \
+                gzip.open(self.log + ".1.gz", "wb") as out:
+            shutil.copyfileobj(f, out)
+        os.unlink(self.log)
+        self.append(b"four\n")
+        self.assertEqual(self.run_reader()[0], [b"three\n", b"four\n"])
+
+    def test_copytruncate(self):
+        self.append(b"one\ntwo\n")
+        self.run_reader()
+        self.append(b"three\n")
+        shutil.copy(self.log, self.log + ".1")
+        with open(self.log, "r+b") as f:
+            f.truncate(0)
+        self.append(b"four\n")
+        self.assertEqual(self.run_reader()[0], [b"three\n", b"four\n"])
+
+    def test_rotated_twice(self):
+        self.append(b"one\n")
+        self.run_reader()
+        os.rename(self.log, self.log + ".2")
+        self.append(b"two\n", self.log + ".1")
+        self.append(b"three\n")
+        with self.assertLogs("LogReader", "WARNING"):
+            lines, reader = self.run_reader()
+        self.assertEqual(lines, [b"three\n"])
+        self.assertTrue(reader.skipped)
+
+    def test_follow(self):
+        # Each wait for the log to grow runs the next of these instead.
+        writes = [
+            lambda: self.append(b"o\n"),
+            lambda: self.append(b"three\n"),
+            lambda: (self.append(b"four"),
+                     os.rename(self.log, self.log + ".1"),
+                     self.append(b"five\n")),
+            lambda: (open(self.log, "wb").close(), self.append(b"six\n")),
+        ]
+        sleep = log_reader.time.sleep
+        log_reader.time.sleep = lambda seconds: writes.pop(0)()
+        try:
+            self.append(b"one\ntw")
+            reader = LogReader(self.log, self.checkpoint, chunk_size=4)
+            lines = reader.follow(interval=0)
+            self.assertEqual(next(lines), b"one\n")
+            self.assertEqual(next(lines), b"two\n")
+            # Saved before each wait, after the lines handled so far.
+            with open(self.checkpoint) as f:
+                self.assertEqual(json.load(f)["offset"], 4)
+            self.assertEqual(next(lines), b"three\n")
+            with open(self.checkpoint) as f:
+                self.assertEqual(json.load(f)["offset"], 8)
+            self.assertEqual([next(lines), next(lines)], [b"four", b"five\n"])
+            with self.assertLogs("LogReader", "WARNING"):
+                self.assertEqual(next(lines), b"six\n")
+            lines.close()
+            reader.save()
+            reader.close()
+        finally:
+            log_reader.time.sleep = sleep
+        # The lines handed out since the checkpoint advanced are read again.
+        self.assertEqual(self.run_reader()[0], [b"six\n"])
+        self.assertEqual(self.run_reader()[0], [])
+
+    def test_follow_missing_log(self):
+        inodes = []
+
+        def wait():
+            inodes.append(os.stat(self.checkpoint).st_ino
+                          if os.path.exists(self.checkpoint) else None)
+
+        writes = [
+            wait,
+            lambda: self.append(b"one\n"),
+            wait,
+            wait,
+            lambda: self.append(b"two\n"),
+        ]
+        sleep = log_reader.time.sleep
+        log_reader.time.sleep = lambda seconds: writes.pop(0)()
+        try:
+            reader = LogReader(self.log, self.checkpoint)
+            lines = reader.follow(interval=0)
+            self.assertEqual([next(lines), next(lines)], [b"one\n", b"two\n"])
+            lines.close()
+        finally:
+            log_reader.time.sleep = sleep
+        # Nothing to save until the log exists, then only once while it
+        # doesn't grow.
+        self.assertIsNone(inodes[0])
+        self.assertIsNotNone(inodes[1])
+        self.assertEqual(inodes[1], inodes[2])
+
+
+if __name__ == '__main__':
+    unittest.main()
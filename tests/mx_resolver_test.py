@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import dns.resolver
+
+ROOT_DIR, _ = os.path.split(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "tools"))
+
+from MXResolver import MXResolver
+from ObservationStore import ObservationStore
+from ScanEngine import ScanEngine
+from starttls_probe_test import STARTTLSServer
+from stubdns import StubDNSServer
+
+RECORDS = {
+    ("a.example", "MX"): ["10 aspmx.l.google.com.", "20 alt1.aspmx.l.google.com."],
+    ("b.example", "MX"): ["10 aspmx.l.google.com.", "20 alt1.aspmx.l.google.com."],
+    ("c.example", "MX"): ["5 mx.c.example."],
+    ("null.example", "MX"): ["0 ."],
+    ("aspmx.l.google.com", "A"): ["127.0.0.1"],
+    ("alt1.aspmx.l.google.com", "A"): ["127.0.0.1"],
+    ("mx.c.example", "A"): ["127.0.0.1"],
+}
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestMXResolver(unittest.TestCase):
+    def run_with_server(self, coro_func, records=RECORDS, ttl=300):
+        async def run():
+            server = StubDNSServer(records, ttl=ttl)
+            resolver = await server.start()
+            try:
+                return server, await coro_func(resolver)
+            finally:
+                server.close()
+        return asyncio.run(run())
+
+    def test_map_domains(self):
+        async def resolve(resolver):
+            mx_resolver = MXResolver(resolver)
+            return await mx_resolver.map_domains(
+                ["a.example", "b.example", "c.example", "missing.example",
+                 "null.example"])
+        server, (mx_to_domains, failures) = self.run_with_server(resolve)
+        self.assertEqual(dict(mx_to_domains), {
+            "aspmx.l.google.com": ["a.example", "b.example"],
+            "alt1.aspmx.l.google.com": ["a.example", "b.example"],
+            "mx.c.example": ["c.example"],
+        })
+        self.assertEqual(list(failures), ["missing.example"])
+        self.assertIsInstance(failures["missing.example"],
+                              dns.resolver.NXDOMAIN)
+
+    def test_ttl_cache(self):
+        clock = FakeClock()
+
+        async def resolve(resolver):
+            mx_resolver = MXResolver(resolver, clock=clock)
+            first = await mx_resolver.addresses("mx.c.example")
+            await mx_resolver.addresses("MX.C.EXAMPLE.")
+            clock.now += 59
+            await mx_resolver.addresses("mx.c.example")
+            clock.now += 2
+            await mx_resolver.addresses("mx.c.example")
+            return first
+        server, addresses = self.run_with_server(resolve, ttl=60)
+        self.assertEqual(addresses, ["127.0.0.1"])
+        self.assertEqual(server.queries[("mx.c.example", "A")], 2)
+
+    def test_concurrent_lookups_coalesce(self):
+        async def resolve(resolver):
+            mx_resolver = MXResolver(resolver)
+            return await asyncio.gather(
+                *[mx_resolver.mx_hosts("c.example") for _ in range(20)])
+        server, results = self.run_with_server(resolve)
+        self.assertEqual(results, [["mx.c.example"]] * 20)
+        self.assertEqual(server.queries[("c.example", "MX")], 1)
+
+    def test_negative_cache(self):
+        async def resolve(resolver):
+            mx_resolver = MXResolver(resolver)
+            for _ in range(3):
+                with self.assertRaises(dns.resolver.NXDOMAIN):
+                    await mx_resolver.mx_hosts("missing.example")
+        server, _ = self.run_with_server(resolve)
+        self.assertEqual(server.queries[("missing.example", "MX")], 1)
+
+
+class TestScanEngineDeduplication(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.store = ObservationStore(":memory:")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_shared_mx_probed_once(self):
+        smtp_server = STARTTLSServer(self.tmp_dir)
+
+        async def run():
+            dns_server = StubDNSServer(RECORDS)
+            resolver = await dns_server.start()
+            listener = await asyncio.start_server(smtp_server.handle,
+                                                  "127.0.0.1", 0)
+            port = listener.sockets[0].getsockname()[1]
+            engine = ScanEngine(self.store, port=port,
+                                resolver=MXResolver(resolver))
+            async with listener:
+                await engine.scan(["a.example", "b.example", "c.example"])
+            dns_server.close()
+            return dns_server
+        dns_server = asyncio.run(run())
+        self.assertEqual(smtp_server.connections, 3)
+        self.assertEqual(dns_server.queries[("aspmx.l.google.com", "A")], 1)
+        for domain in ("a.example", "b.example"):
+            observations = self.store.domain_observations(domain)
+            self.assertEqual(
+                sorted(observations),
+                ["alt1.aspmx.l.google.com", "aspmx.l.google.com"])
+            self.assertEqual(observations["aspmx.l.google.com"].names,
+                             frozenset(["mx.example.com"]))
+        self.assertEqual(list(self.store.domain_observations("c.example")),
+                         ["mx.c.example"])
+
+
+if __name__ == '__main__':
+    unittest.main()
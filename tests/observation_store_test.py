@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+ROOT_DIR, _ = os.path.split(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "tools"))
+
+from ChainValidator import TrustStore
+from ObservationStore import ObservationStore, pack_chain, unpack_chain
+from STARTTLSProbe import Observation
+from testcerts import der, make_cert, pem
+
+
+class TestObservationStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "certs-observed.sqlite")
+        root = make_cert("Test Root", ca=True, days=3650)
+        cafile = os.path.join(self.tmp_dir, "roots.pem")
+        with open(cafile, "wb") as f:
+            f.write(pem(root[0]))
+        self.trust_store = TrustStore(cafile=cafile)
+        self.chain = [der(make_cert("mx.example.com", issuer=root)[0])]
+        self.store = ObservationStore(self.path, self.trust_store)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def observe(self, mx_host, chain, scanned_at=None):
+        self.store.record_observation(
+            Observation(mx_host, "192.0.2.1", "TLSv1.2", "ECDHE-AES", chain),
+            scanned_at)
+
+    def test_pack_chain(self):
+        chain = [b"\x30\x01a", b"", b"\x30" * 70000]
+        self.assertEqual(unpack_chain(pack_chain(chain)), chain)
+
+    def test_round_trip(self):
+        self.store.record_domain("example.com", ["mx.example.com",
+                                                 "mx2.example.com"])
+        self.observe("mx.example.com", self.chain)
+        self.store.record_failure("mx2.example.com", "timed out")
+        self.store.close()
+
+        store = self.store = ObservationStore(self.path)
+        self.assertEqual(store.domain_mxs("example.com"),
+                         ["mx.example.com", "mx2.example.com"])
+        self.assertIsNone(store.domain_mxs("example.net"))
+        observations = store.domain_observations("example.com")
+        ok = observations["mx.example.com"]
+        self.assertEqual(ok.protocol, "TLSv1.2")
+        self.assertEqual(ok.names, frozenset(["mx.example.com"]))
+        self.assertTrue(ok.valid)
+        self.assertIsNone(ok.error)
+        self.assertEqual(store.chain(ok.chain_id), self.chain)
+        failed = observations["mx2.example.com"]
+        self.assertEqual(failed.error, "timed out")
+        self.assertIsNone(failed.valid)
+
+    def test_latest_and_chain_dedup(self):
+        self.observe("mx.example.com", self.chain, scanned_at=100)
+        self.observe("mx.example.com", self.chain, scanned_at=300)
+        self.observe("mx.example.com", [b"junk"], scanned_at=200)
+        self.observe("mx.example.net", self.chain, scanned_at=100)
+        latest = self.store.latest("mx.example.com")
+        self.assertEqual(latest.scanned_at, 300)
+        self.assertEqual(latest.chain_id,
+                         self.store.latest("mx.example.net").chain_id)
+        self.assertEqual(
+            self.store.db.execute("SELECT COUNT(*) FROM chains").fetchone()[0],
+            2)
+
+    def test_revalidate(self):
+        self.store.trust_store = None
+        self.observe("mx.example.com", self.chain)
+        self.observe("mx.example.com", self.chain,
+                     scanned_at=time.time() + 365 * 24 * 60 * 60)
+        self.assertEqual(self.store.revalidate(self.trust_store), 2)
+        self.assertFalse(self.store.latest("mx.example.com").valid)
+        self.assertEqual(self.store.revalidate(self.trust_store), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
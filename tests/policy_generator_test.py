@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+import json
+import os
+import sys
+import unittest
+
+from jsonschema import validate
+from publicsuffix import PublicSuffixList
+
+ROOT_DIR, _ = os.path.split(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "tools"))
+
+from ObservationStore import ObservationStore
+from PolicyGenerator import PolicyGenerator, synthesize_mxs
+from STARTTLSProbe import Observation
+from testcerts import der, make_cert
+
+POLICY_FILE = os.path.join(ROOT_DIR, "policy.json")
+SCHEMA_FILE = os.path.join(ROOT_DIR, "schema", "policy-0.1.schema.json")
+
+public_suffix_list = PublicSuffixList()
+
+
+class TestSynthesizeMXs(unittest.TestCase):
+    def setUp(self):
+        self.generator = PolicyGenerator(
+            None, public_suffix_list=public_suffix_list)
+
+    def synthesize(self, identities, wildcards=()):
+        return synthesize_mxs(set(identities), set(wildcards),
+                              self.generator.permitted)
+
+    def test_single_host_is_exact(self):
+        self.assertEqual(self.synthesize(["mail.example.com"]),
+                         ["mail.example.com"])
+
+    def test_branching_point(self):
+        self.assertEqual(
+            self.synthesize(["mx1.example.com", "mx2.example.com"]),
+            [".example.com"])
+        self.assertEqual(
+            self.synthesize(["a.mx.example.com", "b.mx.example.com",
+                             "mail.other.org"]),
+            [".mx.example.com", "mail.other.org"])
+
+    def test_host_on_pattern_node(self):
+        self.assertEqual(
+            self.synthesize(["aspmx.l.google.com", "alt1.aspmx.l.google.com",
+                             "alt2.aspmx.l.google.com"]),
+            [".aspmx.l.google.com", "aspmx.l.google.com"])
+
+    def test_never_a_public_suffix(self):
+        self.assertEqual(
+            self.synthesize(["mail.example.co.uk", "mail.other.co.uk"]),
+            ["mail.example.co.uk", "mail.other.co.uk"])
+        self.assertEqual(
+            self.synthesize(["a.github.io", "b.github.io"]),
+            ["a.github.io", "b.github.io"])
+
+    def test_wildcard(self):
+        self.assertEqual(
+            self.synthesize(["mx1.mail.example.net"], ["mail.example.net"]),
+            [".mail.example.net"])
+
+
+class TestPolicyGenerator(unittest.TestCase):
+    def setUp(self):
+        with open(POLICY_FILE) as pf:
+            self.aliases = json.load(pf)["policy-aliases"]
+        self.store = ObservationStore(":memory:")
+        self.generator = PolicyGenerator(
+            self.store, self.aliases, public_suffix_list=public_suffix_list)
+
+    def tearDown(self):
+        self.store.close()
+
+    def serve(self, domain, mx_hosts, cert_names=None, valid=True):
+        self.store.record_domain(domain, mx_hosts)
+        for mx_host in mx_hosts:
+            chain = [der(make_cert((cert_names or {}).get(mx_host,
+                                                          mx_host))[0])]
+            self.store.record_observation(Observation(
+                mx_host, "192.0.2.1", "TLSv1.2", "ECDHE-AES", chain))
+            self.store.db.execute(
+                "UPDATE observations SET valid = ? WHERE mx_host = ?",
+                (valid, mx_host))
+
+    def test_document(self):
+        self.serve("example.com", ["mx1.example.com", "mx2.example.com"])
+        self.serve("example.org", ["mail.example.org"],
+                   {"mail.example.org": "*.example.org"})
+        self.serve("example.net", ["mx.hosting.example"],
+                   {"mx.hosting.example": "mail.hosting.example"})
+        self.serve("invalid.example", ["mx.invalid.example"], valid=False)
+        self.store.record_domain("dead.example", [])
+        self.store.record_domain("down.example", ["mx.down.example"])
+        self.store.record_failure("mx.down.example", "timed out")
+        document = self.generator.document(
+            ["example.com", "example.org", "example.net", "invalid.example",
+             "dead.example", "down.example", "unscanned.example"])
+        self.assertIsNone(validate(
+            json.loads(json.dumps(document)), json.load(open(SCHEMA_FILE))))
+        self.assertEqual(document["policies"], {
+            "example.com": {"mode": "testing", "mxs": [".example.com"]},
+            "example.net": {"mode": "testing",
+                            "mxs": ["mail.hosting.example"]},
+            "example.org": {"mode": "testing", "mxs": [".example.org"]},
+        })
+
+    def test_aliases(self):
+        google = self.aliases["google"]["mxs"]
+        self.serve("google.example", google)
+        self.serve("outlook.example", ["a.mail.protection.outlook.com",
+                                       "b.olc.protection.outlook.com"],
+                   {"a.mail.protection.outlook.com":
+                        "*.mail.protection.outlook.com",
+                    "b.olc.protection.outlook.com":
+                        "*.olc.protection.outlook.com"})
+        self.serve("partial.example", google[:3])
+        policies = self.generator.policies(
+            ["google.example", "outlook.example", "partial.example"])
+        self.assertEqual(policies["google.example"],
+                         {"policy-alias": "google"})
+        self.assertEqual(policies["outlook.example"],
+                         {"policy-alias": "outlook"})
+        self.assertEqual(policies["partial.example"]["mxs"],
+                         [".aspmx.l.google.com", "aspmx.l.google.com"])
+
+
+if __name__ == '__main__':
+    unittest.main()
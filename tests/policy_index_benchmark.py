@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks for PolicyIndex at several list sizes.
+
+Builds synthetic policy lists (a quarter of the domains on a few shared
+aliases, the rest with their own exact or leading-dot `mxs`) and reports the
+build time, memory held by the index, and the cost per call of policy_for(),
+mx_allowed() and domains_for_mx():
+
+  python tests/policy_index_benchmark.py --sizes 1000,100000,1000000
+
+Each list is also written out as JSON and compiled, and a fresh interpreter
+loads each file and answers 1000 lookups, to compare what a process pays at
+startup for either form: the time to the last answer and the RSS it grew by.
+For the compiled form, that RSS is pages of the file, which every process
+mapping it shares.
+"""
+import argparse
+import gc
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT_DIR, _ = os.path.split(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "tools"))
+
+from PolicyIndex import MappedPolicyIndex, PolicyIndex
+
+ALIASES = {
+    "provider%d" % i: {"mode": "testing",
+                       "mxs": [".mx.provider%d.example" % i,
+                               "mx.provider%d.example" % i]}
+    for i in range(8)
+}
+
+
+def make_policy_list(size):
+    policies = {}
+    for i in range(size):
+        domain = "d%d.example" % i
+        if i % 4 == 0:
+            policies[domain] = {"policy-alias": "provider%d" % (i % 8)}
+        elif i % 4 == 1:
+            policies[domain] = {"mode": "enforce",
+                                "mxs": [".d%d.example" % i]}
+        else:
+            policies[domain] = {"mode": "testing",
+                                "mxs": ["mx1.d%d.example" % i,
+                                        "mx2.d%d.example" % i]}
+    return {"version": "0.1", "policy-aliases": ALIASES,
+            "policies": policies}
+
+
+def rss_bytes():
+    """Current resident set size, or None where /proc isn't available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (IOError, OSError):
+        return None
+
+
+def per_call(func, args, repeat=3):
+    """Return the best nanoseconds per call of func(*a) over @args."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for a in args:
+            func(*a)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best / len(args) * 1e9)
+
+
+def bench(size, queries=100000):
+    policy_list = make_policy_list(size)
+    text = json.dumps(policy_list)
+    del policy_list
+    gc.collect()
+    start = time.perf_counter()
+    policy_list = json.loads(text)
+    parse_seconds = time.perf_counter() - start
+
+    gc.collect()
+    rss_before = rss_bytes()
+    start = time.perf_counter()
+    index = PolicyIndex(policy_list)
+    build_seconds = time.perf_counter() - start
+    del policy_list
+    gc.collect()
+    rss_after = rss_bytes()
+    index_mib = None
+    if rss_before is not None:
+        # The parsed JSON is freed above, so this is what the index keeps.
+        index_mib = round((rss_after - rss_before) / 2.0 ** 20, 1)
+
+    step = max(1, size // queries)
+    ids = range(0, size, step)
+    domains = [("d%d.example" % i,) for i in ids]
+    mx_pairs = [("d%d.example" % i, "mx1.d%d.example" % i) for i in ids]
+    mx_hosts = [("mx1.d%d.example" % i,) for i in ids]
+    result = {
+        "policies": size,
+        "json_parse_seconds": round(parse_seconds, 3),
+        "build_seconds": round(build_seconds, 3),
+        "index_rss_mib": index_mib,
+        "policy_for_ns": per_call(index.policy_for, domains),
+        "mx_allowed_ns": per_call(index.mx_allowed, mx_pairs),
+        "domains_for_mx_ns": per_call(index.domains_for_mx, mx_hosts),
+    }
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        json_path = os.path.join(tmp_dir, "policy.json")
+        with open(json_path, "w") as f:
+            f.write(text)
+        del text
+        compiled_path = os.path.join(tmp_dir, "policy.idx")
+        start = time.perf_counter()
+        index.compile(compiled_path)
+        result["compile_seconds"] = round(time.perf_counter() - start, 3)
+        result["compiled_mib"] = round(
+            os.path.getsize(compiled_path) / 2.0 ** 20, 1)
+        del index
+        gc.collect()
+        mapped = MappedPolicyIndex(compiled_path)
+        result["mapped_policy_for_ns"] = per_call(mapped.policy_for, domains)
+        result["mapped_mx_allowed_ns"] = per_call(mapped.mx_allowed,
+                                                  mx_pairs)
+        result["mapped_domains_for_mx_ns"] = per_call(mapped.domains_for_mx,
+                                                      mx_hosts)
+        mapped.close()
+        for form, path in (("json", json_path), ("compiled", compiled_path)):
+            child = json.loads(subprocess.check_output(
+                [sys.executable, os.path.abspath(__file__), "--startup",
+                 path, "--size", str(size)]))
+            result[form + "_startup_seconds"] = child["seconds"]
+            result[form + "_startup_rss_mib"] = child["rss_mib"]
+    finally:
+        shutil.rmtree(tmp_dir)
+    return result
+
+
+def startup(path, size, lookups=1000):
+    """Load @path in this (fresh) process and answer @lookups queries."""
+    rss_before = rss_bytes()
+    start = time.perf_counter()
+    index = PolicyIndex.from_file(path)
+    step = max(1, size // lookups)
+    for i in range(0, size, step):
+        index.policy_for("d%d.example" % i)
+    seconds = time.perf_counter() - start
+    rss_mib = None
+    if rss_before is not None:
+        rss_mib = round((rss_bytes() - rss_before) / 2.0 ** 20, 1)
+    return {"seconds": round(seconds, 4), "rss_mib": rss_mib}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", default="1000,100000,1000000",
+                        help="comma-separated list sizes (default: "
+                        "%(default)s)")
+    parser.add_argument("--startup", help=argparse.SUPPRESS)
+    parser.add_argument("--size", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.startup:
+        print(json.dumps(startup(args.startup, args.size)))
+        return
+    results = [bench(int(size)) for size in args.sizes.split(",")]
+    print(json.dumps(results, indent=2))
+    return results
+
+
+if __name__ == '__main__':
+    main()
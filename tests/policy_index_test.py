@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT_DIR, _ = os.path.split(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "tools"))
+
+from PolicyIndex import (MappedPolicyIndex, Policy, PolicyError, PolicyIndex,
+                         parse_time)
+
+POLICY_FILE = os.path.join(ROOT_DIR, "policy.json")
+
+
+class TestPolicyIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = PolicyIndex.from_file(POLICY_FILE)
+
+    def test_policy_for(self):
+        with open(POLICY_FILE) as f:
+            policy_list = json.load(f)
+        self.assertEqual(len(self.index), len(policy_list["policies"]))
+        comcast = self.index.policy_for("Comcast.NET.")
+        self.assertEqual(comcast, Policy("enforce", ["mx1.comcast.net",
+                                                     "mx2.comcast.net"]))
+        self.assertIsNone(self.index.policy_for("example.invalid"))
+
+    def test_aliases_resolved(self):
+        aol = self.index.policy_for("aol.com")
+        self.assertEqual(aol.alias, "yahoo")
+        self.assertEqual(aol.mode, "testing")
+        self.assertIs(aol, self.index.policy_for("yahoo.com"))
+
+    def test_mx_allowed(self):
+        self.assertTrue(self.index.mx_allowed("aol.com",
+                                              "mta5.am0.yahoodns.net"))
+        self.assertTrue(self.index.mx_allowed("aol.com",
+                                              "x.y.am0.yahoodns.net"))
+        self.assertFalse(self.index.mx_allowed("aol.com", "am0.yahoodns.net"))
+        self.assertFalse(self.index.mx_allowed("aol.com", "evilyahoodns.net"))
+        self.assertTrue(self.index.mx_allowed(
+            "gmail.com", "GMAIL-SMTP-IN.L.GOOGLE.COM."))
+        self.assertTrue(self.index.mx_allowed(
+            "gmail.com", "alt1.gmail-smtp-in.l.google.com"))
+        self.assertFalse(self.index.mx_allowed("example.invalid",
+                                               "mx.example.invalid"))
+
+    def test_domains_for_mx(self):
+        yahoo = set(["aol.com", "rocketmail.com", "yahoo.com",
+                     "yahoogroups.com", "ymail.com"])
+        self.assertTrue(yahoo <= self.index.domains_for_mx(
+            "mta6.am0.yahoodns.net"))
+        for domain in self.index.domains_for_mx("mta6.am0.yahoodns.net"):
+            self.assertTrue(self.index.mx_allowed(domain,
+                                                  "mta6.am0.yahoodns.net"))
+        self.assertEqual(self.index.domains_for_mx("mx1.comcast.net"),
+                         frozenset(["comcast.net",
+                                    "technikumnukleoniczne.pl"]))
+        self.assertEqual(self.index.domains_for_mx("comcast.net"),
+                         frozenset())
+        self.assertEqual(self.index.domains_for_mx("net"), frozenset())
+
+    def test_matches_linear_scan(self):
+        # The trie must agree with checking every policy in turn.
+        for mx_host in ("mx.eff.org", "eff.org", "a.b.mail.icloud.com",
+                        "mx1.mail.icloud.com", "aspmx.l.google.com",
+                        "mail.protection.outlook.com", "mx.qq.com"):
+            expected = frozenset(d for d in self.index.domains()
+                                 if self.index.mx_allowed(d, mx_host))
+            self.assertEqual(self.index.domains_for_mx(mx_host), expected)
+
+    def test_errors(self):
+        with self.assertRaises(PolicyError):
+            PolicyIndex({"policies": {"a.example": {"policy-alias": "x"}}})
+        with self.assertRaises(PolicyError):
+            PolicyIndex({"policies": {"a.example": {"mode": "strict",
+                                                    "mxs": ["a.example"]}}})
+        with self.assertRaises(PolicyError):
+            PolicyIndex({"policies": {"a.example": {"mxs": ["a.example"]},
+                                      "A.example.": {"mxs": ["b.example"]}}})
+
+
+class TestParseTime(unittest.TestCase):
+    def test_formats(self):
+        self.assertEqual(parse_time(1590000000), 1590000000.0)
+        self.assertEqual(parse_time("2020-01-01T00:00:00Z"), 1577836800.0)
+        self.assertEqual(parse_time("2020-01-01T00:00:00"), 1577836800.0)
+        self.assertEqual(parse_time("2020-01-01T08:00:00+08:00"),
+                         1577836800.0)
+        self.assertEqual(parse_time("2019-12-31T16:00:00-08:00"),
+                         1577836800.0)
+        # Any number of fractional digits, as the schema allows.
+        self.assertAlmostEqual(parse_time("2020-01-01T00:00:00.1Z"),
+                               1577836800.1)
+        self.assertAlmostEqual(parse_time("2020-01-01T00:00:00.12345678Z"),
+                               1577836800.12345678)
+
+    def test_invalid(self):
+        for value in ("2020-13-01T00:00:00Z", "2020-01-01T00:00:00+24:00",
+                      "2020-01-01", "yesterday", None, True):
+            self.assertRaises(PolicyError, parse_time, value)
+
+
+class TestMappedPolicyIndex(TestPolicyIndex):
+    """Every PolicyIndex test again, against the compiled form."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "policy.idx")
+        PolicyIndex.from_file(POLICY_FILE).compile(self.path)
+        self.index = PolicyIndex.from_file(self.path)
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_same_as_json(self):
+        self.assertIsInstance(self.index, MappedPolicyIndex)
+        index = PolicyIndex.from_file(POLICY_FILE)
+        self.assertEqual(sorted(self.index.domains()),
+                         sorted(index.domains()))
+        for domain in index.domains():
+            self.assertEqual(self.index.policy_for(domain),
+                             index.policy_for(domain))
+        self.assertEqual(self.index.expires, index.expires)
+        self.assertEqual(self.index.version, "0.1")
+        self.assertFalse("example.invalid" in self.index)
+
+    def test_bad_files(self):
+        with open(self.path, "rb") as f:
+            data = f.read()
+        with open(self.path, "wb") as f:
+            f.write(data[:-4])
+        with self.assertRaises(PolicyError):
+            MappedPolicyIndex(self.path)
+        with open(self.path, "wb") as f:
+            f.write(b"")
+        with self.assertRaises(PolicyError):
+            MappedPolicyIndex(self.path)
+        with self.assertRaises(PolicyError):
+            MappedPolicyIndex(POLICY_FILE)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+
+import collections
+import json
+import os
+import shutil
+import sys
+import tempfile
+import tracemalloc
+import unittest
+
+ROOT_DIR, _ = os.path.split(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "tools"))
+
+from PolicyIndex import Policy, PolicyError, PolicyIndex
+from PolicyStream import PolicyStream
+from PolicyValidator import ERROR, WARNING, pointer
+
+POLICY_FILE = os.path.join(ROOT_DIR, "policy.json")
+
+POLICY_LIST = collections.OrderedDict([
+    ("version", "0.1"),
+    ("timestamp", "2020-05-20T10:25:12+00:00"),
+    ("expires", "2020-06-03T10:25:12+00:00"),
+    ("policy-aliases", {
+        "hosted": {"mode": "enforce", "mxs": [".mx.hosted.example"]},
+    }),
+    ("policies", collections.OrderedDict([
+        ("example.com", {"mode": "testing", "mxs": ["mx1.example.com"]}),
+        ("customer.example", {"policy-alias": "hosted"}),
+        ("big.example", {"mode": "enforce",
+                         "mxs": ["mx%d.big.example" % i for i in range(50)]}),
+    ])),
+])
+
+EXPECTED = [
+    ("example.com", Policy("testing", ["mx1.example.com"])),
+    ("customer.example", Policy("enforce", [".mx.hosted.example"], "hosted")),
+    ("big.example", Policy("enforce",
+                           ["mx%d.big.example" % i for i in range(50)])),
+]
+
+
+class TestPolicyStream(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, policy_list, indent=2):
+        path = os.path.join(self.tmp_dir, "policy.json")
+        with open(path, "w") as f:
+            if isinstance(policy_list, str):
+                f.write(policy_list)
+            else:
+                json.dump(policy_list, f, indent=indent)
+        return path
+
+    def test_policy_json(self):
+        index = PolicyIndex.from_file(POLICY_FILE)
+        stream = PolicyStream(POLICY_FILE)
+        seen = 0
+        for domain, policy in stream:
+            self.assertEqual(policy, index.policy_for(domain))
+            seen += 1
+        self.assertEqual(seen, len(index))
+        self.assertEqual(stream.fields["version"], "0.1")
+        self.assertEqual(stream.fields["policies"], {})
+
+    def test_small_chunks(self):
+        # Every value, the timestamps and the long mxs list included, is
+        # split across reads.
+        for indent in (None, 2):
+            path = self.write(POLICY_LIST, indent)
+            for chunk_size in (1, 7, 64):
+                self.assertEqual(list(PolicyStream(path,
+                                                   chunk_size=chunk_size)),
+                                 EXPECTED)
+
+    def test_aliases_after_policies(self):
+        policy_list = collections.OrderedDict(
+            (key, value) for key, value in POLICY_LIST.items()
+            if key != "policy-aliases")
+        policy_list["policy-aliases"] = POLICY_LIST["policy-aliases"]
+        problems = []
+        stream = PolicyStream(self.write(policy_list),
+                              on_problem=problems.append, chunk_size=16)
+        self.assertEqual(list(stream), EXPECTED)
+        self.assertEqual(problems, [])
+
+    def test_problems_skip_entries(self):
+        policy_list = json.loads(json.dumps(POLICY_LIST))
+        policy_list["policy-aliases"]["broken"] = {"mode": "enforce"}
+        policies = policy_list["policies"]
+        policies["example.com"]["mxs"].append(".example.com")
+        policies["dangling.example"] = {"policy-alias": "missing"}
+        policies["uses-broken.example"] = {"policy-alias": "broken"}
+        policies["bad mode.example"] = {"mode": "none", "mxs": ["mx.example"]}
+        problems = []
+        stream = PolicyStream(self.write(policy_list),
+                              on_problem=problems.append)
+        self.assertEqual([domain for domain, _ in stream],
+                         [domain for domain, _ in EXPECTED])
+        paths = sorted((problem.path, problem.severity)
+                       for problem in problems)
+        self.assertEqual(paths, sorted([
+            (pointer("policy-aliases", "broken"), ERROR),
+            (pointer("policies", "example.com", "mxs", 0), WARNING),
+            (pointer("policies", "dangling.example", "policy-alias"), ERROR),
+            (pointer("policies", "uses-broken.example", "policy-alias"),
+             ERROR),
+            (pointer("policies", "bad mode.example"), ERROR),
+            (pointer("policies", "bad mode.example", "mode"), ERROR),
+        ]))
+
+    def test_first_error_raises(self):
+        policy_list = json.loads(json.dumps(POLICY_LIST))
+        policy_list["policies"]["dangling.example"] = {"policy-alias": "x"}
+        stream = iter(PolicyStream(self.write(policy_list)))
+        self.assertEqual([next(stream) for _ in EXPECTED], EXPECTED)
+        self.assertRaises(PolicyError, next, stream)
+
+    def test_top_level_checked(self):
+        policy_list = json.loads(json.dumps(POLICY_LIST))
+        policy_list["expires"] = policy_list["timestamp"]
+        del policy_list["version"]
+        problems = []
+        stream = PolicyStream(self.write(policy_list),
+                              on_problem=problems.append)
+        self.assertEqual(list(stream), EXPECTED)
+        self.assertEqual(sorted(problem.path for problem in problems),
+                         ["", "/expires"])
+
+    def test_bad_json(self):
+        text = json.dumps(POLICY_LIST)
+        for bad in ("", "[]", text[:-1], text[:len(text) // 2], text + "{}",
+                    text.replace('"mode"', "mode", 1)):
+            stream = PolicyStream(self.write(bad), on_problem=lambda p: None,
+                                  chunk_size=32)
+            self.assertRaises(PolicyError, list, stream)
+
+    def test_bounded_memory(self):
+        policies = collections.OrderedDict(
+            ("domain%d.example" % i,
+             {"mode": "enforce", "mxs": ["mx.domain%d.example" % i]})
+            for i in range(20000))
+        policy_list = dict(POLICY_LIST, policies=policies)
+        path = self.write(policy_list)
+        size = os.path.getsize(path)
+        tracemalloc.start()
+        try:
+            count = sum(1 for _ in PolicyStream(path, chunk_size=4096))
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(count, len(policies))
+        self.assertLess(peak, size // 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
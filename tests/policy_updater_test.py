@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+
+import base64
+import collections
+import email.utils
+import hashlib
+import http.server
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+
+ROOT_DIR, _ = os.path.split(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "tools"))
+
+from PolicyDelta import dump, make_delta, sha256
+from PolicyUpdater import DELTA, FULL, UNCHANGED, VERIFY_SCRIPT, \
+    PolicyUpdater as Updater, UpdateError
+
+POLICY_FILE = os.path.join(ROOT_DIR, "policy.json")
+PINNED_FINGERPRINT = "B693F33372E965D76D55368616EEA65D03326C9D"
+
+
+class PolicyServer(http.server.ThreadingHTTPServer):
+    """Serve {path: bytes} with ETags and Last-Modified, logging requests."""
+
+    def __init__(self):
+        self.files = {}
+        self.modified = {}
+        self.requests = []
+        http.server.ThreadingHTTPServer.__init__(
+            self, ("127.0.0.1", 0), PolicyRequestHandler)
+
+    def publish(self, path, data, modified):
+        self.files[path] = data
+        self.modified[path] = modified
+
+
+class PolicyRequestHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        data = self.server.files.get(self.path)
+        if data is None:
+            return self.reply(404)
+        if isinstance(data, int):
+            return self.reply(data)
+        etag = '"%s"' % hashlib.sha256(data).hexdigest()[:16]
+        modified = email.utils.formatdate(self.server.modified[self.path],
+                                          usegmt=True)
+        if self.headers.get("If-None-Match") == etag:
+            return self.reply(304)
+        self.reply(200, data, {"ETag": etag, "Last-Modified": modified})
+
+    def reply(self, status, data=b"", headers={}):
+        self.server.requests.append((self.path, status))
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@unittest.skipUnless(shutil.which("gpg") and shutil.which("gpgv"),
+                     "needs gpg and gpgv")
+class TestPolicyUpdater(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.gnupg_home = tempfile.mkdtemp()
+        # Old enough to sign lists with 2020 timestamps.
+        cls.gpg("--faked-system-time", "1500000000!", "--quick-gen-key", "Test Signer <signer@example.com>",
+                "ed25519", "sign", "never")
+        listing = cls.gpg("--with-colons", "--list-keys").decode()
+        cls.fingerprint = [line.split(":")[9] for line in listing.split("\n")
+                           if line.startswith("fpr:")][0]
+        # A copy of verify.sh with the test key pinned instead.
+        with open(VERIFY_SCRIPT) as f:
+            script = f.read()
+        key = base64.encodebytes(cls.gpg("--export", cls.fingerprint))
+        script = re.sub(r"(?s)(<<EOF\n).*?(\nEOF\n)",
+                        lambda m: m.group(1) + key.decode().rstrip("\n") +
+                        m.group(2), script)
+        script = script.replace(PINNED_FINGERPRINT, cls.fingerprint)
+        cls.verify_script = os.path.join(cls.gnupg_home, "verify.sh")
+        with open(cls.verify_script, "w") as f:
+            f.write(script)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.gnupg_home)
+
+    @classmethod
+    def gpg(cls, *args, **kwargs):
+        return subprocess.check_output(
+            ["gpg", "--batch", "--quiet", "--homedir", cls.gnupg_home,
+             "--passphrase", "", "--pinentry-mode", "loopback"] +
+            list(args), stderr=subprocess.DEVNULL, **kwargs)
+
+    def sign(self, data, when):
+        return self.gpg("--faked-system-time", "%d!" % when, "--armor",
+                        "--detach-sign", "-u", self.fingerprint,
+                        input=data)
+
+    def setUp(self):
+        self.local_dir = tempfile.mkdtemp()
+        self.server = PolicyServer()
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.updater = Updater(
+            self.local_dir, "http://127.0.0.1:%d/" % self.server.server_port,
+            self.verify_script)
+        with open(POLICY_FILE, "rb") as f:
+            self.v1 = f.read()
+        policy_list = json.loads(self.v1.decode("utf-8"),
+                                 object_pairs_hook=collections.OrderedDict)
+        policy_list["timestamp"] = "2020-05-21T10:25:12.710034-07:00"
+        del policy_list["policies"]["eff.org"]
+        policy_list["policies"]["new.example"] = {"policy-alias": "google"}
+        self.v2 = dump(policy_list)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.local_dir)
+
+    def publish(self, policy, when, delta_from=None):
+        self.server.publish("/policy.json", policy, when)
+        self.server.publish("/policy.json.asc", self.sign(policy, when), when)
+        if delta_from is not None:
+            self.server.publish(
+                "/deltas/%s.json" % sha256(delta_from),
+                json.dumps(make_delta(delta_from, policy)).encode(), when)
+
+    def installed(self):
+        with open(os.path.join(self.local_dir, "policy.json"), "rb") as f:
+            return f.read()
+
+    def requests(self):
+        requests, self.server.requests[:] = list(self.server.requests), []
+        return requests
+
+    def test_full_then_unchanged(self):
+        self.publish(self.v1, 1590000000)
+        self.assertEqual(self.updater.update(), FULL)
+        self.assertEqual(self.installed(), self.v1)
+        self.assertEqual(self.requests(), [
+            ("/policy.json.asc", 200), ("/policy.json", 200)])
+        self.assertEqual(self.updater.update(), UNCHANGED)
+        self.assertEqual(self.requests(), [("/policy.json.asc", 304)])
+
+    def test_delta(self):
+        self.publish(self.v1, 1590000000)
+        self.updater.update()
+        self.requests()
+        self.publish(self.v2, 1590100000, delta_from=self.v1)
+        self.assertEqual(self.updater.update(), DELTA)
+        self.assertEqual(self.installed(), self.v2)
+        self.assertEqual(self.requests(), [
+            ("/policy.json.asc", 200),
+            ("/deltas/%s.json" % sha256(self.v1), 200)])
+        self.assertEqual(self.updater.update(), UNCHANGED)
+
+    def test_full_fallback(self):
+        self.publish(self.v1, 1590000000)
+        self.updater.update()
+        # No delta for what's installed.
+        self.publish(self.v2, 1590100000)
+        self.assertEqual(self.updater.update(), FULL)
+        self.assertEqual(self.installed(), self.v2)
+
+        # A delta that rebuilds something other than what was signed.
+        v3 = self.v2.replace(b"2020-05-21", b"2020-05-22")
+        self.publish(v3, 1590200000, delta_from=self.v2)
+        self.publish(v3.replace(b"2020-05-22", b"2020-05-23"), 1590300000)
+        self.requests()
+        self.assertEqual(self.updater.update(), FULL)
+        self.assertEqual(self.requests(), [
+            ("/policy.json.asc", 200),
+            ("/deltas/%s.json" % sha256(self.v2), 200),
+            ("/policy.json", 200)])
+
+    def test_delta_server_error(self):
+        self.publish(self.v1, 1590000000)
+        self.updater.update()
+        self.publish(self.v2, 1590100000)
+        self.server.publish("/deltas/%s.json" % sha256(self.v1), 500,
+                            1590100000)
+        self.requests()
+        with self.assertLogs("PolicyUpdater", "WARNING"):
+            self.assertEqual(self.updater.update(), FULL)
+        self.assertEqual(self.installed(), self.v2)
+        self.assertEqual(self.requests(), [
+            ("/policy.json.asc", 200),
+            ("/deltas/%s.json" % sha256(self.v1), 500),
+            ("/policy.json", 200)])
+
+    def test_resigned(self):
+        self.publish(self.v1, 1590000000)
+        self.updater.update()
+        self.server.publish("/policy.json.asc",
+                            self.sign(self.v1, 1590100000), 1590100000)
+        self.requests()
+        self.assertEqual(self.updater.update(), FULL)
+        self.assertEqual(self.requests(), [
+            ("/policy.json.asc", 200), ("/deltas/%s.json" % sha256(self.v1),
+                                        404),
+            ("/policy.json", 304)])
+
+    def test_rollback(self):
+        self.publish(self.v2, 1590100000)
+        self.updater.update()
+        self.publish(self.v1, 1590000000)
+        with self.assertRaises(UpdateError):
+            self.updater.update()
+        self.assertEqual(self.installed(), self.v2)
+
+    def state(self):
+        with open(os.path.join(self.local_dir, "update-state.json")) as f:
+            return json.load(f)
+
+    def set_state(self, state):
+        with open(os.path.join(self.local_dir, "update-state.json"),
+                  "w") as f:
+            json.dump(state, f)
+
+    def test_verified_record(self):
+        self.publish(self.v1, 1590000000)
+        self.updater.update()
+        with open(os.path.join(self.local_dir, "policy.json.asc"), "rb") as f:
+            signature = f.read()
+        self.assertEqual(self.state()["verified"], {
+            "sha256": sha256(self.v1), "sig_sha256": sha256(signature),
+            "sig_epoch": 1590000000, "fingerprint": self.fingerprint})
+
+        # The recorded date stands in for checking the installed list again:
+        # claim it was signed later than the update, and it's a rollback.
+        state = self.state()
+        state["verified"]["sig_epoch"] = 1600000000
+        self.set_state(state)
+        self.publish(self.v2, 1590100000, delta_from=self.v1)
+        with self.assertRaises(UpdateError):
+            self.updater.update()
+
+        # A record that doesn't match the installed files is ignored.
+        state["verified"]["sha256"] = sha256(b"something else")
+        self.set_state(state)
+        self.assertEqual(self.updater.update(), DELTA)
+        self.assertEqual(self.state()["verified"]["sig_epoch"], 1590100000)
+
+    def test_bad_signature(self):
+        self.publish(self.v1, 1590000000)
+        self.server.publish("/policy.json", self.v2, 1590000000)
+        with self.assertRaises(UpdateError):
+            self.updater.update()
+        self.assertFalse(os.path.exists(os.path.join(self.local_dir,
+                                                     "policy.json")))
+
+
+class TestVerify(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_no_status(self):
+        # A verify.sh that succeeds without writing the gpgv status.
+        script = os.path.join(self.tmp_dir, "verify.sh")
+        with open(script, "w") as f:
+            f.write("exit 0\n")
+        updater = Updater(self.tmp_dir, verify_script=script)
+        with self.assertLogs("PolicyUpdater", "WARNING"):
+            self.assertIsNone(updater.verify(b"{}", b"signature"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Benchmark PolicyValidator against jsonschema.validate().
+
+For each size, builds a synthetic policy list (see
+policy_index_benchmark.py), then times a full check with PolicyValidator, a
+check of only what changed after 1% of the domains were edited, and, up to
+--jsonschema-max domains, jsonschema.validate() on the same list:
+
+  python tests/policy_validator_benchmark.py --sizes 10000,100000,1000000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR, _ = os.path.split(TESTS_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, "tools"))
+sys.path.insert(0, TESTS_DIR)
+
+import jsonschema
+
+from PolicyValidator import SCHEMA_FILE, PolicyValidator
+from policy_index_benchmark import make_policy_list
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, round(time.perf_counter() - start, 3)
+
+
+def bench(size, jsonschema_max):
+    old = make_policy_list(size)
+    old["timestamp"] = "2020-05-20T10:25:12+00:00"
+    old["expires"] = "2020-06-03T10:25:12+00:00"
+    validator, setup_seconds = timed(PolicyValidator)
+    problems, full_seconds = timed(validator.validate, old)
+    assert not problems, problems[:5]
+
+    new = dict(old, policies=dict(old["policies"]))
+    for i in range(0, size, 100):
+        new["policies"]["d%d.example" % i] = {
+            "mode": "enforce", "mxs": ["mx.d%d.example" % i]}
+    problems, incremental_seconds = timed(
+        lambda: list(validator.iter_changed_problems(old, new)))
+    assert not problems, problems[:5]
+
+    result = {
+        "policies": size,
+        "setup_seconds": setup_seconds,
+        "full_seconds": full_seconds,
+        "changed": len(range(0, size, 100)),
+        "incremental_seconds": incremental_seconds,
+        "jsonschema_seconds": None,
+    }
+    if size <= jsonschema_max:
+        with open(SCHEMA_FILE) as f:
+            schema = json.load(f)
+        _, result["jsonschema_seconds"] = timed(jsonschema.validate, old,
+                                                schema)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", default="10000,100000,1000000",
+                        help="comma-separated list sizes (default: "
+                        "%(default)s)")
+    parser.add_argument("--jsonschema-max", type=int, default=100000,
+                        help="largest list to time jsonschema on (default: "
+                        "%(default)s)")
+    args = parser.parse_args(argv)
+    results = [bench(int(size), args.jsonschema_max)
+               for size in args.sizes.split(",")]
+    print(json.dumps(results, indent=2))
+    return results
+
+
+if __name__ == '__main__':
+    main()
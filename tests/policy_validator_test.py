@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+import copy
+import json
+import os
+import sys
+import unittest
+
+ROOT_DIR, _ = os.path.split(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "tools"))
+
+from PolicyValidator import ERROR, WARNING, PolicyValidator, Problem, pointer
+
+POLICY_FILE = os.path.join(ROOT_DIR, "policy.json")
+
+POLICY_LIST = {
+    "version": "0.1",
+    "timestamp": "2020-05-20T10:25:12+00:00",
+    "expires": "2020-06-03T10:25:12+00:00",
+    "policy-aliases": {
+        "hosted": {"mode": "enforce", "mxs": [".mx.hosted.example"]},
+    },
+    "policies": {
+        "example.com": {"mode": "enforce", "mxs": ["mx1.example.com"]},
+        "customer.example": {"policy-alias": "hosted"},
+    },
+}
+
+
+class TestPolicyValidator(unittest.TestCase):
+    def setUp(self):
+        self.validator = PolicyValidator()
+        self.policy_list = copy.deepcopy(POLICY_LIST)
+
+    def paths(self, problems):
+        return sorted((problem.path, problem.severity) for problem in problems)
+
+    def test_policy_json(self):
+        with open(POLICY_FILE) as f:
+            policy_list = json.load(f)
+        self.assertEqual(self.validator.errors(policy_list), [])
+
+    def test_valid(self):
+        self.assertEqual(self.validator.validate(self.policy_list), [])
+
+    def test_every_error_reported(self):
+        policies = self.policy_list["policies"]
+        policies["bad.example"] = {"mode": "strict", "mxs": []}
+        policies["no_underscores.example"] = {"mode": "testing",
+                                              "mxs": ["mx.example"]}
+        policies["dangling.example"] = {"policy-alias": "nowhere"}
+        policies["mixed.example"] = {"policy-alias": "hosted",
+                                     "mode": "testing"}
+        policies["EXAMPLE.com"] = {"mode": "testing", "mxs": ["mx.example"]}
+        policies["badmx.example"] = {"mode": "testing",
+                                     "mxs": ["mx.example", "not a host"]}
+        self.policy_list["expires"] = self.policy_list["timestamp"]
+        del self.policy_list["version"]
+        problems = self.validator.validate(self.policy_list)
+        self.assertEqual(self.paths(problems), [
+            ("", ERROR),
+            ("/expires", ERROR),
+            ("/policies/EXAMPLE.com", ERROR),
+            ("/policies/bad.example/mode", ERROR),
+            ("/policies/bad.example/mxs", ERROR),
+            ("/policies/badmx.example/mxs/1", ERROR),
+            ("/policies/dangling.example/policy-alias", ERROR),
+            ("/policies/example.com", ERROR),
+            ("/policies/mixed.example", ERROR),
+            ("/policies/no_underscores.example", ERROR),
+        ])
+        self.assertIn("'version' is a required property",
+                      [problem.message for problem in problems])
+
+    def test_fractional_seconds(self):
+        self.policy_list["timestamp"] = "2020-05-20T10:25:12.1Z"
+        self.policy_list["expires"] = "2020-05-20T10:25:12.12345Z"
+        self.assertEqual(self.validator.validate(self.policy_list), [])
+        self.policy_list["expires"] = "2020-05-20T10:25:12.09Z"
+        self.assertEqual(self.paths(self.validator.validate(self.policy_list)),
+                         [("/expires", ERROR)])
+
+    def test_mxs_warnings(self):
+        self.policy_list["policy-aliases"]["hosted"]["mxs"] = [
+            ".hosted.example", "mx.hosted.example", ".mx.hosted.example",
+            "MX.other.example", "mx.other.example"]
+        problems = self.validator.validate(self.policy_list)
+        self.assertEqual(self.paths(problems), [
+            ("/policy-aliases/hosted/mxs/1", WARNING),
+            ("/policy-aliases/hosted/mxs/2", WARNING),
+            ("/policy-aliases/hosted/mxs/4", WARNING),
+        ])
+        self.assertEqual(self.validator.errors(self.policy_list), [])
+
+    def test_changes(self):
+        new = copy.deepcopy(self.policy_list)
+        new["policies"]["example.com"]["mxs"] = ["not a host"]
+        new["policies"]["new.example"] = {"policy-alias": "hosted"}
+        new["policy-aliases"]["other"] = {"mode": "testing",
+                                          "mxs": [".other.example"]}
+        self.assertEqual(self.validator.changes(self.policy_list, new),
+                         (["example.com", "new.example"], ["other"]))
+        self.assertEqual(
+            self.paths(self.validator.iter_changed_problems(self.policy_list,
+                                                            new)),
+            [("/policies/example.com/mxs/0", ERROR)])
+
+        # Dropping an alias rechecks the domains still using it.
+        old = new
+        new = copy.deepcopy(old)
+        del new["policy-aliases"]["hosted"]
+        self.assertEqual(self.validator.changes(old, new)[0],
+                         ["customer.example", "new.example"])
+        self.assertEqual(
+            self.paths(self.validator.iter_changed_problems(old, new)),
+            [("/policies/customer.example/policy-alias", ERROR),
+             ("/policies/new.example/policy-alias", ERROR)])
+
+    def test_not_an_object(self):
+        self.assertEqual(self.validator.validate([]),
+                         [Problem("", "[] is not of type 'object'", ERROR)])
+        self.policy_list["policies"] = []
+        self.assertEqual(self.paths(self.validator.validate(self.policy_list)),
+                         [("/policies", ERROR)])
+
+    def test_pointer(self):
+        self.assertEqual(pointer("policies", "a/b~c", "mxs", 0),
+                         "/policies/a~1b~0c/mxs/0")
+
+
+if __name__ == '__main__':
+    unittest.main()
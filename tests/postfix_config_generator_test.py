@@ -0,0 +1,371 @@
+#!/usr/bin/env python
+
+import io
+import json
+import logging
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import unittest
+
+ROOT_DIR, _ = os.path.split(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "tools"))
+
+from CABundle import CABundle
+from Cdb import Cdb
+from PolicyIndex import PolicyError
+import PostfixConfigGenerator as pcg
+from testcerts import make_cert, pem
+
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.StreamHandler())
+
+
+# Fake Postfix Configs
+names_only_config = """myhostname = mail.fubard.org
+mydomain = fubard.org
+myorigin = fubard.org"""
+
+
+certs_only_config = (
+"""smtpd_tls_cert_file = /etc/letsencrypt/live/www.fubard.org/fullchain.pem
+smtpd_tls_key_file = /etc/letsencrypt/live/www.fubard.org/privkey.pem""")
+
+
+def GetFakeOpen(fake_file_contents):
+    fake_file = io.StringIO()
+    # cast this to unicode for py2
+    fake_file.write(fake_file_contents)
+    fake_file.seek(0)
+
+    def FakeOpen(_):
+        return fake_file
+
+    return FakeOpen
+
+
+class TestPostfixConfigGenerator(unittest.TestCase):
+
+    def setUp(self):
+        self.fopen_names_only_config = GetFakeOpen(names_only_config)
+        self.fopen_certs_only_config = GetFakeOpen(certs_only_config)
+        self.fopen_no_certs_only_config = self.fopen_names_only_config
+
+        self.config = None
+        self.postfix_dir = 'tests/'
+
+    def tearDown(self):
+        pass
+
+    def testGetAllNames(self):
+        sorted_names = ['fubard.org', 'mail.fubard.org']
+        postfix_config_gen = pcg.PostfixConfigGenerator(
+            self.config,
+            self.postfix_dir,
+            fixup=True,
+            fopen=self.fopen_names_only_config
+        )
+        self.assertEqual(sorted_names, postfix_config_gen.get_all_names())
+
+    def testGetAllCertAndKeys(self):
+        return_vals = [('/etc/letsencrypt/live/www.fubard.org/fullchain.pem',
+                        '/etc/letsencrypt/live/www.fubard.org/privkey.pem',
+                        'tests/main.cf'),]
+        postfix_config_gen = pcg.PostfixConfigGenerator(
+            self.config,
+            self.postfix_dir,
+            fixup=True,
+            fopen=self.fopen_certs_only_config
+        )
+        self.assertEqual(return_vals, postfix_config_gen.get_all_certs_keys())
+
+    def testGetAllCertsAndKeys_With_None(self):
+        postfix_config_gen = pcg.PostfixConfigGenerator(
+            self.config,
+            self.postfix_dir,
+            fixup=True,
+            fopen=self.fopen_no_certs_only_config
+        )
+        self.assertEqual([], postfix_config_gen.get_all_certs_keys())
+
+    def testEnsureCfVar(self):
+        config = (names_only_config + "\n"
+                  "smtp_tls_protocols_extra = !SSLv2\n"
+                  "smtp_tls_loglevel = 2\n"
+                  "smtp_tls_security_level = encrypt\n")
+        generator = pcg.PostfixConfigGenerator(
+            self.config, self.postfix_dir, fopen=GetFakeOpen(config))
+        # A longer name with the same prefix is a different parameter.
+        generator.ensure_cf_var("smtp_tls_protocols", "!SSLv2, !SSLv3", [])
+        generator.ensure_cf_var("smtp_tls_security_level", "may",
+                                ["encrypt", "dane"])
+        self.assertEqual(generator.cf.edits,
+                         [("smtp_tls_protocols", "!SSLv2, !SSLv3")])
+        self.assertRaises(pcg.ExistingConfigError, generator.ensure_cf_var,
+                          "smtp_tls_loglevel", "1", [])
+
+        generator = pcg.PostfixConfigGenerator(
+            self.config, self.postfix_dir, fixup=True,
+            fopen=GetFakeOpen(config + "smtp_tls_loglevel = 0\n"))
+        generator.ensure_cf_var("smtp_tls_loglevel", "1", [])
+        self.assertEqual(generator.cf.edits, [("smtp_tls_loglevel", "1")])
+        lines = generator.cf.text().splitlines()
+        self.assertEqual(lines.count("smtp_tls_loglevel = 1"), 1)
+        self.assertIn("# smtp_tls_loglevel = 2", lines)
+        self.assertIn("# smtp_tls_loglevel = 0", lines)
+
+
+POLICY_LIST = {
+    "version": "0.1",
+    "timestamp": "2020-05-20T10:25:12+00:00",
+    "expires": "2020-06-03T10:25:12+00:00",
+    "policy-aliases": {
+        "hosted": {"mode": "enforce", "mxs": [".mx.hosted.example"]},
+    },
+    "policies": {
+        "Example.COM": {"mode": "enforce",
+                        "mxs": ["mx1.example.com", "mx2.example.com"]},
+        "customer.example": {"policy-alias": "hosted"},
+        "testing.example": {"mode": "testing", "mxs": ["mx.testing.example"]},
+    },
+}
+
+
+class TestPolicyMap(unittest.TestCase):
+    def setUp(self):
+        self.postfix_dir = tempfile.mkdtemp()
+        self.policy_file = os.path.join(self.postfix_dir, "policy.json")
+        self.write_policy(POLICY_LIST)
+        self.generator = pcg.PostfixConfigGenerator(
+            self.policy_file, self.postfix_dir,
+            fopen=GetFakeOpen(names_only_config))
+
+    def tearDown(self):
+        shutil.rmtree(self.postfix_dir)
+
+    def write_policy(self, policy_list):
+        with open(self.policy_file, "w") as f:
+            json.dump(policy_list, f, indent=2)
+
+    def test_policy_map(self):
+        self.assertTrue(self.generator.set_domainwise_tls_policies())
+        self.assertEqual(self.generator.policy_map, os.path.join(
+            self.postfix_dir, "starttls_everywhere_policy.cdb"))
+        with Cdb(self.generator.policy_map) as cdb:
+            self.assertEqual(dict(cdb), {
+                b"example.com":
+                b"secure match=mx1.example.com:mx2.example.com",
+                b"customer.example": b"secure match=.mx.hosted.example",
+            })
+            self.assertIsNone(cdb.get(b"testing.example"))
+
+    def test_unchanged_policy_skipped(self):
+        self.assertTrue(self.generator.set_domainwise_tls_policies())
+        stat = os.stat(self.generator.policy_map)
+        self.assertFalse(self.generator.set_domainwise_tls_policies())
+        self.assertEqual(os.stat(self.generator.policy_map).st_ino,
+                         stat.st_ino)
+
+        policy_list = json.loads(json.dumps(POLICY_LIST))
+        del policy_list["policies"]["customer.example"]
+        self.write_policy(policy_list)
+        self.assertTrue(self.generator.set_domainwise_tls_policies())
+        with Cdb(self.generator.policy_map) as cdb:
+            self.assertIsNone(cdb.get(b"customer.example"))
+
+        # A missing table is rebuilt, even from the same list.
+        os.unlink(self.generator.policy_map)
+        self.assertTrue(self.generator.set_domainwise_tls_policies())
+
+    def test_invalid_policy_keeps_map(self):
+        self.generator.set_domainwise_tls_policies()
+        with open(self.generator.policy_stamp) as f:
+            stamp = f.read()
+        policy_list = json.loads(json.dumps(POLICY_LIST))
+        policy_list["policies"]["dangling.example"] = {"policy-alias": "x"}
+        self.write_policy(policy_list)
+        self.assertRaises(PolicyError,
+                          self.generator.set_domainwise_tls_policies)
+        with Cdb(self.generator.policy_map) as cdb:
+            self.assertIsNotNone(cdb.get(b"customer.example"))
+        # The stamp still vouches for the map in place.
+        with open(self.generator.policy_stamp) as f:
+            self.assertEqual(f.read(), stamp)
+        self.assertEqual(sorted(os.listdir(self.postfix_dir)),
+                         ["policy.json", "starttls_everywhere_policy.cdb",
+                          "starttls_everywhere_policy.sha256"])
+
+
+class TestCheckpoints(unittest.TestCase):
+    def setUp(self):
+        self.postfix_dir = tempfile.mkdtemp()
+        self.policy_file = os.path.join(self.postfix_dir, "policy.json")
+        self.write_policy(POLICY_LIST)
+        with open(os.path.join(self.postfix_dir, "main.cf"), "w") as f:
+            f.write(names_only_config + "\n")
+        root = os.path.join(self.postfix_dir, "root.crt")
+        with open(root, "wb") as f:
+            f.write(pem(make_cert("Root", ca=True)[0]))
+        self.ca_bundle = CABundle([root])
+
+    def tearDown(self):
+        shutil.rmtree(self.postfix_dir)
+
+    def write_policy(self, policy_list):
+        with open(self.policy_file, "w") as f:
+            json.dump(policy_list, f, indent=2)
+
+    def configure(self, title=None):
+        with open(os.path.join(self.postfix_dir, "main.cf")) as f:
+            generator = pcg.PostfixConfigGenerator(
+                self.policy_file, self.postfix_dir, fixup=True,
+                fopen=lambda _: f, version=(3, 4, 13),
+                ca_bundle=self.ca_bundle)
+        generator.deploy_cert("example.com", "cert.pem", "privkey.pem",
+                              "chain.pem", "fullchain.pem")
+        generator.save(title)
+        return generator
+
+    def test_main_cf_replaced(self):
+        main_cf = os.path.join(self.postfix_dir, "main.cf")
+        os.chmod(main_cf, 0o640)
+        inode = os.stat(main_cf).st_ino
+        self.configure()
+        # Renamed into place, not rewritten, and with its mode kept.
+        self.assertNotEqual(os.stat(main_cf).st_ino, inode)
+        self.assertEqual(stat.S_IMODE(os.stat(main_cf).st_mode), 0o640)
+        with open(main_cf) as f:
+            self.assertIn("smtp_tls_loglevel = 1\n", f.read())
+
+    def test_checkpoints(self):
+        generator = self.configure("first")
+        self.assertTrue(generator.changed)
+        with open(generator.fn) as f:
+            configured = f.read()
+
+        # Nothing to do, so nothing to reload.
+        generator = self.configure("again")
+        self.assertFalse(generator.changed)
+        self.assertFalse(generator.restart())
+        self.assertEqual(len(generator.checkpoints.checkpoints()), 1)
+
+        # Rewriting main.cf without changing a setting isn't a change.
+        with open(generator.fn, "a") as f:
+            f.write("# a comment\n")
+        generator = self.configure("comment")
+        self.assertFalse(generator.changed)
+
+        policy_list = json.loads(json.dumps(POLICY_LIST))
+        del policy_list["policies"]["customer.example"]
+        self.write_policy(policy_list)
+        generator = self.configure("update")
+        self.assertTrue(generator.changed)
+        self.assertTrue(generator.policy_changed)
+        self.assertFalse(generator.ca_changed)
+
+        generator.changed = False
+        generator.rollback_checkpoints(1)
+        self.assertTrue(generator.changed)
+        with Cdb(generator.policy_map) as cdb:
+            self.assertIsNotNone(cdb.get(b"customer.example"))
+        # The map is rebuilt for the new list on the next run.
+        generator = self.configure("update again")
+        self.assertTrue(generator.policy_changed)
+
+        self.assertEqual([c["title"] for c in
+                          generator.checkpoints.checkpoints()],
+                         ["first", "update again"])
+        generator.rollback_checkpoints(2)
+        with open(generator.fn) as f:
+            self.assertEqual(f.read(), names_only_config + "\n")
+        for path in (generator.policy_map, generator.ca_file):
+            self.assertFalse(os.path.exists(path))
+        self.assertRaises(Exception, generator.rollback_checkpoints, 1)
+        self.assertNotEqual(configured, names_only_config + "\n")
+
+
+class TestFleet(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.policy_file = os.path.join(self.tmp_dir, "policy.json")
+        with open(self.policy_file, "w") as f:
+            json.dump(POLICY_LIST, f)
+        # A postconf that counts how often it is run.
+        self.postconf = os.path.join(self.tmp_dir, "postconf")
+        self.calls = os.path.join(self.tmp_dir, "postconf.calls")
+        with open(self.postconf, "w") as f:
+            f.write("#!/bin/sh\necho run >> %s\n"
+                    "echo 'mail_version = 3.4.13'\n" % self.calls)
+        os.chmod(self.postconf, 0o755)
+        self.postfix_dirs = []
+        for i in range(8):
+            postfix_dir = os.path.join(self.tmp_dir, "postfix-%d" % i)
+            os.mkdir(postfix_dir)
+            with open(os.path.join(postfix_dir, "main.cf"), "w") as f:
+                f.write(names_only_config + "\nsmtp_tls_loglevel = %d\n" % i)
+            self.postfix_dirs.append(postfix_dir)
+        self.cert_paths = ["/etc/letsencrypt/live/example.com/" + name
+                           for name in ("cert.pem", "privkey.pem",
+                                        "chain.pem", "fullchain.pem")]
+        root = os.path.join(self.tmp_dir, "root.crt")
+        with open(root, "wb") as f:
+            f.write(pem(make_cert("Root", ca=True)[0]))
+        self.ca_bundle = CABundle([root])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_fleet(self):
+        missing = os.path.join(self.tmp_dir, "missing")
+        results = pcg.configure_fleet(
+            self.policy_file, self.postfix_dirs + [missing], self.cert_paths,
+            workers=4, postconf=self.postconf, reload=False,
+            ca_bundle=self.ca_bundle)
+        self.assertEqual([result.postfix_dir for result in results],
+                         self.postfix_dirs + [missing])
+        for result in results[:-1]:
+            self.assertIsNone(result.error)
+            self.assertTrue(result.policy_changed)
+            self.assertTrue(result.ca_changed)
+            self.assertGreaterEqual(result.seconds, 0)
+        self.assertIsNotNone(results[-1].error)
+        with open(self.calls) as f:
+            self.assertEqual(len(f.readlines()), 1)
+
+        with open(os.path.join(self.postfix_dirs[0],
+                               "starttls_everywhere_policy.cdb"), "rb") as f:
+            table = f.read()
+        for postfix_dir in self.postfix_dirs:
+            with open(os.path.join(postfix_dir,
+                                   "starttls_everywhere_policy.cdb"),
+                      "rb") as f:
+                self.assertEqual(f.read(), table)
+            with open(os.path.join(postfix_dir, "main.cf")) as f:
+                lines = f.read().splitlines()
+            self.assertIn("smtp_tls_loglevel = 1", lines)
+            self.assertIn("smtp_tls_policy_maps = cdb:" + os.path.join(
+                postfix_dir, "starttls_everywhere_policy"), lines)
+            with open(os.path.join(postfix_dir,
+                                   "starttls_everywhere_CAfile"), "rb") as f:
+                self.assertEqual(f.read(), self.ca_bundle.data)
+
+        # The same table as streamed for a single instance.
+        with open(os.path.join(self.postfix_dirs[0], "main.cf")) as f:
+            generator = pcg.PostfixConfigGenerator(
+                self.policy_file, self.tmp_dir, fopen=lambda _: f)
+        generator.set_domainwise_tls_policies()
+        with open(generator.policy_map, "rb") as f:
+            self.assertEqual(f.read(), table)
+
+        results = pcg.configure_fleet(
+            self.policy_file, self.postfix_dirs, self.cert_paths,
+            postconf=self.postconf, reload=False, ca_bundle=self.ca_bundle)
+        self.assertFalse(any(result.error or result.policy_changed or
+                             result.ca_changed for result in results))
+
+
+if __name__ == '__main__':
+    unittest.main()
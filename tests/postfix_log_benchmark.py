@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Throughput of PostfixLogSummary on a synthetic mail log.
+
+Writes a log of --lines lines, mostly the queue manager, cleanup and smtpd
+chatter a busy relay logs, with a TLS connection established for every
+tenth line and a TLS-related deferral for every two hundredth, then reports
+the lines per second of the parser, and of a baseline that, as the parser
+used to, parses every line's timestamp and runs both patterns on it:
+
+  python tests/postfix_log_benchmark.py --lines 5000000
+
+The policy list has --domains domains, of which the log names a thousand; the
+parser's throughput shouldn't depend on it.
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+
+ROOT_DIR, _ = os.path.split(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "tools"))
+
+from PolicyIndex import PolicyIndex
+from PostfixLogSummary import TIME_FORMAT, get_counts
+
+LOGGED_DOMAINS = 1000
+
+NOISE = [
+    "postfix/smtpd[%(pid)d]: connect from client%(n)d.example[198.51.100.%(o)d]",
+    "postfix/cleanup[%(pid)d]: %(qid)s: message-id=<%(n)d@sender.example>",
+    "postfix/qmgr[%(pid)d]: %(qid)s: from=<u%(n)d@sender.example>, size=%(n)d,"
+    " nrcpt=1 (queue active)",
+    "postfix/smtp[%(pid)d]: %(qid)s: to=<u@d%(d)d.example>,"
+    " relay=mx.d%(d)d.example[192.0.2.%(o)d]:25, delay=0.5,"
+    " delays=0.1/0/0.2/0.2, dsn=2.0.0, status=sent (250 2.0.0 Ok)",
+    "postfix/qmgr[%(pid)d]: %(qid)s: removed",
+    "postfix/smtpd[%(pid)d]: disconnect from client%(n)d.example"
+    "[198.51.100.%(o)d]",
+]
+CONNECTED = ("postfix/smtp[%(pid)d]: Trusted TLS connection established to"
+             " mx.d%(d)d.example[192.0.2.%(o)d]:25: TLSv1.2 with cipher"
+             " ECDHE-RSA-AES256-GCM-SHA384 (256/256 bits)")
+DEFERRED = ("postfix/smtp[%(pid)d]: %(qid)s: to=<u@d%(d)d.example>,"
+            " relay=mx.d%(d)d.example[192.0.2.%(o)d]:25, delay=0.07,"
+            " delays=0.03/0.01/0.03/0, dsn=4.7.4, status=deferred (TLS is"
+            " required, but was not offered by host mx.d%(d)d.example"
+            "[192.0.2.%(o)d])")
+
+# The per-line work PostfixLogSummary used to do.
+TLS_CONNECTED_RE = re.compile(
+    r"([A-Za-z]+) TLS connection established to ([^[]*)")
+DEFERRED_RE = re.compile(r"relay=([^[ ]*).* status=deferred.*TLS")
+
+
+def make_policy_list(domains):
+    return {"version": "0.1", "policies": {
+        "d%d.example" % i: {"mode": "testing", "mxs": ["mx.d%d.example" % i]}
+        for i in range(domains)}}
+
+
+def write_log(path, lines):
+    start = time.mktime(time.strptime("2019 Jun 12 00:00:00",
+                                      "%Y " + TIME_FORMAT))
+    with open(path, "w") as f:
+        for n in range(lines):
+            # About a hundred lines a second.
+            prefix = time.strftime(TIME_FORMAT,
+                                   time.localtime(start + n // 100))
+            fields = {"pid": 1000 + n % 5000, "n": n, "o": n % 250 + 1,
+                      "d": n % LOGGED_DOMAINS, "qid": "%011X" % n}
+            if n % 200 == 0:
+                template = DEFERRED
+            elif n % 10 == 0:
+                template = CONNECTED
+            else:
+                template = NOISE[n % len(NOISE)]
+            f.write("%s sender %s\n" % (prefix, template % fields))
+
+
+def baseline(path):
+    events = 0
+    with open(path) as f:
+        for line in f:
+            time.strptime(line[:15], TIME_FORMAT)
+            if TLS_CONNECTED_RE.search(line) or DEFERRED_RE.search(line):
+                events += 1
+    return events
+
+
+def parser(path, index):
+    with open(path, "rb") as f:
+        counts, tls_deferred, _, _ = get_counts(f, index, None)
+    return (sum(c["all"] for c in counts.values()) +
+            sum(tls_deferred.values()))
+
+
+def measure(function, lines, *args):
+    start = time.perf_counter()
+    events = function(*args)
+    seconds = time.perf_counter() - start
+    return {"events": events, "seconds": round(seconds, 3),
+            "lines_per_second": round(lines / seconds)}
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    arg_parser.add_argument("--lines", type=int, default=2000000)
+    arg_parser.add_argument("--domains", type=int, default=LOGGED_DOMAINS)
+    arg_parser.add_argument("--skip-baseline", action="store_true")
+    args = arg_parser.parse_args(argv)
+
+    index = PolicyIndex(make_policy_list(args.domains))
+    tmpdir = tempfile.mkdtemp()
+    path = os.path.join(tmpdir, "mail.log")
+    try:
+        write_log(path, args.lines)
+        results = {"lines": args.lines, "domains": args.domains,
+                   "megabytes": round(os.path.getsize(path) / 2**20, 1),
+                   "parser": measure(parser, args.lines, path, index)}
+        if not args.skip_baseline:
+            results["baseline"] = measure(baseline, args.lines, path)
+    finally:
+        os.unlink(path)
+        os.rmdir(tmpdir)
+    print(json.dumps(results, indent=2))
+    return results
+
+
+if __name__ == "__main__":
+    main()
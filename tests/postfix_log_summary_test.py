@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+
+import contextlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+ROOT_DIR, _ = os.path.split(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "tools"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import PostfixLogSummary
+from PolicyIndex import PolicyIndex
+from PostfixLogSummary import (CONNECTED, DEFERRED, LogParser, MXDomains,
+                               get_counts)
+import postfix_log_benchmark
+
+POLICY_LIST = {
+    "version": "0.1",
+    "policy-aliases": {
+        "provider": {"mode": "testing", "mxs": [".mx.provider.example"]},
+    },
+    "policies": {
+        "a.example": {"policy-alias": "provider"},
+        "b.example": {"policy-alias": "provider"},
+        "c.example": {"mode": "enforce", "mxs": ["mx.c.example"]},
+    },
+}
+
+LOG = b"""\
+Jun 12 06:24:10 sender postfix/smtpd[9001]: connect from localhost[127.0.0.1]
+Jun 12 06:24:14 sender postfix/smtp[9045]: Untrusted TLS connection established to in1.MX.provider.example[192.0.2.1]:25: TLSv1.2 with cipher ECDHE-RSA-AES256-GCM-SHA384 (256/256 bits)
+Jun 12 06:24:14 sender postfix/smtp[9046]: Verified TLS connection established to mx.c.example[192.0.2.2]:25: TLSv1.2 with cipher ECDHE-RSA-AES256-GCM-SHA384 (256/256 bits)
+Jun 12 06:24:15 sender postfix/smtp[9047]: Verified TLS connection established to in2.mx.provider.example[192.0.2.3]:25: TLSv1.2 with cipher ECDHE-RSA-AES256-GCM-SHA384 (256/256 bits)
+Jun 12 06:24:15 sender postfix/smtp[9048]: Anonymous TLS connection established to mx.unlisted.example[192.0.2.4]:25: TLSv1.2 with cipher ECDHE-RSA-AES256-GCM-SHA384 (256/256 bits)
+Jun 12 06:24:16 sender postfix/smtp[9049]: 62D3F481249: to=<u@c.example>, relay=mx.c.example[192.0.2.2]:25, delay=0.07, delays=0.03/0.01/0.03/0, dsn=4.7.4, status=deferred (TLS is required, but was not offered by host mx.c.example[192.0.2.2])
+Jun 12 06:24:17 sender postfix/smtp[9050]: 62D3F481250: to=<u@d.example>, relay=mx.d.example[192.0.2.5]:25, delay=0.07, delays=0.03/0.01/0.03/0, dsn=4.4.1, status=deferred (connect to mx.d.example[192.0.2.5]:25: Connection refused)
+Jun 12 06:24:18 sender postfix/smtp[9051]: warning: TLS library problem: error:140740BF:SSL routines
+Jun 12 06:24:19 sender postfix/qmgr[9002]: 62D3F481249: removed
+"""
+
+
+def stamp(text):
+    return time.strptime(text, PostfixLogSummary.TIME_FORMAT)
+
+
+class TestLogParser(unittest.TestCase):
+    def test_events(self):
+        parser = LogParser()
+        events = list(parser.events(LOG.splitlines(True)))
+        self.assertEqual([(e.kind, e.mx, e.validation) for e in events], [
+            (CONNECTED, "in1.mx.provider.example", "Untrusted"),
+            (CONNECTED, "mx.c.example", "Verified"),
+            (CONNECTED, "in2.mx.provider.example", "Verified"),
+            (CONNECTED, "mx.unlisted.example", "Anonymous"),
+            (DEFERRED, "mx.c.example", None),
+        ])
+        self.assertEqual(events[0].timestamp, stamp("Jun 12 06:24:14"))
+        self.assertEqual(parser.last_timestamp, stamp("Jun 12 06:24:19"))
+
+    def test_earliest_timestamp(self):
+        parser = LogParser(stamp("Jun 12 06:24:15"))
+        events = list(parser.events(LOG.splitlines(True)))
+        self.assertEqual([e.mx for e in events],
+                         ["in2.mx.provider.example", "mx.unlisted.example",
+                          "mx.c.example"])
+
+    def test_unparsed_timestamps(self):
+        lines = LOG.splitlines(True)
+        bad = [
+            b"2019-06-12T06:24:14.123456+00:00 sender postfix/smtp[9045]: "
+            b"Verified TLS connection established to mx.c.example"
+            b"[192.0.2.2]:25: TLSv1.2\n",
+            b"garbage Verified TLS connection established to mx.c.example"
+            b"[192.0.2.2]:25\n",
+        ]
+        parser = LogParser()
+        events = list(parser.events(lines[:2] + bad + lines[2:]))
+        self.assertEqual([(e.timestamp, e.mx) for e in events[1:3]],
+                         [(None, "mx.c.example"), (None, "mx.c.example")])
+        self.assertEqual(len(events), 7)
+        self.assertEqual(parser.unparsed, 2)
+        self.assertEqual(parser.last_timestamp, stamp("Jun 12 06:24:19"))
+
+        # They can't be compared with an earliest timestamp.
+        parser = LogParser(stamp("Jun 12 06:24:10"))
+        with self.assertLogs("PostfixLogSummary", "WARNING"):
+            events = list(parser.events(lines[:2] + bad + lines[2:]))
+        self.assertEqual(len(events), 5)
+        self.assertEqual(parser.unparsed, 2)
+
+    def test_empty(self):
+        parser = LogParser()
+        self.assertEqual(list(parser.events([])), [])
+        self.assertIsNone(parser.last_timestamp)
+
+    def test_timestamps_memoized(self):
+        PostfixLogSummary.parse_timestamp.cache_clear()
+        list(LogParser().events(LOG.splitlines(True)))
+        info = PostfixLogSummary.parse_timestamp.cache_info()
+        # Five events in three seconds, plus the last line.
+        self.assertEqual(info.misses, 4)
+        self.assertEqual(info.hits, 2)
+
+
+class TestGetCounts(unittest.TestCase):
+    def test_counts(self):
+        index = PolicyIndex.from_json(json.dumps(POLICY_LIST))
+        counts, tls_deferred, seen_trusted, last = get_counts(
+            io.BytesIO(LOG), index, None)
+        self.assertEqual(counts, {
+            "a.example, b.example": {"Untrusted": 1, "Verified": 1, "all": 2},
+            "c.example": {"Verified": 1, "all": 1},
+        })
+        self.assertEqual(tls_deferred, {"mx.c.example": 1})
+        self.assertTrue(seen_trusted)
+        self.assertEqual(last, stamp("Jun 12 06:24:19"))
+
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            PostfixLogSummary.print_summary(counts)
+        self.assertIn("c.example Verified 1.0 of 1\n", out.getvalue())
+        self.assertIn("a.example, b.example Untrusted 0.5 of 2\n",
+                      out.getvalue())
+
+
+class TestMXDomains(unittest.TestCase):
+    def setUp(self):
+        self.index = PolicyIndex.from_json(json.dumps(POLICY_LIST))
+
+    def test_lookup(self):
+        mx_domains = MXDomains(self.index)
+        self.assertEqual(mx_domains.lookup("in1.mx.provider.example"),
+                         "a.example, b.example")
+        self.assertEqual(mx_domains.lookup("mx.c.example"), "c.example")
+        self.assertEqual(mx_domains.lookup("mx.unlisted.example"), "")
+
+    def test_cached(self):
+        mx_domains = MXDomains(self.index, maxsize=2)
+        calls = []
+        domains_for_mx = self.index.domains_for_mx
+        self.index.domains_for_mx = lambda mx: (calls.append(mx) or
+                                                domains_for_mx(mx))
+        for mx in ["mx.c.example", "in1.mx.provider.example",
+                   "mx.c.example", "in2.mx.provider.example",
+                   "in1.mx.provider.example"]:
+            mx_domains.lookup(mx)
+        # The third host pushes out the least recently used one.
+        self.assertEqual(calls, ["mx.c.example", "in1.mx.provider.example",
+                                 "in2.mx.provider.example",
+                                 "in1.mx.provider.example"])
+
+    def test_keys_interned(self):
+        counts, tls_deferred, _, _ = get_counts(io.BytesIO(LOG + LOG),
+                                                self.index, None)
+        a = "".join(["a.example, ", "b.example"])
+        key = next(k for k in counts if k == a)
+        self.assertIs(key, sys.intern(a))
+        self.assertIs(next(iter(tls_deferred)), sys.intern("mx.c.example"))
+
+
+class TestMain(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.policy_file = os.path.join(self.tmpdir, "policy.json")
+        with open(self.policy_file, "w") as f:
+            json.dump(POLICY_LIST, f)
+        self.log = os.path.join(self.tmpdir, "mail.log")
+        self.checkpoint = os.path.join(self.tmpdir, "checkpoint.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def run_main(self, log_lines):
+        with open(self.log, "ab") as f:
+            f.writelines(log_lines)
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            PostfixLogSummary.main([self.policy_file, "--log", self.log,
+                                    "--checkpoint", self.checkpoint])
+        return out.getvalue()
+
+    def test_missing_log(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(PostfixLogSummary.main(
+                [self.policy_file, "-c", "--log", self.log,
+                 "--checkpoint", self.checkpoint]), 0)
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_reads_new_lines_only(self):
+        lines = LOG.splitlines(True)
+        out = self.run_main(lines[:5])
+        self.assertIn("c.example Verified 1.0 of 1\n", out)
+        self.assertNotIn("deferred", out)
+        out = self.run_main(lines[5:])
+        self.assertEqual(out, "No Trusted connections seen! Probably need "
+                         "to install a CAfile.\n"
+                         "Some mail was deferred due to TLS problems:\n"
+                         "mx.c.example: 1\n")
+
+
+class TestPostfixLogBenchmark(unittest.TestCase):
+    def test_benchmark(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = postfix_log_benchmark.main(["--lines", "20000"])
+        self.assertEqual(result["lines"], 20000)
+        self.assertEqual(result["parser"]["events"],
+                         result["baseline"]["events"])
+        self.assertGreater(result["parser"]["events"], 0)
+        self.assertGreater(result["parser"]["lines_per_second"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
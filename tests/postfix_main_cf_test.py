@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import unittest
+
+ROOT_DIR, _ = os.path.split(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "tools"))
+
+from PostfixMainCF import MainCF, Parameter
+
+MAIN_CF = """\
+# See /usr/share/postfix/main.cf.dist for a commented, more complete version
+smtpd_banner = $myhostname ESMTP $mail_name
+myhostname=mail.example.com
+
+smtp_tls_protocols_extra = yes
+smtp_tls_protocols = !SSLv2,
+    # a comment inside a continued line
+    !SSLv3
+  mydestination = continues smtp_tls_protocols
+smtp_tls_loglevel = 0
+not a parameter
+smtp_tls_loglevel = 2"""
+
+
+class TestMainCF(unittest.TestCase):
+    def setUp(self):
+        self.cf = MainCF(MAIN_CF.splitlines(True))
+
+    def test_parse(self):
+        self.assertEqual(self.cf.get("myhostname"), "mail.example.com")
+        self.assertEqual(self.cf.get("smtp_tls_protocols"),
+                         "!SSLv2, !SSLv3 mydestination = continues "
+                         "smtp_tls_protocols")
+        self.assertEqual(self.cf.get("smtp_tls_protocols_extra"), "yes")
+        self.assertNotIn("mydestination", self.cf)
+        self.assertNotIn("smtp_tls", self.cf)
+        self.assertIsNone(self.cf.get("missing"))
+        # The last setting counts.
+        self.assertEqual(self.cf.get("smtp_tls_loglevel"), "2")
+        self.assertEqual(self.cf.occurrences("smtp_tls_loglevel"), [
+            Parameter("smtp_tls_loglevel", "0", 9, 9),
+            Parameter("smtp_tls_loglevel", "2", 11, 11)])
+        self.assertEqual(self.cf.occurrences("smtp_tls_protocols"),
+                         [Parameter("smtp_tls_protocols", self.cf.get(
+                             "smtp_tls_protocols"), 5, 8)])
+        self.assertEqual([name for name, _ in self.cf.items()],
+                         ["smtpd_banner", "myhostname",
+                          "smtp_tls_protocols_extra", "smtp_tls_protocols",
+                          "smtp_tls_loglevel", "smtp_tls_loglevel"])
+
+    def test_unedited(self):
+        self.assertEqual(self.cf.edits, [])
+        self.assertEqual(self.cf.text(), MAIN_CF)
+
+    def test_edits(self):
+        self.cf.set("smtp_tls_protocols", "!SSLv2, !SSLv3")
+        self.cf.set("smtp_tls_loglevel", "1")
+        self.cf.set("smtp_tls_security_level", "may")
+        lines = self.cf.text().splitlines()
+        self.assertEqual(lines[:5], MAIN_CF.splitlines()[:5])
+        self.assertEqual(lines[5:], [
+            "# Line removed by STARTTLS Everywhere",
+            "# smtp_tls_protocols = !SSLv2,",
+            "#     # a comment inside a continued line",
+            "#     !SSLv3",
+            "#   mydestination = continues smtp_tls_protocols",
+            "# Line removed by STARTTLS Everywhere",
+            "# smtp_tls_loglevel = 0",
+            "not a parameter",
+            "# Line removed by STARTTLS Everywhere",
+            "# smtp_tls_loglevel = 2",
+            "#",
+            "# New config lines added by STARTTLS Everywhere",
+            "#",
+            "smtp_tls_protocols = !SSLv2, !SSLv3",
+            "smtp_tls_loglevel = 1",
+            "smtp_tls_security_level = may",
+        ])
+        edited = MainCF(self.cf.text().splitlines(True))
+        self.assertEqual(edited.get("smtp_tls_protocols"), "!SSLv2, !SSLv3")
+        self.assertEqual(edited.get("smtp_tls_loglevel"), "1")
+        self.assertEqual(edited.get("myhostname"), "mail.example.com")
+
+    def test_empty(self):
+        cf = MainCF([])
+        cf.set("smtpd_use_tls", "yes")
+        self.assertEqual(cf.text().splitlines()[-1], "smtpd_use_tls = yes")
+
+    def test_large(self):
+        lines = ["param_%d = value %d\n" % (i, i) for i in range(100000)]
+        cf = MainCF(lines)
+        self.assertEqual(cf.get("param_99999"), "value 99999")
+        cf.set("param_5", "new")
+        self.assertEqual(MainCF(cf.text().splitlines(True)).get("param_5"),
+                         "new")
+
+
+if __name__ == '__main__':
+    unittest.main()
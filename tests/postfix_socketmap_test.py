@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR, _ = os.path.split(TESTS_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, "tools"))
+sys.path.insert(0, TESTS_DIR)
+
+from PostfixSocketmap import SocketmapServer, netstring, read_netstring
+import socketmap_loadtest
+
+POLICY_LIST = {
+    "version": "0.1",
+    "expires": "2030-01-01T00:00:00+00:00",
+    "policy-aliases": {
+        "hosted": {"mode": "enforce", "mxs": [".mx.hosted.example"]},
+    },
+    "policies": {
+        "example.com": {"mode": "enforce",
+                        "mxs": ["mx1.example.com", ".mail.example.net"]},
+        "customer.example": {"policy-alias": "hosted"},
+        "testing.example": {"mode": "testing", "mxs": ["mx.testing.example"]},
+    },
+}
+
+
+class TestPostfixSocketmap(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.policy_file = os.path.join(self.tmp_dir, "policy.json")
+        self.write_policy(POLICY_LIST)
+        self.listen = "unix:" + os.path.join(self.tmp_dir, "socketmap")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_policy(self, policy_list):
+        # Replace the file the way the updater does, so it gets a new inode.
+        tmp = self.policy_file + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(policy_list, f)
+        os.replace(tmp, self.policy_file)
+
+    def run_server(self, server, session):
+        """Run @server while coroutine function @session(query) runs."""
+        async def run():
+            task = asyncio.ensure_future(server.serve(self.listen))
+            path = self.listen.partition(":")[2]
+            while not os.path.exists(path):
+                await asyncio.sleep(0.01)
+            reader, writer = await asyncio.open_unix_connection(path)
+
+            async def query(request):
+                writer.write(request)
+                return await read_netstring(reader)
+            try:
+                await session(query)
+            finally:
+                writer.close()
+                task.cancel()
+        asyncio.run(run())
+
+    def test_replies(self):
+        server = SocketmapServer(self.policy_file)
+        replies = []
+
+        async def session(query):
+            for key in [b"starttls example.com", b"starttls EXAMPLE.com.",
+                        b"starttls customer.example",
+                        b"starttls testing.example",
+                        b"starttls unlisted.example",
+                        b"otherdb example.com"]:
+                replies.append(await query(netstring(key)))
+        self.run_server(server, session)
+        self.assertEqual(replies, [
+            b"OK secure match=mx1.example.com:.mail.example.net",
+            b"OK secure match=mx1.example.com:.mail.example.net",
+            b"OK secure match=.mx.hosted.example",
+            b"NOTFOUND ",
+            b"NOTFOUND ",
+            b"PERM unknown map otherdb",
+        ])
+
+    def test_bad_netstring(self):
+        server = SocketmapServer(self.policy_file)
+        replies = []
+
+        async def session(query):
+            replies.append(await query(b"5:starttls example.com,"))
+            replies.append(await query(b""))
+        self.run_server(server, session)
+        self.assertTrue(replies[0].startswith(b"PERM "))
+        # The server hangs up once framing is lost.
+        self.assertIsNone(replies[1])
+
+    def test_expired(self):
+        expired = dict(POLICY_LIST, expires="2020-01-01T00:00:00Z")
+        self.write_policy(expired)
+        server = SocketmapServer(self.policy_file)
+        self.assertEqual(server.respond(b"starttls example.com"),
+                         b"NOTFOUND ")
+        server.clock = lambda: 0
+        self.assertTrue(server.respond(b"starttls example.com")
+                        .startswith(b"OK "))
+
+    def test_reload(self):
+        server = SocketmapServer(self.policy_file, check_interval=0.01)
+        replies = []
+        changed = json.loads(json.dumps(POLICY_LIST))
+        changed["policies"]["testing.example"]["mode"] = "enforce"
+
+        async def session(query):
+            replies.append(await query(netstring(b"starttls testing.example")))
+            self.assertFalse(await server.reload())
+            self.write_policy(changed)
+            while not server.reloads:
+                await asyncio.sleep(0.01)
+            replies.append(await query(netstring(b"starttls testing.example")))
+            # A broken list leaves the loaded one serving.
+            with open(self.policy_file, "w") as f:
+                f.write("{")
+            self.assertFalse(await server.reload())
+            replies.append(await query(netstring(b"starttls testing.example")))
+        self.run_server(server, session)
+        self.assertEqual(replies, [
+            b"NOTFOUND ",
+            b"OK secure match=mx.testing.example",
+            b"OK secure match=mx.testing.example",
+        ])
+        self.assertEqual(server.reloads, 1)
+
+    def test_loadtest(self):
+        domains = os.path.join(self.tmp_dir, "domains.txt")
+        with open(domains, "w") as f:
+            f.write("# recipients\nexample.com\n\nunlisted.example\n")
+        result = socketmap_loadtest.main([
+            "--policy", self.policy_file, "--domains", domains,
+            "--queries", "200", "--connections", "4"])
+        self.assertEqual(result["queries"], 200)
+        self.assertEqual(result["replies"], {"OK": 100, "NOTFOUND": 100})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+import asyncio
+import os
+import sys
+import time
+import unittest
+
+ROOT_DIR, _ = os.path.split(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "tools"))
+
+from ObservationStore import ObservationStore
+from RescanScheduler import DAY, RescanScheduler
+from ScanEngine import ScanEngine
+from STARTTLSProbe import Observation
+from scan_engine_test import FakeSMTPServer, LocalResolver
+from testcerts import der, make_cert
+
+HOUR = 60 * 60
+
+
+class TestRescanScheduler(unittest.TestCase):
+    def setUp(self):
+        self.now = time.time()
+        self.store = ObservationStore(":memory:")
+        self.scheduler = RescanScheduler(max_age=7 * DAY,
+                                         expiry_window=14 * DAY,
+                                         retry_after=HOUR,
+                                         max_retry_after=DAY,
+                                         clock=lambda: self.now)
+
+    def tearDown(self):
+        self.store.close()
+
+    def observe(self, mx_host, scanned_at, days=90):
+        chain = [der(make_cert(mx_host, days=days)[0])]
+        self.store.record_observation(
+            Observation(mx_host, "192.0.2.1", "TLSv1.2", "ECDHE-AES", chain),
+            scanned_at)
+
+    def test_due(self):
+        self.observe("fresh.example", self.now - DAY)
+        self.observe("stale.example", self.now - 8 * DAY)
+        self.observe("expiring.example", self.now - DAY, days=10)
+        self.store.record_failure("failed.example", "timed out",
+                                  self.now - 2 * HOUR)
+        self.assertEqual(
+            self.scheduler.due(self.store, [
+                "fresh.example", "stale.example", "expiring.example",
+                "failed.example", "new.example"]),
+            ["stale.example", "expiring.example", "failed.example",
+             "new.example"])
+
+    def test_expiring_not_probed_every_run(self):
+        self.observe("expiring.example", self.now - 60, days=10)
+        self.assertEqual(self.scheduler.due(self.store, ["expiring.example"]),
+                         [])
+
+    def test_backoff(self):
+        self.assertEqual([self.scheduler.backoff(n) for n in range(7)],
+                         [0, HOUR, 2 * HOUR, 4 * HOUR, 8 * HOUR, 16 * HOUR,
+                          DAY])
+        self.observe("mx.example", self.now - 30 * DAY)
+        for hours_ago in (10, 6, 3):
+            self.store.record_failure("mx.example", "timed out",
+                                      self.now - hours_ago * HOUR)
+        # Three failures in a row: wait four hours after the last one.
+        self.assertEqual(self.scheduler.next_probe(self.store, "mx.example"),
+                         self.now + HOUR)
+        self.observe("mx.example", self.now)
+        self.assertEqual(self.store.history("mx.example")[1], 0)
+
+
+class TestResumedScan(unittest.TestCase):
+    def setUp(self):
+        self.store = ObservationStore(":memory:")
+
+    def tearDown(self):
+        self.store.close()
+
+    def test_resume(self):
+        # A scan that was interrupted after probing only mx1.a.example.
+        self.store.enqueue(["mx1.a.example", "mx1.b.example"])
+        self.store.record_failure("mx1.a.example", "timed out")
+        self.assertEqual(self.store.queued(), ["mx1.b.example"])
+
+        server = FakeSMTPServer(delay=0)
+        # Nothing is due by age, so only the leftover probe is run.
+        scheduler = RescanScheduler(retry_after=DAY)
+        self.store.record_failure("mx1.c.example", "timed out")
+
+        async def run():
+            listener = await asyncio.start_server(server.handle,
+                                                  "127.0.0.1", 0)
+            engine = ScanEngine(self.store,
+                                port=listener.sockets[0].getsockname()[1],
+                                resolver=LocalResolver(["mx1"]),
+                                scheduler=scheduler)
+            async with listener:
+                await engine.scan(["a.example", "c.example"])
+        asyncio.run(run())
+        self.assertEqual(server.sessions, 1)
+        self.assertEqual(self.store.queued(), [])
+        self.assertIsNotNone(self.store.latest("mx1.b.example").error)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Scanner throughput benchmark against simulated MX hosts.
+
+Starts a MailFarm (see fakesmtp.py) and a stub DNS server in a child
+process, points the scanner at them and reports hosts per second, per-host
+latency and the scanning process's peak memory.  Nothing leaves the machine,
+so runs on the same box can be compared before and after a change:
+
+  python tests/scan_benchmark.py --hosts 2000 --mix ok=80,tarpit=5,reject=5,\\
+      no_starttls=5,handshake_failure=2,expired=2,self_signed=1
+
+--mode sync runs CheckSTARTTLS.collect() one domain at a time; --mode async
+(the default) runs ScanEngine.  Either way the run ends by generating the
+policy list from the results, which is timed separately.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR, _ = os.path.split(TESTS_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, "tools"))
+sys.path.insert(0, TESTS_DIR)
+
+from fakesmtp import BEHAVIOURS, MailFarm
+
+DEFAULT_MIX = "ok=80,tarpit=4,reject=4,no_starttls=4,handshake_failure=4," \
+    "expired=2,self_signed=2"
+
+
+def parse_mix(mix):
+    """Parse "ok=80,tarpit=5" into [(behaviour, weight)]."""
+    weights = []
+    for item in mix.split(","):
+        behaviour, _, weight = item.partition("=")
+        if behaviour not in BEHAVIOURS:
+            raise ValueError("unknown behaviour %r" % behaviour)
+        weights.append((behaviour, int(weight or 1)))
+    return weights
+
+
+def make_hosts(count, mix):
+    """Return ({host: behaviour}, {domain: [host]}) for @count hosts.
+
+    Behaviours are interleaved in proportion to the weights in @mix, so any
+    prefix of the host list has roughly the same mix.
+    """
+    cycle = [behaviour for behaviour, weight in parse_mix(mix)
+             for _ in range(weight)]
+    stride = 7 if len(cycle) % 7 else 11
+    hosts = {}
+    domains = {}
+    for i in range(count):
+        host = "mx%d.bench.test" % i
+        hosts[host] = cycle[i * stride % len(cycle)]
+        domains["d%d.test" % i] = [host]
+    return hosts, domains
+
+
+def serve(hosts, domains, tarpit_delay, conn):
+    """Child process: run the farm until told to stop."""
+    cert_dir = tempfile.mkdtemp()
+    farm = MailFarm(cert_dir, hosts, tarpit_delay)
+
+    async def run():
+        ports = await farm.start(domains)
+        conn.send(ports + (farm.root_pem,))
+        await asyncio.get_running_loop().run_in_executor(None, conn.recv)
+        farm.close()
+    try:
+        asyncio.run(run())
+    finally:
+        shutil.rmtree(cert_dir)
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def bench(args):
+    from ChainValidator import TrustStore
+    from MXResolver import MXResolver
+    from ObservationStore import ObservationStore
+    from PolicyGenerator import PolicyGenerator
+    from ScanEngine import ScanEngine
+    from ScanMetrics import ScanMetrics
+    import CheckSTARTTLS
+    import dns.asyncresolver
+
+    class RecordingMetrics(ScanMetrics):
+        """Keep every host's time too, for exact percentiles."""
+        def __init__(self):
+            ScanMetrics.__init__(self)
+            self.latencies = []
+
+        def host_done(self, ok, seconds=None):
+            ScanMetrics.host_done(self, ok, seconds)
+            self.latencies.append(seconds)
+
+    hosts, domains = make_hosts(args.hosts, args.mix)
+    parent, child = multiprocessing.Pipe()
+    server = multiprocessing.get_context("fork").Process(
+        target=serve, args=(hosts, domains, args.tarpit_delay, child))
+    server.start()
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        smtp_port, dns_port, root_pem = parent.recv()
+        cafile = os.path.join(tmp_dir, "root.pem")
+        with open(cafile, "wb") as f:
+            f.write(root_pem)
+        store = ObservationStore(os.path.join(tmp_dir, "bench.sqlite"),
+                                 TrustStore(cafile=cafile))
+        metrics = RecordingMetrics()
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start = time.monotonic()
+        if args.mode == "async":
+            resolver = dns.asyncresolver.Resolver(configure=False)
+            resolver.nameservers = ["127.0.0.1"]
+            resolver.port = dns_port
+            engine = ScanEngine(store, concurrency=args.concurrency,
+                                per_ip=args.per_ip, timeout=args.timeout,
+                                port=smtp_port,
+                                resolver=MXResolver(resolver),
+                                metrics=metrics)
+            engine.run(sorted(domains))
+        else:
+            CheckSTARTTLS.store = store
+            CheckSTARTTLS.probed = set()
+            CheckSTARTTLS.metrics = metrics
+            CheckSTARTTLS.smtp_port = smtp_port
+            CheckSTARTTLS.timeout = args.timeout
+            CheckSTARTTLS.resolver.nameservers = ["127.0.0.1"]
+            CheckSTARTTLS.resolver.port = dns_port
+            # collect() reports progress on stdout, which is ours.
+            with contextlib.redirect_stdout(sys.stderr):
+                for domain in sorted(domains):
+                    CheckSTARTTLS.collect(domain)
+            store.commit()
+        scan_seconds = time.monotonic() - start
+        start = time.monotonic()
+        policies = PolicyGenerator(
+            store, public_suffix_list=CheckSTARTTLS.public_suffix_list
+        ).policies(domains)
+        policy_seconds = time.monotonic() - start
+        rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        store.close()
+    finally:
+        parent.send("stop")
+        server.join()
+        shutil.rmtree(tmp_dir)
+
+    latencies = [seconds for seconds in metrics.latencies
+                 if seconds is not None]
+    summary = metrics.summary()
+    return {
+        "mode": args.mode,
+        "hosts": args.hosts,
+        "mix": args.mix,
+        "scan_seconds": round(scan_seconds, 3),
+        "hosts_per_second": round(args.hosts / scan_seconds, 1),
+        "host_p50_seconds": percentile(latencies, 0.5),
+        "host_p99_seconds": percentile(latencies, 0.99),
+        "policy_seconds": round(policy_seconds, 3),
+        "policies": len(policies),
+        # ru_maxrss is in KiB on Linux.
+        "peak_rss_mib": round(rss_after / 1024.0, 1),
+        "peak_rss_growth_mib": round((rss_after - rss_before) / 1024.0, 1),
+        "outcomes": summary["hosts"],
+        "errors": summary["errors"],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--hosts", type=int, default=500)
+    parser.add_argument("--mix", default=DEFAULT_MIX,
+                        help="behaviour=weight,... (default: %(default)s)")
+    parser.add_argument("--mode", choices=["async", "sync"], default="async")
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--per-ip", type=int, default=2)
+    parser.add_argument("--timeout", type=float, default=2)
+    parser.add_argument("--tarpit-delay", type=float, default=1,
+                        help="seconds a tarpit holds its banner; above "
+                        "--timeout they time out (default: %(default)s)")
+    args = parser.parse_args(argv)
+    result = bench(args)
+    print(json.dumps(result, indent=2))
+    return result
+
+
+if __name__ == '__main__':
+    main()
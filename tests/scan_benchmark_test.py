@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+
+import contextlib
+import io
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import scan_benchmark
+from fakesmtp import BEHAVIOURS
+
+
+class TestScanBenchmark(unittest.TestCase):
+    def run_bench(self, mode):
+        args = ["--hosts", str(2 * len(BEHAVIOURS)), "--mode", mode,
+                "--mix", ",".join(BEHAVIOURS), "--timeout", "1",
+                "--tarpit-delay", "0.1"]
+        with contextlib.redirect_stdout(io.StringIO()), \
+                contextlib.redirect_stderr(io.StringIO()):
+            return scan_benchmark.main(args)
+
+    def check(self, result):
+        # Every behaviour but reject, no_starttls and handshake_failure
+        # completes a handshake; only ok and tarpit hosts validate.
+        self.assertEqual(result["outcomes"], {"ok": 8, "failed": 6})
+        self.assertEqual(result["policies"], 4)
+        self.assertEqual(result["errors"], {
+            "banner": {"smtp_554": 2},
+            "ehlo": {"no_starttls": 2},
+            "handshake": {"tls": 2},
+        })
+        self.assertGreater(result["hosts_per_second"], 0)
+        self.assertGreaterEqual(result["host_p99_seconds"],
+                                result["host_p50_seconds"])
+
+    def test_async(self):
+        self.check(self.run_bench("async"))
+
+    def test_sync(self):
+        self.check(self.run_bench("sync"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+import asyncio
+import os
+import sys
+import unittest
+
+ROOT_DIR, _ = os.path.split(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "tools"))
+
+from ObservationStore import ObservationStore
+from ScanEngine import ScanEngine
+
+
+class FakeSMTPServer(object):
+    """Local SMTP server that advertises STARTTLS but refuses to start it.
+
+    Every connection is held open for @delay seconds after EHLO so that
+    concurrent probes overlap; the peak number of open sessions is recorded.
+    """
+
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.active = 0
+        self.peak = 0
+        self.sessions = 0
+
+    async def handle(self, reader, writer):
+        self.active += 1
+        self.sessions += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            writer.write(b"220 fake ESMTP\r\n")
+            await reader.readline()
+            writer.write(b"250-fake\r\n250 STARTTLS\r\n")
+            await writer.drain()
+            await asyncio.sleep(self.delay)
+            await reader.readline()
+            writer.write(b"454 TLS not available\r\n")
+            await writer.drain()
+        finally:
+            self.active -= 1
+            writer.close()
+
+
+class LocalResolver(object):
+    """Give every domain the same MX names, all served on localhost."""
+
+    def __init__(self, mx_hosts):
+        self.mx_hosts = mx_hosts
+        self.looked_up = []
+
+    async def map_domains(self, mail_domains):
+        self.looked_up.extend(mail_domains)
+        mx_to_domains = {}
+        for mail_domain in mail_domains:
+            for mx in self.mx_hosts:
+                mx_to_domains.setdefault("%s.%s" % (mx, mail_domain),
+                                         []).append(mail_domain)
+        return mx_to_domains, {}
+
+    async def addresses(self, mx_host):
+        return ["127.0.0.1"]
+
+
+class TestScanEngine(unittest.TestCase):
+    def setUp(self):
+        self.store = ObservationStore(":memory:")
+
+    def tearDown(self):
+        self.store.close()
+
+    def scan(self, server, domains, **kwargs):
+        self.resolver = LocalResolver(["mx1", "mx2"])
+        async def run():
+            listener = await asyncio.start_server(server.handle, "127.0.0.1", 0)
+            port = listener.sockets[0].getsockname()[1]
+            engine = ScanEngine(self.store, port=port, resolver=self.resolver,
+                                **kwargs)
+            async with listener:
+                await engine.scan(domains)
+        asyncio.run(run())
+
+    def test_per_ip_limit(self):
+        server = FakeSMTPServer()
+        domains = ["example%d.com" % i for i in range(10)]
+        self.scan(server, domains, concurrency=50, per_ip=3)
+        self.assertEqual(server.sessions, 20)
+        self.assertEqual(server.peak, 3)
+
+    def test_global_limit(self):
+        server = FakeSMTPServer()
+        domains = ["example%d.com" % i for i in range(10)]
+        self.scan(server, domains, concurrency=2, per_ip=10)
+        self.assertEqual(server.peak, 2)
+
+    def test_records_results(self):
+        server = FakeSMTPServer(delay=0)
+        self.scan(server, ["example.com", "example.net"])
+        self.assertEqual(self.store.domain_mxs("example.com"),
+                         ["mx1.example.com", "mx2.example.com"])
+        # STARTTLS was refused, so only the failure was recorded.
+        observation = self.store.latest("mx1.example.com")
+        self.assertIsNone(observation.protocol)
+        self.assertEqual(observation.error,
+                         "No STARTTLS support on mx1.example.com 454")
+
+    def test_duplicate_domains(self):
+        server = FakeSMTPServer(delay=0)
+        self.scan(server, ["example.com", "example.net", "example.com"])
+        self.assertEqual(self.resolver.looked_up,
+                         ["example.com", "example.net"])
+        self.assertEqual(server.sessions, 4)
+        self.assertEqual(self.store.domain_mxs("example.com"),
+                         ["mx1.example.com", "mx2.example.com"])
+
+
+if __name__ == '__main__':
+    unittest.main()
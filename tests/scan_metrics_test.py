@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT_DIR, _ = os.path.split(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "tools"))
+
+from ObservationStore import ObservationStore
+from ScanEngine import ScanEngine
+from ScanMetrics import Histogram, ScanMetrics
+from STARTTLSProbe import SMTPReplyError, probe
+from scan_engine_test import FakeSMTPServer, LocalResolver
+
+
+class TestHistogram(unittest.TestCase):
+    def test_quantiles(self):
+        histogram = Histogram(buckets=(1, 2, 5))
+        self.assertIsNone(histogram.quantile(0.5))
+        for value in (0.5, 0.5, 1.5, 4, 100):
+            histogram.observe(value)
+        self.assertEqual(histogram.quantile(0.5), 2)
+        self.assertEqual(histogram.quantile(0.99), float("inf"))
+        self.assertEqual(list(histogram.cumulative()),
+                         [(1, 2), (2, 3), (5, 4), (float("inf"), 5)])
+        self.assertEqual(histogram.sum, 106.5)
+
+
+class TestScanMetrics(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_span(self):
+        metrics = ScanMetrics()
+        with metrics.span("connect"):
+            pass
+        with self.assertRaises(SMTPReplyError):
+            with metrics.span("starttls"):
+                raise SMTPReplyError(454, ["TLS not available"])
+        with self.assertRaises(asyncio.TimeoutError):
+            with metrics.span("banner"):
+                raise asyncio.TimeoutError()
+        summary = json.loads(json.dumps(metrics.summary()))
+        self.assertEqual(summary["phases"]["connect"]["count"], 1)
+        self.assertEqual(summary["phases"]["starttls"]["count"], 0)
+        self.assertEqual(summary["errors"], {"banner": {"timeout": 1},
+                                             "starttls": {"smtp_454": 1}})
+
+    def test_banner_timeout(self):
+        async def silent(reader, writer):
+            await asyncio.sleep(1)
+            writer.close()
+
+        async def run():
+            metrics = ScanMetrics()
+            listener = await asyncio.start_server(silent, "127.0.0.1", 0)
+            async with listener:
+                with self.assertRaises(asyncio.TimeoutError):
+                    await probe("mx.example", "127.0.0.1",
+                                listener.sockets[0].getsockname()[1],
+                                timeout=0.1, metrics=metrics)
+            return metrics
+        metrics = asyncio.run(run())
+        self.assertEqual(metrics.phases["connect"].count, 1)
+        self.assertEqual(dict(metrics.errors), {("banner", "timeout"): 1})
+
+    def test_engine_exports(self):
+        store = ObservationStore(":memory:")
+        path = os.path.join(self.tmp_dir, "scan.prom")
+        server = FakeSMTPServer(delay=0)
+
+        async def run():
+            listener = await asyncio.start_server(server.handle,
+                                                  "127.0.0.1", 0)
+            engine = ScanEngine(store,
+                                port=listener.sockets[0].getsockname()[1],
+                                resolver=LocalResolver(["mx1", "mx2"]),
+                                metrics_file=path)
+            async with listener:
+                await engine.scan(["a.example", "b.example"])
+            return engine.metrics
+        metrics = asyncio.run(run())
+        store.close()
+        self.assertEqual(metrics.hosts["failed"], 4)
+        for phase in ("dns", "connect", "banner", "ehlo"):
+            self.assertEqual(metrics.phases[phase].count, 4)
+        with open(path) as f:
+            text = f.read()
+        self.assertIn('starttls_scan_phase_seconds_count{phase="ehlo"} 4\n',
+                      text)
+        self.assertIn('starttls_scan_phase_seconds_bucket'
+                      '{phase="ehlo",le="+Inf"} 4\n', text)
+        self.assertIn('starttls_scan_errors_total'
+                      '{phase="starttls",class="smtp_454"} 4\n', text)
+        self.assertEqual(os.listdir(self.tmp_dir), ["scan.prom"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+import asyncio
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT_DIR, _ = os.path.split(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "tools"))
+
+from ObservationStore import ObservationStore
+from PolicyGenerator import PolicyGenerator
+from ScanEngine import ScanEngine, shard_of
+from starttls_probe_test import STARTTLSServer
+
+SHARDS = 3
+# Twelve domains sharing eight MX hosts between them.
+DOMAINS = dict(("d%d.example" % i,
+                ["mx%d.provider.example" % (i % 4),
+                 "mx%d.provider.example" % ((i + 1) % 4),
+                 "mail.d%d.example" % (i % 4)])
+               for i in range(12))
+
+
+class ShardResolver(object):
+    async def map_domains(self, mail_domains):
+        mx_to_domains = {}
+        for mail_domain in mail_domains:
+            for mx_host in DOMAINS[mail_domain]:
+                mx_to_domains.setdefault(mx_host, []).append(mail_domain)
+        return mx_to_domains, {}
+
+    async def addresses(self, mx_host):
+        return ["127.0.0.1"]
+
+
+def scan_shard(tmp_dir, index):
+    """Worker process: scan shard @index into its own store."""
+    cert_dir = os.path.join(tmp_dir, "certs%d" % index)
+    os.mkdir(cert_dir)
+    server = STARTTLSServer(cert_dir)
+    store = ObservationStore(os.path.join(tmp_dir, "shard%d.sqlite" % index))
+
+    async def run():
+        listener = await asyncio.start_server(server.handle, "127.0.0.1", 0)
+        engine = ScanEngine(store, port=listener.sockets[0].getsockname()[1],
+                            resolver=ShardResolver(), shard=(index, SHARDS))
+        async with listener:
+            await engine.scan(sorted(DOMAINS))
+    asyncio.run(run())
+    store.close()
+    return server.connections
+
+
+class TestShardedScan(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def merged(self, name, order):
+        store = ObservationStore(os.path.join(self.tmp_dir, name))
+        for index in order:
+            store.merge(os.path.join(self.tmp_dir, "shard%d.sqlite" % index))
+        # The test servers' roots aren't trusted anywhere; pretend they are.
+        store.db.execute("UPDATE observations SET valid = 1")
+        return store
+
+    def test_shard_of_is_stable(self):
+        # Fixed values: workers on other machines must agree with these.
+        self.assertEqual(shard_of("aspmx.l.google.com", 1), 0)
+        self.assertEqual([shard_of("mx%d.example" % i, 4) for i in range(8)],
+                         [3, 0, 1, 3, 1, 1, 0, 2])
+        self.assertEqual(shard_of("mx.example.com", 1000), 855)
+
+    def test_workers_and_merge(self):
+        with multiprocessing.get_context("fork").Pool(SHARDS) as pool:
+            connections = pool.starmap(
+                scan_shard, [(self.tmp_dir, i) for i in range(SHARDS)])
+        mx_hosts = set(mx for mxs in DOMAINS.values() for mx in mxs)
+        # Every MX host probed once, by the worker that owns it.
+        self.assertEqual(sum(connections), len(mx_hosts))
+        for index in range(SHARDS):
+            self.assertEqual(connections[index], len(
+                [mx for mx in mx_hosts if shard_of(mx, SHARDS) == index]))
+
+        forward = self.merged("forward.sqlite", range(SHARDS))
+        backward = self.merged("backward.sqlite", reversed(range(SHARDS)))
+        # Merging again changes nothing.
+        forward.merge(os.path.join(self.tmp_dir, "shard0.sqlite"))
+        self.assertEqual(
+            forward.db.execute("SELECT COUNT(*) FROM observations")
+            .fetchone()[0], len(mx_hosts))
+        for mail_domain, mxs in DOMAINS.items():
+            self.assertEqual(forward.domain_mxs(mail_domain), sorted(mxs))
+        self.assertEqual(
+            PolicyGenerator(forward).policies(DOMAINS),
+            PolicyGenerator(backward).policies(DOMAINS))
+        self.assertEqual(len(PolicyGenerator(forward).policies(DOMAINS)),
+                         len(DOMAINS))
+        forward.close()
+        backward.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
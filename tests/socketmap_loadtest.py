@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Load-test client for PostfixSocketmap.
+
+Replays recipient-domain lookups the way Postfix's smtp processes make them:
+--connections persistent connections, each sending one query and waiting for
+its reply before sending the next.  The connections are spread over
+--processes client processes, so that the client isn't what runs out of CPU
+first.  Reports queries per second, latency
+percentiles and the count of each kind of reply:
+
+  python tests/socketmap_loadtest.py --policy policy.json \\
+      --domains recipients.txt --queries 200000 --connections 50
+
+--domains is a file of recipient domains, one per line (blank lines and "#"
+comments are skipped); without it the domains on the policy list are
+replayed, mixed with an equal number that aren't on it.  Without --listen, a
+server for --policy is started in a child process on a temporary socket;
+with it, the client talks to an already running server.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT_DIR, _ = os.path.split(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "tools"))
+
+from PolicyIndex import PolicyIndex
+from PostfixSocketmap import SocketmapServer, netstring, read_netstring
+
+
+def load_domains(args):
+    if args.domains:
+        with open(args.domains) as f:
+            return [line.strip() for line in f
+                    if line.strip() and not line.startswith("#")]
+    listed = sorted(PolicyIndex.from_file(args.policy).domains())
+    unlisted = ["unlisted%d.example" % i for i in range(len(listed))]
+    return [domain for pair in zip(listed, unlisted) for domain in pair]
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def serve(policy, listen, ready):
+    """Child process: run a server until killed."""
+    # Replay against the list as though it were current, even if it has
+    # expired, so that the enforce replies get exercised.
+    server = SocketmapServer(policy, clock=lambda: 0)
+
+    async def run():
+        task = asyncio.ensure_future(server.serve(listen))
+        while not os.path.exists(listen.partition(":")[2]):
+            await asyncio.sleep(0.01)
+        ready.set()
+        await task
+    asyncio.run(run())
+
+
+async def replay(listen, map_name, domains, queries, connections):
+    latencies = []
+    replies = {}
+    keys = itertools.cycle([("%s %s" % (map_name, domain)).encode("ascii")
+                            for domain in domains])
+    remaining = [queries]
+    kind, _, address = listen.partition(":")
+
+    async def client():
+        if kind == "unix":
+            reader, writer = await asyncio.open_unix_connection(address)
+        else:
+            host, _, port = address.rpartition(":")
+            reader, writer = await asyncio.open_connection(host, int(port))
+        try:
+            while remaining[0] > 0:
+                remaining[0] -= 1
+                request = netstring(next(keys))
+                start = time.perf_counter()
+                writer.write(request)
+                reply = await read_netstring(reader)
+                latencies.append(time.perf_counter() - start)
+                status = reply.partition(b" ")[0].decode("ascii")
+                replies[status] = replies.get(status, 0) + 1
+        finally:
+            writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(connections)])
+    return time.perf_counter() - start, latencies, replies
+
+
+def replay_process(job):
+    """Pool worker: replay one share of the queries."""
+    return asyncio.run(replay(*job))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--policy", default=os.path.join(ROOT_DIR,
+                                                         "policy.json"))
+    parser.add_argument("--domains",
+                        help="file of recipient domains to replay")
+    parser.add_argument("--listen",
+                        help="unix:PATH or inet:HOST:PORT of a running server")
+    parser.add_argument("--map-name", default="starttls")
+    parser.add_argument("--queries", type=int, default=100000)
+    parser.add_argument("--connections", type=int, default=50)
+    parser.add_argument("--processes", type=int, default=4)
+    args = parser.parse_args(argv)
+
+    domains = load_domains(args)
+    listen = args.listen
+    server = tmp_dir = None
+    if listen is None:
+        tmp_dir = tempfile.mkdtemp()
+        listen = "unix:" + os.path.join(tmp_dir, "socketmap")
+        context = multiprocessing.get_context("fork")
+        ready = context.Event()
+        server = context.Process(
+            target=serve, args=(args.policy, listen, ready))
+        server.start()
+        ready.wait()
+    processes = max(1, min(args.processes, args.connections))
+    jobs = []
+    for i in range(processes):
+        # Each process starts at a different place in the domain list.
+        offset = i * len(domains) // processes
+        jobs.append((listen, args.map_name,
+                     domains[offset:] + domains[:offset],
+                     args.queries // processes +
+                     (i < args.queries % processes),
+                     args.connections // processes +
+                     (i < args.connections % processes)))
+    try:
+        start = time.perf_counter()
+        with multiprocessing.get_context("fork").Pool(processes) as pool:
+            results = pool.map(replay_process, jobs)
+        seconds = time.perf_counter() - start
+    finally:
+        if server is not None:
+            server.terminate()
+            server.join()
+            shutil.rmtree(tmp_dir)
+    latencies = sorted(latency for _, share, _ in results
+                       for latency in share)
+    replies = {}
+    for _, _, share in results:
+        for status, count in share.items():
+            replies[status] = replies.get(status, 0) + count
+
+    result = {
+        "queries": len(latencies),
+        "connections": args.connections,
+        "processes": processes,
+        "distinct_domains": len(set(domains)),
+        "seconds": round(seconds, 3),
+        "queries_per_second": round(len(latencies) / seconds),
+        "p50_us": round(percentile(latencies, 0.5) * 1e6),
+        "p99_us": round(percentile(latencies, 0.99) * 1e6),
+        "p999_us": round(percentile(latencies, 0.999) * 1e6),
+        "max_us": round(latencies[-1] * 1e6),
+        "replies": replies,
+    }
+    print(json.dumps(result, indent=2))
+    return result
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+import asyncio
+import os
+import shutil
+import ssl
+import sys
+import tempfile
+import unittest
+
+ROOT_DIR, _ = os.path.split(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "tools"))
+
+import STARTTLSProbe
+from testcerts import der, key_pem, make_cert, pem
+
+
+class STARTTLSServer(object):
+    """Local SMTP server that upgrades to TLS with a leaf + intermediate."""
+
+    def __init__(self, cert_dir, offer_starttls=True):
+        self.offer_starttls = offer_starttls
+        root = make_cert("Test Root", ca=True)
+        intermediate = make_cert("Test Intermediate", issuer=root, ca=True)
+        leaf = make_cert("mx.example.com", issuer=intermediate)
+        self.chain = [der(leaf[0]), der(intermediate[0])]
+        chain_file = os.path.join(cert_dir, "chain.pem")
+        key_file = os.path.join(cert_dir, "key.pem")
+        with open(chain_file, "wb") as f:
+            f.write(pem(leaf[0]) + pem(intermediate[0]))
+        with open(key_file, "wb") as f:
+            f.write(key_pem(leaf[1]))
+        self.context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        self.context.load_cert_chain(chain_file, key_file)
+        self.connections = 0
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        writer.write(b"220 fake ESMTP\r\n")
+        await reader.readline()
+        if self.offer_starttls:
+            writer.write(b"250-fake\r\n250-PIPELINING\r\n250 STARTTLS\r\n")
+        else:
+            writer.write(b"250-fake\r\n250 PIPELINING\r\n")
+        await writer.drain()
+        if not self.offer_starttls:
+            writer.close()
+            return
+        await reader.readline()
+        writer.write(b"220 go ahead\r\n")
+        await writer.drain()
+        loop = asyncio.get_running_loop()
+        transport = await loop.start_tls(
+            writer.transport, writer.transport.get_protocol(), self.context,
+            server_side=True)
+        transport.close()
+
+
+class TestSTARTTLSProbe(unittest.TestCase):
+    def setUp(self):
+        self.cert_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cert_dir)
+
+    def probe(self, server):
+        async def run():
+            listener = await asyncio.start_server(server.handle, "127.0.0.1", 0)
+            port = listener.sockets[0].getsockname()[1]
+            async with listener:
+                return await STARTTLSProbe.probe(
+                    "mx.example.com", "127.0.0.1", port, timeout=5)
+        return asyncio.run(run())
+
+    def test_single_connection_capture(self):
+        server = STARTTLSServer(self.cert_dir)
+        observation = self.probe(server)
+        self.assertEqual(server.connections, 1)
+        self.assertEqual(observation.mx_host, "mx.example.com")
+        self.assertEqual(observation.address, "127.0.0.1")
+        self.assertTrue(observation.protocol.startswith("TLSv1"))
+        self.assertTrue(observation.cipher)
+        self.assertEqual(observation.chain, server.chain)
+
+    def test_no_starttls(self):
+        server = STARTTLSServer(self.cert_dir, offer_starttls=False)
+        with self.assertRaises(STARTTLSProbe.SMTPReplyError) as cm:
+            self.probe(server)
+        self.assertEqual(STARTTLSProbe.describe_failure("mx", cm.exception),
+                         "No STARTTLS support on mx")
+
+
+if __name__ == '__main__':
+    unittest.main()
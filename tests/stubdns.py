@@ -0,0 +1,62 @@
+"""A tiny authoritative DNS server for the scanner tests."""
+
+import asyncio
+import collections
+
+import dns.asyncresolver
+import dns.flags
+import dns.message
+import dns.rcode
+import dns.rdatatype
+import dns.rrset
+
+
+class StubDNSServer(asyncio.DatagramProtocol):
+    """Answer UDP queries from a fixed set of records.
+
+    @records maps (name, type) to a list of rdata strings, e.g.
+    {("example.com", "MX"): ["10 mx.example.com."]}.  Names not in @records
+    get NXDOMAIN; known names asked for another type get an empty answer.
+    Every query is counted in self.queries by (name, type).
+    """
+
+    def __init__(self, records, ttl=300):
+        self.records = dict(((name.lower().rstrip("."), rdtype.upper()), rdata)
+                            for (name, rdtype), rdata in records.items())
+        self.names = set(name for name, _ in self.records)
+        self.ttl = ttl
+        self.queries = collections.Counter()
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        query = dns.message.from_wire(data)
+        response = dns.message.make_response(query)
+        response.flags |= dns.flags.AA
+        question = query.question[0]
+        name = question.name.to_text().lower().rstrip(".")
+        rdtype = dns.rdatatype.to_text(question.rdtype)
+        self.queries[(name, rdtype)] += 1
+        if name not in self.names:
+            response.set_rcode(dns.rcode.NXDOMAIN)
+        elif (name, rdtype) in self.records:
+            response.answer.append(dns.rrset.from_text_list(
+                question.name, self.ttl, "IN", rdtype,
+                self.records[(name, rdtype)]))
+        self.transport.sendto(response.to_wire(), addr)
+
+    async def start(self):
+        """Listen on a free localhost port; return a resolver that uses it."""
+        loop = asyncio.get_running_loop()
+        await loop.create_datagram_endpoint(
+            lambda: self, local_addr=("127.0.0.1", 0))
+        resolver = dns.asyncresolver.Resolver(configure=False)
+        resolver.nameservers = ["127.0.0.1"]
+        resolver.port = self.transport.get_extra_info("sockname")[1]
+        resolver.lifetime = 2
+        return resolver
+
+    def close(self):
+        self.transport.close()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+Replace files so that readers see either the old contents or the new.
+
+The new contents are written under a temporary name in the same directory,
+then renamed over the file.  Processes that already have the old file open
+or mapped keep reading it, and an interrupted write leaves the old file as
+it was.  The new file is synced before the rename, and the directory after
+it, so a crash can't leave an empty or missing file either.
+"""
+import os
+import stat
+import tempfile
+
+DEFAULT_MODE = 0o644
+
+
+def atomic_write(path, data, mode=None):
+    """Replace @path with @data (bytes).
+
+    The file gets @mode; by default, the mode of the file it replaces, or
+    DEFAULT_MODE if there is none.
+    """
+    if mode is None:
+        try:
+            mode = stat.S_IMODE(os.stat(path).st_mode)
+        except FileNotFoundError:
+            mode = DEFAULT_MODE
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory,
+                               prefix="." + os.path.basename(path))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp, mode)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    dir_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
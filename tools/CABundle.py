@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Build the CA file Postfix verifies policy list MX hosts against.
+
+The bundle is every certificate in the root files (by default Mozilla's, as
+Debian installs them), each once however many files it appears in, in PEM.
+It is built in memory and only replaces the installed file if it differs,
+so an unchanged bundle is left alone (and Postfix needn't be reloaded for
+it).
+
+  python tools/CABundle.py /etc/postfix/starttls_everywhere_CAfile
+"""
+import argparse
+import glob
+import hashlib
+import logging
+import os
+import re
+import ssl
+import sys
+
+from AtomicWrite import atomic_write
+
+logger = logging.getLogger(__name__)
+
+CA_DIR = "/usr/share/ca-certificates/mozilla"
+CA_PATTERN = "*.crt"
+
+_PEM = re.compile(br"-----BEGIN CERTIFICATE-----.*?-----END CERTIFICATE-----",
+                  re.DOTALL)
+
+
+class CABundleError(ValueError):
+    pass
+
+
+def _certificates(data):
+    """Return the DER of each certificate in the PEM or DER file @data."""
+    blocks = _PEM.findall(data)
+    if not blocks:
+        # A DER file holds one certificate, an ASN.1 SEQUENCE.
+        return [data] if data[:1] == b"\x30" else []
+    certificates = []
+    for block in blocks:
+        try:
+            pem = block.decode("ascii")
+            certificates.append(ssl.PEM_cert_to_DER_cert(pem))
+        except ValueError:
+            # Includes the binascii and Unicode errors.
+            pass
+    return certificates
+
+
+class CABundle(object):
+    """The CA bundle built from the certificate files at @paths, in order."""
+
+    def __init__(self, paths):
+        self.paths = list(paths)
+        seen = set()
+        pems = []
+        for path in self.paths:
+            with open(path, "rb") as f:
+                data = f.read()
+            certificates = _certificates(data)
+            if not certificates:
+                logger.warning("No certificates in %s", path)
+            for der in certificates:
+                fingerprint = hashlib.sha256(der).digest()
+                if fingerprint not in seen:
+                    seen.add(fingerprint)
+                    pems.append(ssl.DER_cert_to_PEM_cert(der))
+        if not pems:
+            raise CABundleError("no certificates in %d files" %
+                                len(self.paths))
+        self.count = len(pems)
+        self.data = "".join(pems).encode("ascii")
+        self.sha256 = hashlib.sha256(self.data).hexdigest()
+
+    @classmethod
+    def from_directory(cls, directory=CA_DIR, pattern=CA_PATTERN):
+        return cls(sorted(glob.glob(os.path.join(directory, pattern))))
+
+    def install(self, path):
+        """Make @path this bundle, unless it already is.  Returns whether the
+        file was written."""
+        try:
+            with open(path, "rb") as f:
+                if hashlib.sha256(f.read()).hexdigest() == self.sha256:
+                    return False
+        except (IOError, OSError):
+            pass
+        atomic_write(path, self.data)
+        return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Build a CA file from a directory of root certificates")
+    parser.add_argument("ca_file", help="the CA file to write")
+    parser.add_argument("--ca-dir", default=CA_DIR,
+                        help="default: %(default)s")
+    parser.add_argument("--pattern", default=CA_PATTERN,
+                        help="root files to read (default: %(default)s)")
+    args = parser.parse_args(argv)
+    logging.basicConfig(stream=sys.stderr, level=logging.INFO,
+                        format="%(message)s")
+    bundle = CABundle.from_directory(args.ca_dir, args.pattern)
+    changed = bundle.install(args.ca_file)
+    logger.info("%s %s (%d certificates from %d files)", args.ca_file,
+                "updated" if changed else "unchanged", bundle.count,
+                len(bundle.paths))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
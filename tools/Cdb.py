@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Read and write cdb constant databases, the format of Postfix's cdb: tables.
+
+A cdb file is built once and then only read: a fixed 2048-byte header of
+256 (offset, slots) pairs, the records as (key length, value length, key,
+value), then 256 open-addressing hash tables of (hash, record offset) slots.
+A lookup reads the header entry, one or two slots and the record, so a
+process that opens the table does no work proportional to its size.  See
+https://cr.yp.to/cdb/cdb.txt.
+
+Postfix's postmap writes keys and values without a trailing NUL and looks
+keys up with and without one, so that is how CdbWriter writes them too.
+"""
+import array
+import io
+import mmap
+import struct
+import sys
+
+from AtomicWrite import atomic_write
+
+_PAIR = struct.Struct("<II")
+HEADER_SIZE = 256 * _PAIR.size
+# Offsets are 32 bits.
+MAX_SIZE = 0xffffffff
+
+
+class CdbError(ValueError):
+    pass
+
+
+def cdb_hash(key):
+    h = 5381
+    for c in key:
+        h = ((h << 5) + h ^ c) & 0xffffffff
+    return h
+
+
+class CdbWriter(object):
+    """Write a cdb to the binary file @f, one record at a time.
+
+    The records go straight to @f; only a (hash, offset) pair per record is
+    kept until finish() writes the hash tables and the header.
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.f.seek(HEADER_SIZE)
+        self.pos = HEADER_SIZE
+        # Per table: the hash and offset of each of its records, flattened.
+        self.tables = [array.array("I") for _ in range(256)]
+
+    def add(self, key, value):
+        """Add a record for @key, both it and @value bytes."""
+        record = _PAIR.pack(len(key), len(value)) + key + value
+        if self.pos + len(record) > MAX_SIZE:
+            raise CdbError("cdb would be larger than 4GB")
+        h = cdb_hash(key)
+        self.tables[h & 0xff].extend((h, self.pos))
+        self.f.write(record)
+        self.pos += len(record)
+
+    def finish(self):
+        header = []
+        for table in self.tables:
+            count = len(table) // 2
+            slots = 2 * count
+            layout = array.array("I", bytes(8 * slots))
+            for i in range(0, len(table), 2):
+                h = table[i]
+                slot = (h >> 8) % slots
+                while layout[2 * slot + 1]:
+                    slot = (slot + 1) % slots
+                layout[2 * slot] = h
+                layout[2 * slot + 1] = table[i + 1]
+            header.append(_PAIR.pack(self.pos, slots))
+            if self.pos + 8 * slots > MAX_SIZE:
+                raise CdbError("cdb would be larger than 4GB")
+            if sys.byteorder == "big":
+                layout.byteswap()
+            self.f.write(layout.tobytes())
+            self.pos += 8 * slots
+        self.f.seek(0)
+        self.f.write(b"".join(header))
+        self.f.seek(self.pos)
+
+
+def write_cdb(path, items):
+    """Write the (key, value) @items to a cdb at @path, replacing it
+    atomically."""
+    f = io.BytesIO()
+    writer = CdbWriter(f)
+    for key, value in items:
+        writer.add(key, value)
+    writer.finish()
+    atomic_write(path, f.getvalue())
+
+
+class Cdb(object):
+    """A cdb file at @path, mapped into memory."""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            try:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise CdbError("%s is empty" % path)
+        if len(self._map) < HEADER_SIZE:
+            self._map.close()
+            raise CdbError("%s is too short to be a cdb" % path)
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _unpack(self, offset):
+        if offset + _PAIR.size > len(self._map):
+            raise CdbError("offset %d is past the end of the cdb" % offset)
+        return _PAIR.unpack_from(self._map, offset)
+
+    def get(self, key, default=None):
+        """Return the value of the first record for @key, or @default."""
+        h = cdb_hash(key)
+        table, slots = self._unpack(8 * (h & 0xff))
+        if not slots:
+            return default
+        slot = (h >> 8) % slots
+        for _ in range(slots):
+            slot_hash, pos = self._unpack(table + 8 * slot)
+            if not pos:
+                return default
+            if slot_hash == h:
+                key_length, value_length = self._unpack(pos)
+                start = pos + _PAIR.size
+                if key_length == len(key) and \
+                        self._map[start:start + key_length] == key:
+                    start += key_length
+                    return self._map[start:start + value_length]
+            slot = (slot + 1) % slots
+        return default
+
+    def __iter__(self):
+        """Iterate over the (key, value) of every record, in file order."""
+        pos = HEADER_SIZE
+        end = self._unpack(0)[0]
+        while pos < end:
+            key_length, value_length = self._unpack(pos)
+            pos += _PAIR.size
+            key = self._map[pos:pos + key_length]
+            pos += key_length
+            yield key, self._map[pos:pos + value_length]
+            pos += value_length
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+In-process certificate chain validation.
+
+TrustStore loads a CA bundle once and verifies captured chains against it
+without spawning `openssl verify` per host.  The checks mirror
+`openssl verify -purpose sslserver -untrusted <chain> <chain>`: the leaf is
+verified using the rest of the captured chain as untrusted intermediates, and
+every certificate below the trust anchor must be usable for TLS server
+authentication.  A verification time can be given so that a chain is judged as
+of when it was captured rather than now (`-attime`).
+
+Paths are built and verified with OpenSSL's time checks turned off, and the
+validity window of the resulting path is compared with the verification time
+separately.  A path only has to be built once per distinct chain, and every
+later verification of that chain, at any time, is a dictionary lookup.
+"""
+import hashlib
+import ssl
+import time
+
+from cryptography import x509
+from cryptography.x509.oid import ExtendedKeyUsageOID, ObjectIdentifier
+from OpenSSL import crypto
+
+# OpenSSL's sslserver purpose also accepts the legacy Server Gated Crypto
+# usages in place of serverAuth.
+SERVER_AUTH_USAGES = frozenset([
+    ExtendedKeyUsageOID.SERVER_AUTH,
+    ObjectIdentifier("2.16.840.1.113730.4.1"),  # Netscape SGC
+    ObjectIdentifier("1.3.6.1.4.1.311.10.3.3"),  # Microsoft SGC
+])
+
+# X509_V_FLAG_NO_CHECK_TIME, which pyOpenSSL doesn't name.
+NO_CHECK_TIME = 0x200000
+
+
+class InvalidChain(Exception):
+    """A captured chain failed verification."""
+
+
+def _extension(cert, extension_class):
+    try:
+        return cert.extensions.get_extension_for_class(extension_class).value
+    except x509.ExtensionNotFound:
+        return None
+
+
+def purpose_error(cert, is_leaf):
+    """Return why @cert can't be used for TLS server auth, or None."""
+    usages = _extension(cert, x509.ExtendedKeyUsage)
+    if usages is not None and not SERVER_AUTH_USAGES.intersection(usages):
+        return "unsupported certificate purpose"
+    if is_leaf:
+        key_usage = _extension(cert, x509.KeyUsage)
+        if key_usage is not None and not (key_usage.digital_signature or
+                                          key_usage.key_encipherment or
+                                          key_usage.key_agreement):
+            return "unsupported certificate purpose"
+    return None
+
+
+class TrustStore(object):
+    """A set of trust roots, loaded once, to verify many chains against.
+
+    @cafile is a PEM bundle and @capath a directory of hashed symlinks, as
+    for openssl.  With neither, the system default locations are used.
+    """
+
+    def __init__(self, cafile=None, capath=None):
+        if cafile is None and capath is None:
+            defaults = ssl.get_default_verify_paths()
+            cafile, capath = defaults.cafile, defaults.capath
+        self._store = crypto.X509Store()
+        self._store.load_locations(cafile, capath)
+        self._store.set_flags(NO_CHECK_TIME)
+        # Digest of a chain -> (not before, not after) of the path it verifies
+        # through, or the InvalidChain it failed with.
+        self._verdicts = {}
+
+    def verify(self, chain, at_time=None):
+        """Verify @chain, a list of DER certificates with the leaf first.
+
+        @at_time is a POSIX timestamp to verify as of; default is now.
+        Raises InvalidChain if the chain does not verify.
+        """
+        if not chain:
+            raise InvalidChain("no certificates")
+        if at_time is None:
+            at_time = time.time()
+        digest = hashlib.sha256()
+        for der in chain:
+            digest.update(b"%d:" % len(der))
+            digest.update(der)
+        digest = digest.digest()
+        verdict = self._verdicts.get(digest)
+        if verdict is None:
+            verdict = self._verdicts[digest] = self._verify_path(chain)
+        if isinstance(verdict, InvalidChain):
+            raise InvalidChain(*verdict.args)
+        not_before, not_after = verdict
+        if at_time < not_before:
+            raise InvalidChain("certificate is not yet valid")
+        if at_time > not_after:
+            raise InvalidChain("certificate has expired")
+
+    def _verify_path(self, chain):
+        """Return the validity window of @chain's path, or an InvalidChain."""
+        try:
+            certs = [crypto.load_certificate(crypto.FILETYPE_ASN1, der)
+                     for der in chain]
+        except crypto.Error as e:
+            return InvalidChain("unparseable certificate: %s" % e)
+        context = crypto.X509StoreContext(self._store, certs[0], certs[1:])
+        try:
+            path = context.get_verified_chain()
+        except crypto.X509StoreContextError as e:
+            return InvalidChain(str(e))
+
+        path = [cert.to_cryptography() for cert in path]
+        # The last certificate is the trust anchor; its purpose isn't checked.
+        for depth, cert in enumerate(path[:-1]):
+            error = purpose_error(cert, depth == 0)
+            if error:
+                return InvalidChain("%s at depth %d" % (error, depth))
+        return (max(cert.not_valid_before_utc.timestamp() for cert in path),
+                min(cert.not_valid_after_utc.timestamp() for cert in path))
+
+    def is_valid(self, chain, at_time=None):
+        """Return True if @chain verifies (as of @at_time)."""
+        try:
+            self.verify(chain, at_time)
+            return True
+        except InvalidChain:
+            return False
@@ -1,191 +1,229 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
+import argparse
+import asyncio
 import sys
-import os
-import errno
-import smtplib
-import socket
-import subprocess
-import re
 import json
-import collections
 
+import dns.exception
 import dns.resolver
-from M2Crypto import X509
 from publicsuffix import PublicSuffixList
 
-public_suffix_list = PublicSuffixList()
-CERTS_OBSERVED = 'certs-observed'
-
-def mkdirp(path):
-    try:
-        os.makedirs(path)
-    except OSError as exc:
-        if exc.errno == errno.EEXIST and os.path.isdir(path):
-            pass
-        else: raise
-
-def extract_names(pem):
-    """Return a set of DNS subject names from PEM-encoded leaf cert."""
-    leaf = X509.load_cert_string(pem, X509.FORMAT_PEM)
+from ChainValidator import TrustStore
+from ObservationStore import ObservationStore
+from PolicyGenerator import PolicyGenerator
+from RescanScheduler import DAY, RescanScheduler
+from ScanEngine import ScanEngine, shard_of
+from ScanMetrics import ScanMetrics
+from STARTTLSProbe import SMTP_PORT, PROBE_ERRORS, describe_failure, probe
 
-    subj = leaf.get_subject()
-    # Certs have a "subject" identified by a Distingushed Name (DN).
-    # Host certs should also have a Common Name (CN) with a DNS name.
-    common_names = subj.get_entries_by_nid(subj.nid['CN'])
-    common_names = [name.get_data().as_text() for name in common_names]
-    try:
-        # The SAN extension allows one cert to cover multiple domains
-        # and permits DNS wildcards.
-        # http://www.digicert.com/subject-alternative-name.htm
-        # The field is a comma delimited list, e.g.:
-        # >>> twitter_cert.get_ext('subjectAltName').get_value()
-        # 'DNS:www.twitter.com, DNS:twitter.com'
-        alt_names = leaf.get_ext('subjectAltName').get_value()
-        alt_names = alt_names.split(', ')
-        alt_names = [name.partition(':') for name in alt_names]
-        alt_names = [name for prot, _, name in alt_names if prot == 'DNS']
-    except:
-        alt_names = []
-    return set(common_names + alt_names)
-
-def tls_connect(mx_host, mail_domain):
-  """Attempt a STARTTLS connection with openssl and save the output."""
-  if supports_starttls(mx_host):
-    # smtplib doesn't let us access certificate information,
-    # so shell out to openssl.
-    try:
-      output = subprocess.check_output(
-          """openssl s_client \
-             -starttls smtp -connect %s:25 -showcerts </dev/null \
-             2>/dev/null
-             """ % mx_host, shell = True)
-    except subprocess.CalledProcessError:
-      print "Failed s_client"
-      return
-
-    # Save a copy of the certificate for later analysis
-    with open(os.path.join(CERTS_OBSERVED, mail_domain, mx_host), "w") as f:
-      f.write(output)
-
-def valid_cert(filename):
-  """Return true if the certificate is valid.
-
-     Note: CApath must have hashed symlinks to the trust roots.
-     TODO: Include the -attime flag based on file modification time."""
-
-  if open(filename).read().find("-----BEGIN CERTIFICATE-----") == -1:
-    return False
+public_suffix_list = PublicSuffixList()
+CERTS_OBSERVED = 'certs-observed.sqlite'
+# Set from --ca-file/--ca-path, or the system default roots on first use.
+trust_store = None
+# Set from --store, or opened at CERTS_OBSERVED on first use.
+store = None
+# Shared by every collect() so that lookups are only repeated once their TTL
+# has run out.
+resolver = dns.resolver.Resolver()
+resolver.cache = dns.resolver.LRUCache()
+# MX hosts probed by collect() during this run.
+probed = set()
+# Decides which MX hosts collect() re-probes; set from --max-age and friends.
+scheduler = RescanScheduler()
+# Phase timings and error counts of every probe made during this run.
+metrics = ScanMetrics()
+# (index, count) from --shard: only probe MX hosts in this shard.
+shard = None
+# Where tls_connect() talks SMTP; only ever changed for testing.
+smtp_port = SMTP_PORT
+# Per-step network timeout of tls_connect(), in seconds; set from --timeout.
+timeout = 10
+
+def get_trust_store():
+  """Return the trust roots to validate against, loading them on first use."""
+  global trust_store
+  if trust_store is None:
+    trust_store = TrustStore()
+  return trust_store
+
+def get_store():
+  """Return the observation store, opening it on first use."""
+  global store
+  if store is None:
+    store = ObservationStore(CERTS_OBSERVED, get_trust_store())
+  return store
+
+def tls_connect(mx_host):
+  """Negotiate STARTTLS with mx_host and record what the server presented.
+
+  Each MX host is only probed once per run, however many domains use it."""
+  if mx_host in probed:
+    return
+  probed.add(mx_host)
+  start = metrics.clock()
   try:
-    # The file contains both the leaf cert and any intermediates, so we pass it
-    # as both the cert to validate and as the "untrusted" chain.
-    output = subprocess.check_output("""openssl verify -CApath /home/jsha/mozilla/ -purpose sslserver \
-              -untrusted "%s" \
-              "%s"
-             """ % (filename, filename), shell = True)
-    return True
-  except subprocess.CalledProcessError:
-    return False
-
-def check_certs(mail_domain):
-  """
-  Return "" if any certs for any mx domains pointed to by mail_domain
-  were invalid, and a public suffix for one if they were all valid
-  """
-  dir = os.path.join(CERTS_OBSERVED, mail_domain)
-  if not os.path.exists(dir):
-    collect(mail_domain)
-  names = set()
-  for mx_hostname in os.listdir(dir):
-    filename = os.path.join(dir, mx_hostname)
-    if not valid_cert(filename):
-      return ""
-    else:
-      new_names = extract_names_from_openssl_output(filename)
-      new_names = set(public_suffix_list.get_public_suffix(n) for n in new_names)
-      names.update(new_names)
-  if len(names) >= 1:
-    # Hack: Just pick an arbitrary suffix for now. Do something cleverer later.
-    return names.pop()
-  else:
-    return ""
-
-def common_suffix(hosts):
-  num_components = min(len(h.split(".")) for h in hosts)
-  longest_suffix = ""
-  for i in range(1, num_components + 1):
-    suffixes = set(".".join(h.split(".")[-i:]) for h in hosts)
-    if len(suffixes) == 1:
-      longest_suffix = suffixes.pop()
-    else:
-      return longest_suffix
-  return longest_suffix
-
-def extract_names_from_openssl_output(certificates_file):
-  openssl_output = open(certificates_file, "r").read()
-  cert = re.findall("-----BEGIN CERTIFICATE-----.*?-----END CERTIFICATE-----", openssl_output, flags = re.DOTALL)
-  return extract_names(cert[0])
-
-def supports_starttls(mx_host):
+    # Resolved here rather than by the probe so that the lookup goes through
+    # the shared resolver's cache.
+    with metrics.span("dns"):
+      try:
+        answers = resolver.resolve(mx_host, 'A')
+      except dns.resolver.NoAnswer:
+        answers = resolver.resolve(mx_host, 'AAAA')
+      address = str(answers[0])
+  except dns.exception.DNSException as e:
+    print("Address lookup for %s failed: %s" % (mx_host, e))
+    get_store().record_failure(mx_host, "address lookup failed: %s" % e)
+    metrics.host_done(False, metrics.clock() - start)
+    return
   try:
-    smtpserver = smtplib.SMTP(mx_host, 25, timeout = 2)
-    smtpserver.ehlo()
-    smtpserver.starttls()
-    return True
-    print "Success: %s" % mx_host
-  except socket.error as e:
-    print "Connection to %s failed: %s" % (mx_host, e.strerror)
-    return False
-  except smtplib.SMTPException, e:
-    # In order to talk to some hosts, you need to run this from a host that has a
-    # reverse DNS entry. AWS instances all have reverse DNS, as an example.
-    if e[0] == 554:
-      print e[1]
-    else:
-      print "No STARTTLS support on %s" % mx_host, e[0]
-    return False
-
-def min_tls_version(mail_domain):
-  protocols = []
-  for mx_hostname in os.listdir(os.path.join(CERTS_OBSERVED, mail_domain)):
-    filename = os.path.join(CERTS_OBSERVED, mail_domain, mx_hostname)
-    contents = open(filename).read()
-    protocol = re.findall("Protocol  : (.*)", contents)[0]
-    protocols.append(protocol)
-  return min(protocols)
+    observation = asyncio.run(probe(mx_host, address, smtp_port, timeout,
+                                    metrics=metrics))
+  except PROBE_ERRORS as e:
+    reason = describe_failure(mx_host, e)
+    print(reason)
+    get_store().record_failure(mx_host, reason, address=address)
+    metrics.host_done(False, metrics.clock() - start)
+    return
+  metrics.host_done(True, metrics.clock() - start)
+  get_store().record_observation(observation)
 
 def collect(mail_domain):
   """
   Attempt to connect to each MX hostname for mail_doman and negotiate STARTTLS.
-  Store the output in a directory with the same name as mail_domain to make
-  subsequent analysis faster.
+  Record the domain's MX set and each result in the observation store to make
+  subsequent analysis faster.  MX hosts whose stored results are still fresh
+  are not probed again.
   """
-  print "Checking domain %s" % mail_domain
-  mkdirp(os.path.join(CERTS_OBSERVED, mail_domain))
-  answers = dns.resolver.query(mail_domain, 'MX')
-  for rdata in answers:
-      mx_host = str(rdata.exchange).rstrip(".")
-      tls_connect(mx_host, mail_domain)
+  print("Checking domain %s" % mail_domain)
+  try:
+    answers = resolver.resolve(mail_domain, 'MX')
+  except dns.exception.DNSException as e:
+    get_store().record_domain(mail_domain, [], str(e))
+    return
+  mx_hosts = [str(rdata.exchange).rstrip(".").lower() for rdata in answers]
+  mx_hosts = [mx_host for mx_host in mx_hosts if mx_host]
+  get_store().record_domain(mail_domain, mx_hosts)
+  if shard is not None:
+    mx_hosts = [mx_host for mx_host in mx_hosts
+                if shard_of(mx_host, shard[1]) == shard[0]]
+  for mx_host in scheduler.due(get_store(), mx_hosts):
+    tls_connect(mx_host)
+  get_store().commit()
 
 if __name__ == '__main__':
   """Consume a target list of domains and output a configuration file for those domains."""
-  if len(sys.argv) < 2:
-    print("Usage: CheckSTARTTLS.py list-of-domains.txt > output.json")
-
-  config = collections.defaultdict(dict)
-
-  for input in sys.argv[1:]:
+  parser = argparse.ArgumentParser(
+    description="Check the MX hosts of a list of mail domains for STARTTLS "
+    "support and write policy list entries for those that qualify",
+    usage="%(prog)s [options] list-of-domains.txt > policy.json")
+  parser.add_argument("domain_lists", nargs="+", metavar="list-of-domains.txt")
+  parser.add_argument("--store", default=CERTS_OBSERVED,
+    help="observation database to read and record results in "
+    "(default: %(default)s)")
+  parser.add_argument("--async", action="store_true", dest="use_async",
+    help="probe all MX hosts concurrently before analysing them")
+  parser.add_argument("--concurrency", type=int, default=100,
+    help="maximum probes in flight in --async mode (default: %(default)s)")
+  parser.add_argument("--per-ip", type=int, default=2,
+    help="maximum probes in flight per destination address in --async mode "
+    "(default: %(default)s)")
+  parser.add_argument("--timeout", type=float, default=timeout,
+    help="per-step network timeout in seconds (default: %(default)s)")
+  parser.add_argument("--max-age", type=float, default=7,
+    help="re-probe MX hosts whose last result is older than this many days "
+    "(default: %(default)s)")
+  parser.add_argument("--expiry-window", type=float, default=14,
+    help="re-probe MX hosts whose certificate expires within this many days "
+    "(default: %(default)s)")
+  parser.add_argument("--retry-after", type=float, default=1,
+    help="hours to wait before re-probing a failed MX host; doubled after "
+    "each further failure (default: %(default)s)")
+  parser.add_argument("--max-retry-after", type=float, default=7,
+    help="longest wait, in days, before re-probing a failing MX host "
+    "(default: %(default)s)")
+  parser.add_argument("--metrics-json",
+    help="write a JSON summary of probe phase timings and errors here at the "
+    "end of the run")
+  parser.add_argument("--metrics-file",
+    help="keep a Prometheus text-format file of scan metrics updated here "
+    "during the run")
+  parser.add_argument("--metrics-interval", type=float, default=15,
+    help="seconds between updates of --metrics-file (default: %(default)s)")
+  parser.add_argument("--shard", metavar="I/N",
+    help="only probe the MX hosts in shard I of N (counting from 0) and skip "
+    "the policy output; combine the workers' stores with --merge")
+  parser.add_argument("--merge", nargs="+", metavar="STORE",
+    help="instead of scanning, merge these per-shard stores into --store and "
+    "write the policy list for the combined results")
+  parser.add_argument("--policy",
+    help="existing policy list whose policy-aliases domains may refer to")
+  parser.add_argument("--mode", choices=["testing", "enforce"],
+    default="testing",
+    help="mode of newly generated policies (default: %(default)s)")
+  parser.add_argument("--ca-file",
+    help="PEM bundle of trust roots (default: the system bundle)")
+  parser.add_argument("--ca-path",
+    help="directory of hashed trust root symlinks, as for openssl -CApath")
+  args = parser.parse_args()
+  if args.shard:
+    try:
+      index, count = [int(n) for n in args.shard.split("/")]
+    except ValueError:
+      parser.error("--shard must look like 0/4")
+    if not 0 <= index < count:
+      parser.error("--shard index must be between 0 and N-1")
+    shard = (index, count)
+  if args.shard and args.merge:
+    parser.error("--shard and --merge are exclusive")
+  if args.ca_file or args.ca_path:
+    trust_store = TrustStore(args.ca_file, args.ca_path)
+  store = ObservationStore(args.store, get_trust_store())
+  timeout = args.timeout
+  scheduler = RescanScheduler(max_age=args.max_age * DAY,
+                              expiry_window=args.expiry_window * DAY,
+                              retry_after=args.retry_after * 60 * 60,
+                              max_retry_after=args.max_retry_after * DAY)
+
+  domains = []
+  for input in args.domain_lists:
     for domain in open(input).readlines():
       domain = domain.strip()
-      suffix = check_certs(domain)
-      if suffix != "":
-        min_version = min_tls_version(domain)
-        suffix_match = "." + suffix
-        config["acceptable-mxs"][domain] = {
-          "accept-mx-domains": [suffix_match]
-        }
-        config["tls-policies"][suffix_match] = {
-          "require-tls": True,
-          "min-tls-version": min_version
-        }
-
-  print json.dumps(config, indent=2, sort_keys=True)
+      if domain:
+        domains.append(domain)
+
+  if args.merge:
+    # Sorted, so that the result doesn't depend on the order given.
+    for path in sorted(args.merge):
+      store.merge(path)
+  elif args.use_async:
+    engine = ScanEngine(store, concurrency=args.concurrency,
+                        per_ip=args.per_ip, timeout=args.timeout,
+                        scheduler=scheduler, metrics=metrics,
+                        metrics_file=args.metrics_file,
+                        metrics_interval=args.metrics_interval, shard=shard)
+    engine.run(domains)
+  else:
+    exported = metrics.clock()
+    for domain in domains:
+      collect(domain)
+      if args.metrics_file and \
+          metrics.clock() - exported >= args.metrics_interval:
+        metrics.write_prometheus(args.metrics_file)
+        exported = metrics.clock()
+    if args.metrics_file:
+      metrics.write_prometheus(args.metrics_file)
+  if args.metrics_json:
+    with open(args.metrics_json, "w") as f:
+      json.dump(metrics.summary(), f, indent=2)
+  if shard is not None:
+    store.close()
+    sys.exit(0)
+
+  aliases = {}
+  if args.policy:
+    with open(args.policy) as f:
+      aliases = json.load(f).get("policy-aliases", {})
+  generator = PolicyGenerator(store, aliases, args.mode, public_suffix_list)
+  policy_list = generator.document(domains)
+  store.close()
+  print(json.dumps(policy_list, indent=2))
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Content-addressed checkpoints of the files a configuration run changes.
+
+A snapshot maps each file to the sha256 of its contents (None if it doesn't
+exist), and every version of a file is kept once, as objects/<sha256>,
+however many snapshots refer to it.  A run begins by recording the snapshot
+before it changes anything as pending; finishing it records a checkpoint of
+the before and after snapshots if they differ.  Rolling back restores the
+before snapshot of a checkpoint by copying back only the files whose
+contents differ, and an interrupted run can be undone from its pending
+snapshot.
+
+  <directory>/objects/<sha256>     file contents
+  <directory>/checkpoints.json     {"current": the snapshot after the last
+                                    run, "checkpoints": [{"title", "time",
+                                    "before", "after"}, oldest first]}
+  <directory>/pending.json         the before snapshot of an unfinished run
+
+The objects of the current snapshot are kept too, so a run that changes
+nothing doesn't have to store them again.
+"""
+import hashlib
+import json
+import os
+import time
+
+from AtomicWrite import atomic_write
+
+MAX_CHECKPOINTS = 20
+
+
+class CheckpointError(Exception):
+    pass
+
+
+class CheckpointStore(object):
+    """Checkpoints kept in @directory, which is created if need be."""
+
+    def __init__(self, directory, max_checkpoints=MAX_CHECKPOINTS):
+        self.directory = directory
+        self.objects = os.path.join(directory, "objects")
+        self.index = os.path.join(directory, "checkpoints.json")
+        self.pending_file = os.path.join(directory, "pending.json")
+        self.max_checkpoints = max_checkpoints
+
+    def _object(self, digest):
+        return os.path.join(self.objects, digest)
+
+    def read(self, digest):
+        """Return the contents stored as @digest."""
+        try:
+            with open(self._object(digest), "rb") as f:
+                return f.read()
+        except (IOError, OSError) as e:
+            raise CheckpointError("missing snapshot %s: %s" % (digest, e))
+
+    def _load(self, path, default):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (IOError, OSError):
+            return default
+        except ValueError as e:
+            raise CheckpointError("%s is corrupt: %s" % (path, e))
+
+    def _save(self, path, value):
+        atomic_write(path, json.dumps(value, indent=2).encode("utf-8"), 0o600)
+
+    def snapshot(self, paths):
+        """Store the current contents of the files at @paths; return their
+        snapshot."""
+        os.makedirs(self.objects, mode=0o700, exist_ok=True)
+        state = {}
+        for path in paths:
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+            except FileNotFoundError:
+                state[path] = None
+                continue
+            digest = hashlib.sha256(data).hexdigest()
+            if not os.path.exists(self._object(digest)):
+                atomic_write(self._object(digest), data, 0o600)
+            state[path] = digest
+        return state
+
+    def begin(self, state):
+        """Record @state as the snapshot before a run, unless an unfinished
+        run already recorded one."""
+        if self.pending() is None:
+            self._save(self.pending_file, state)
+
+    def pending(self):
+        """Return the before snapshot of the unfinished run, or None."""
+        return self._load(self.pending_file, None)
+
+    def _load_index(self):
+        return self._load(self.index, {"current": None, "checkpoints": []})
+
+    def checkpoints(self):
+        """Return the checkpoints, oldest first."""
+        return self._load_index()["checkpoints"]
+
+    def finish(self, after, title=None):
+        """End the pending run, its files now as in the snapshot @after.
+
+        Records a checkpoint if anything changed; returns the before
+        snapshot, or None if no run was pending.
+        """
+        before = self.pending()
+        if before is None:
+            return None
+        index = self._load_index()
+        if before != after:
+            index["checkpoints"].append({"title": title,
+                                         "time": int(time.time()),
+                                         "before": before, "after": after})
+            del index["checkpoints"][:-self.max_checkpoints]
+        index["current"] = after
+        self._save(self.index, index)
+        os.unlink(self.pending_file)
+        self._prune()
+        return before
+
+    def restore(self, state):
+        """Put every file in @state back as it was; return the paths that had
+        to change."""
+        changed = []
+        for path, digest in sorted(state.items()):
+            try:
+                with open(path, "rb") as f:
+                    current = hashlib.sha256(f.read()).hexdigest()
+            except FileNotFoundError:
+                current = None
+            if current == digest:
+                continue
+            if digest is None:
+                os.unlink(path)
+            else:
+                atomic_write(path, self.read(digest))
+            changed.append(path)
+        return changed
+
+    def rollback(self, count=1):
+        """Undo the last @count checkpoints; return the paths restored."""
+        index = self._load_index()
+        checkpoints = index["checkpoints"]
+        if count < 1 or count > len(checkpoints):
+            raise CheckpointError("can't roll back %d of %d checkpoints" %
+                                  (count, len(checkpoints)))
+        index["current"] = checkpoints[-count]["before"]
+        changed = self.restore(index["current"])
+        del checkpoints[-count:]
+        self._save(self.index, index)
+        self._prune()
+        return changed
+
+    def recover(self):
+        """Undo an unfinished run; return the paths restored."""
+        before = self.pending()
+        if before is None:
+            return []
+        changed = self.restore(before)
+        index = self._load_index()
+        index["current"] = before
+        self._save(self.index, index)
+        os.unlink(self.pending_file)
+        self._prune()
+        return changed
+
+    def _prune(self):
+        """Remove the objects no snapshot refers to."""
+        index = self._load_index()
+        states = [self.pending() or {}, index["current"] or {}]
+        for checkpoint in index["checkpoints"]:
+            states.extend((checkpoint["before"], checkpoint["after"]))
+        used = set(digest for state in states for digest in state.values())
+        try:
+            names = os.listdir(self.objects)
+        except FileNotFoundError:
+            return
+        for name in names:
+            if name not in used and not name.startswith("."):
+                os.unlink(os.path.join(self.objects, name))
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Read the lines a log gained since the last run, across rotations.
+
+Progress is checkpointed as the inode of the log and the byte offset after
+the last complete line read from it, with a digest of the file's first bytes
+(up to HEAD_BYTES of those already read) to tell the same file from another
+that reused its inode.  A run seeks straight to that offset, so it costs
+what the log grew by, not what it holds.
+
+If the log has been rotated since, the rest of the old file is read first,
+from the first of ROTATED_SUFFIXES whose head matches: "mail.log.1" as
+logrotate leaves it with delaycompress, or "mail.log.1.gz" without.  A file
+copied and truncated in place (copytruncate) is found the same way.  If no
+rotated file matches, it was rotated more than once and the lines in
+between are skipped.
+
+A trailing partial line, one still being written, is left for the next run,
+except at the end of a rotated file.  The offset advances a chunk at a time,
+once every line of the chunk has been handed out and the next one asked for,
+so lines being handled when a run is interrupted are read again.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import time
+
+from AtomicWrite import atomic_write
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1 << 20
+HEAD_BYTES = 1024
+ROTATED_SUFFIXES = (".1", ".1.gz")
+
+
+def _digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _open_rotated(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+class LogReader(object):
+    """The log at @path, checkpointed in @checkpoint_file (if not None)."""
+
+    def __init__(self, path, checkpoint_file=None, chunk_size=CHUNK_SIZE):
+        self.path = path
+        self.checkpoint_file = checkpoint_file
+        self.chunk_size = chunk_size
+        self._file = None
+        self._inode = None
+        self.offset = 0
+        self.skipped = False
+        # The (inode, offset) the checkpoint file holds, if known.
+        self._saved = None
+
+    def load(self):
+        """Return the saved checkpoint, or None."""
+        if self.checkpoint_file is None:
+            return None
+        try:
+            with open(self.checkpoint_file) as f:
+                checkpoint = json.load(f)
+            return {key: checkpoint[key] for key in
+                    ("inode", "offset", "head", "head_length")}
+        except (IOError, OSError):
+            return None
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning("Ignoring corrupt checkpoint %s: %s",
+                           self.checkpoint_file, e)
+            return None
+
+    def checkpoint(self):
+        """Return the checkpoint for the lines read so far."""
+        head_length = min(HEAD_BYTES, self.offset)
+        head = os.pread(self._file.fileno(), head_length, 0)
+        return {"path": self.path, "inode": self._inode,
+                "offset": self.offset, "head": _digest(head),
+                "head_length": head_length}
+
+    def save(self):
+        """Checkpoint the lines read so far, if they came from a file and
+        the checkpoint has moved."""
+        if self.checkpoint_file is None or self._file is None:
+            return
+        state = (self._inode, self.offset)
+        if state == self._saved:
+            return
+        path = self.checkpoint_file
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        atomic_write(path, json.dumps(self.checkpoint()).encode("utf-8"))
+        self._saved = state
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _open(self):
+        """Open the log from the start; returns whether it exists."""
+        self.close()
+        try:
+            self._file = open(self.path, "rb")
+        except FileNotFoundError:
+            return False
+        self._inode = os.fstat(self._file.fileno()).st_ino
+        self.offset = 0
+        return True
+
+    def _head_matches(self, f, saved):
+        f.seek(0)
+        return _digest(f.read(saved["head_length"])) == saved["head"]
+
+    def _read(self, f, final):
+        """Yield the complete lines of @f from its position on, and with
+        @final, the partial line it ends with.  Without @final, @f is left
+        at the end of the last complete line."""
+        pending = b""
+        while True:
+            chunk = f.read(self.chunk_size)
+            if not chunk:
+                break
+            data = pending + chunk
+            end = data.rfind(b"\n") + 1
+            pending = data[end:]
+            if end:
+                yield from data[:end].splitlines(True)
+                if f is self._file:
+                    self.offset += end
+        if pending:
+            if final:
+                yield pending
+            else:
+                f.seek(self.offset)
+
+    def _rotated(self, saved):
+        """Return the rotated file the checkpoint @saved was in, positioned
+        there, or None."""
+        for suffix in ROTATED_SUFFIXES:
+            try:
+                f = _open_rotated(self.path + suffix)
+            except (IOError, OSError):
+                continue
+            try:
+                if self._head_matches(f, saved):
+                    f.seek(saved["offset"])
+                    if f.tell() == saved["offset"]:
+                        return f
+            except (IOError, OSError, EOFError) as e:
+                logger.warning("Can't read %s: %s", self.path + suffix, e)
+            f.close()
+        return None
+
+    def lines(self):
+        """Yield the lines added to the log since the checkpoint (all of
+        them, if there isn't one).  A log that doesn't exist has none."""
+        saved = self.load()
+        if not self._open():
+            logger.info("%s doesn't exist", self.path)
+            return
+        if saved is None:
+            yield from self._read(self._file, False)
+            return
+        size = os.fstat(self._file.fileno()).st_size
+        if (saved["inode"] == self._inode and saved["offset"] <= size and
+                self._head_matches(self._file, saved)):
+            self._file.seek(saved["offset"])
+            self.offset = saved["offset"]
+            self._saved = (self._inode, self.offset)
+        else:
+            rotated = self._rotated(saved)
+            if rotated is None:
+                logger.warning("%s was rotated more than once since it was "
+                               "checkpointed; some lines were skipped",
+                               self.path)
+                self.skipped = True
+            else:
+                with rotated:
+                    yield from self._read(rotated, True)
+            self._file.seek(0)
+        yield from self._read(self._file, False)
+
+    def _rotated_away(self):
+        """Whether the log file is no longer the one being read."""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            # Between the rename and the new file being created.
+            return False
+        return st.st_ino != self._inode
+
+    def follow(self, interval=1.0):
+        """Yield the lines added since the checkpoint, then each line as it
+        is written, forever.  The checkpoint is saved whenever the lines
+        read so far have been handled."""
+        yield from self.lines()
+        while True:
+            self.save()
+            time.sleep(interval)
+            if self._file is None:
+                if not self._open():
+                    continue
+            elif self._rotated_away():
+                yield from self._read(self._file, True)
+                if not self._open():
+                    continue
+            elif os.fstat(self._file.fileno()).st_size < self.offset:
+                logger.warning("%s was truncated", self.path)
+                self._file.seek(0)
+                self.offset = 0
+            yield from self._read(self._file, False)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Cached, concurrent MX and address resolution for the scanner.
+
+Many mail domains share their MX hosts (hosted Google, Outlook and Yahoo mail
+in particular), so a scan should look each name up once and probe each MX
+once.  MXResolver keeps answers for as long as their TTL allows, coalesces
+concurrent lookups of the same name, and resolves a batch of domains into a
+map of MX host -> mail domains that use it.
+"""
+import asyncio
+import collections
+import time
+
+import dns.asyncresolver
+import dns.exception
+import dns.rdatatype
+import dns.resolver
+
+# How long to remember that a name doesn't exist or has no records of a type,
+# when the answer doesn't carry an SOA to take a negative TTL from.
+NEGATIVE_TTL = 300
+
+
+def _negative_ttl(error):
+    """The negative-caching TTL (RFC 2308) for a failed lookup, if any."""
+    response = None
+    if isinstance(error, dns.resolver.NXDOMAIN):
+        responses = error.responses()
+        response = next(iter(responses.values()), None) if responses else None
+    elif isinstance(error, dns.resolver.NoAnswer):
+        response = error.response()
+    if response is None:
+        return NEGATIVE_TTL
+    for rrset in response.authority:
+        if rrset.rdtype == dns.rdatatype.SOA:
+            return min(rrset.ttl, rrset[0].minimum)
+    return NEGATIVE_TTL
+
+
+class MXResolver(object):
+    """Resolve MX and address records through a TTL-respecting cache.
+
+    @resolver is a dns.asyncresolver.Resolver (the system configuration by
+    default) and @concurrency bounds the number of queries in flight.
+    """
+
+    def __init__(self, resolver=None, concurrency=50, clock=time.monotonic):
+        self.resolver = resolver or dns.asyncresolver.Resolver()
+        self.concurrency = concurrency
+        self.clock = clock
+        # (name, rdtype) -> (expiry, list of rdata or DNSException)
+        self._cache = {}
+        # (name, rdtype) -> Future for lookups currently in flight
+        self._pending = {}
+        self._limit = None
+
+    async def lookup(self, name, rdtype):
+        """Return the rdata list for @name/@rdtype, from cache if fresh.
+
+        Raises dns.exception.DNSException if the lookup fails; negative
+        answers are cached too.
+        """
+        key = (name.lower().rstrip("."), rdtype)
+        cached = self._cache.get(key)
+        if cached is not None and cached[0] > self.clock():
+            result = cached[1]
+        elif key in self._pending:
+            result = await asyncio.shield(self._pending[key])
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self._pending[key] = future
+            try:
+                result = await self._query(key[0], rdtype)
+                future.set_result(result)
+            except BaseException as e:
+                future.set_exception(e)
+                # Don't leave "exception was never retrieved" warnings behind
+                # when nobody else was waiting on this lookup.
+                future.exception()
+                raise
+            finally:
+                del self._pending[key]
+        if isinstance(result, dns.exception.DNSException):
+            raise result
+        return result
+
+    async def _query(self, name, rdtype):
+        if self._limit is None:
+            self._limit = asyncio.Semaphore(self.concurrency)
+        async with self._limit:
+            try:
+                answer = await self.resolver.resolve(name, rdtype)
+            except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer) as e:
+                self._cache[(name, rdtype)] = (
+                    self.clock() + _negative_ttl(e), e)
+                return e
+        records = list(answer)
+        self._cache[(name, rdtype)] = (self.clock() + answer.rrset.ttl, records)
+        return records
+
+    async def mx_hosts(self, mail_domain):
+        """Return the MX hostnames of @mail_domain, most preferred first."""
+        records = await self.lookup(mail_domain, "MX")
+        records = sorted(records, key=lambda rdata: rdata.preference)
+        hosts = [str(rdata.exchange).rstrip(".").lower() for rdata in records]
+        # A "null MX" (RFC 7505) of "." means the domain accepts no mail.
+        return [host for host in hosts if host]
+
+    async def addresses(self, host):
+        """Return the IPv4 addresses of @host, or IPv6 if it has none."""
+        try:
+            records = await self.lookup(host, "A")
+        except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
+            records = await self.lookup(host, "AAAA")
+        return [rdata.address for rdata in records]
+
+    async def map_domains(self, mail_domains):
+        """Resolve every domain in @mail_domains concurrently.
+
+        Returns (mx_to_domains, failures): a dict of MX host -> list of mail
+        domains that use it, in input order, and a dict of mail domain ->
+        DNSException for domains whose MX lookup failed.
+        """
+        results = await asyncio.gather(
+            *[self.mx_hosts(d) for d in mail_domains], return_exceptions=True)
+        mx_to_domains = collections.OrderedDict()
+        failures = {}
+        for mail_domain, result in zip(mail_domains, results):
+            if isinstance(result, dns.exception.DNSException):
+                failures[mail_domain] = result
+                continue
+            elif isinstance(result, BaseException):
+                raise result
+            for mx_host in result:
+                mx_to_domains.setdefault(mx_host, []).append(mail_domain)
+        return mx_to_domains, failures
@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""
+Indexed store of scan results.
+
+Scans used to leave raw s_client output in certs-observed/<domain>/<mx> files
+that every analysis pass re-read and re-parsed.  ObservationStore keeps the
+same information in one SQLite file instead:
+
+  domains       one row per mail domain: when its MX set was last resolved,
+                and the lookup error if it failed
+  domain_mxs    the MX hosts each domain resolved to
+  observations  one row per probe of an MX host, keyed by host and scan time:
+                negotiated protocol and cipher, validation verdict, or the
+                reason the probe failed
+  chains        each distinct certificate chain once, as DER, with the leaf's
+                DNS names and earliest notAfter parsed out
+  scan_queue    MX hosts a scan has planned to probe but not yet recorded, so
+                that an interrupted scan can pick up where it stopped
+
+Observations are only ever appended, so the history of a host is kept and a
+corpus of millions of observations is a single file.
+"""
+import collections
+import hashlib
+import sqlite3
+import struct
+import time
+
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS domains (
+    domain TEXT PRIMARY KEY,
+    resolved_at REAL NOT NULL,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS domain_mxs (
+    domain TEXT NOT NULL,
+    mx_host TEXT NOT NULL,
+    PRIMARY KEY (domain, mx_host)
+);
+CREATE INDEX IF NOT EXISTS domain_mxs_by_mx ON domain_mxs (mx_host);
+CREATE TABLE IF NOT EXISTS chains (
+    id INTEGER PRIMARY KEY,
+    digest BLOB NOT NULL UNIQUE,
+    der BLOB NOT NULL,
+    names TEXT NOT NULL,
+    not_after REAL
+);
+CREATE TABLE IF NOT EXISTS observations (
+    id INTEGER PRIMARY KEY,
+    mx_host TEXT NOT NULL,
+    scanned_at REAL NOT NULL,
+    address TEXT,
+    protocol TEXT,
+    cipher TEXT,
+    chain_id INTEGER REFERENCES chains (id),
+    valid INTEGER,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS observations_by_mx
+    ON observations (mx_host, scanned_at);
+CREATE TABLE IF NOT EXISTS scan_queue (
+    mx_host TEXT PRIMARY KEY
+);
+"""
+
+# A stored probe result.  @names is the frozenset of DNS names the leaf
+# certificate is valid for, @valid is True/False (None if never validated) and
+# @error is why the probe failed, in which case the TLS fields are None.
+StoredObservation = collections.namedtuple("StoredObservation", [
+    "mx_host", "scanned_at", "address", "protocol", "cipher", "chain_id",
+    "names", "not_after", "valid", "error"])
+
+_OBSERVATION_COLUMNS = """
+    o.mx_host, o.scanned_at, o.address, o.protocol, o.cipher, o.chain_id,
+    c.names, c.not_after, o.valid, o.error
+"""
+
+
+def pack_chain(chain):
+    """Serialize a list of DER certificates into one blob."""
+    return b"".join(struct.pack(">I", len(der)) + der for der in chain)
+
+
+def unpack_chain(blob):
+    chain = []
+    offset = 0
+    while offset < len(blob):
+        length, = struct.unpack_from(">I", blob, offset)
+        offset += 4
+        chain.append(bytes(blob[offset:offset + length]))
+        offset += length
+    return chain
+
+
+def leaf_names(der):
+    """Return the set of DNS names in a DER leaf cert's CN and SAN."""
+    leaf = x509.load_der_x509_certificate(der)
+    # Certs have a "subject" identified by a Distingushed Name (DN).
+    # Host certs should also have a Common Name (CN) with a DNS name.
+    names = set(attr.value for attr in
+                leaf.subject.get_attributes_for_oid(NameOID.COMMON_NAME))
+    try:
+        # The SAN extension allows one cert to cover multiple domains
+        # and permits DNS wildcards.
+        san = leaf.extensions.get_extension_for_class(
+            x509.SubjectAlternativeName).value
+        names.update(san.get_values_for_type(x509.DNSName))
+    except x509.ExtensionNotFound:
+        pass
+    return set(name.lower() for name in names)
+
+
+def _not_after(chain):
+    certs = [x509.load_der_x509_certificate(der) for der in chain]
+    return min(cert.not_valid_after_utc.timestamp() for cert in certs)
+
+
+def _row_to_observation(row):
+    row = list(row)
+    row[6] = frozenset(row[6].split()) if row[6] is not None else frozenset()
+    if row[8] is not None:
+        row[8] = bool(row[8])
+    return StoredObservation(*row)
+
+
+class ObservationStore(object):
+    """Scan results in an SQLite database at @path.
+
+    If @trust_store (a ChainValidator.TrustStore) is given, observations are
+    validated as they are recorded.  Writes are committed every
+    @commit_every records and by commit()/close().
+    """
+
+    def __init__(self, path, trust_store=None, commit_every=500):
+        self.path = path
+        self.trust_store = trust_store
+        self.commit_every = commit_every
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+        self._uncommitted = 0
+        # digest -> chain id, for chains written by this process
+        self._chain_ids = {}
+
+    def commit(self):
+        self.db.commit()
+        self._uncommitted = 0
+
+    def close(self):
+        self.commit()
+        self.db.close()
+
+    def _wrote(self):
+        self._uncommitted += 1
+        if self._uncommitted >= self.commit_every:
+            self.commit()
+
+    def record_domain(self, domain, mx_hosts, error=None, resolved_at=None):
+        """Record that @domain resolved to @mx_hosts (or failed with @error)."""
+        if resolved_at is None:
+            resolved_at = time.time()
+        self.db.execute(
+            "INSERT OR REPLACE INTO domains (domain, resolved_at, error) "
+            "VALUES (?, ?, ?)", (domain, resolved_at, error))
+        self.db.execute("DELETE FROM domain_mxs WHERE domain = ?", (domain,))
+        self.db.executemany(
+            "INSERT OR IGNORE INTO domain_mxs (domain, mx_host) VALUES (?, ?)",
+            [(domain, mx_host) for mx_host in mx_hosts])
+        self._wrote()
+
+    def _chain_id(self, chain):
+        digest = hashlib.sha256(pack_chain(chain)).digest()
+        chain_id = self._chain_ids.get(digest)
+        if chain_id is not None:
+            return chain_id
+        row = self.db.execute("SELECT id FROM chains WHERE digest = ?",
+                              (digest,)).fetchone()
+        if row is not None:
+            chain_id = row[0]
+        else:
+            try:
+                names = " ".join(sorted(leaf_names(chain[0])))
+                not_after = _not_after(chain)
+            except ValueError:
+                names, not_after = "", None
+            chain_id = self.db.execute(
+                "INSERT INTO chains (digest, der, names, not_after) "
+                "VALUES (?, ?, ?, ?)",
+                (digest, pack_chain(chain), names, not_after)).lastrowid
+        self._chain_ids[digest] = chain_id
+        return chain_id
+
+    def record_observation(self, observation, scanned_at=None):
+        """Record a successful probe (a STARTTLSProbe.Observation)."""
+        if scanned_at is None:
+            scanned_at = time.time()
+        chain_id = self._chain_id(observation.chain) if observation.chain \
+            else None
+        valid = None
+        if self.trust_store is not None:
+            valid = self.trust_store.is_valid(observation.chain, scanned_at)
+        self.db.execute(
+            "INSERT INTO observations (mx_host, scanned_at, address, "
+            "protocol, cipher, chain_id, valid) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (observation.mx_host, scanned_at, observation.address,
+             observation.protocol, observation.cipher, chain_id, valid))
+        self.db.execute("DELETE FROM scan_queue WHERE mx_host = ?",
+                        (observation.mx_host,))
+        self._wrote()
+
+    def record_failure(self, mx_host, error, scanned_at=None, address=None):
+        """Record that probing @mx_host failed, with reason @error."""
+        if scanned_at is None:
+            scanned_at = time.time()
+        self.db.execute(
+            "INSERT INTO observations (mx_host, scanned_at, address, error) "
+            "VALUES (?, ?, ?, ?)", (mx_host, scanned_at, address, error))
+        self.db.execute("DELETE FROM scan_queue WHERE mx_host = ?", (mx_host,))
+        self._wrote()
+
+    def enqueue(self, mx_hosts):
+        """Plan probes of @mx_hosts; each leaves the queue once recorded."""
+        self.db.executemany("INSERT OR IGNORE INTO scan_queue VALUES (?)",
+                            [(mx_host,) for mx_host in mx_hosts])
+        self.commit()
+
+    def queued(self):
+        """Return the MX hosts planned by a scan but not yet recorded."""
+        return [row[0] for row in self.db.execute(
+            "SELECT mx_host FROM scan_queue ORDER BY mx_host")]
+
+    def domain_mxs(self, domain):
+        """Return the MX hosts recorded for @domain, or None if never scanned."""
+        if self.db.execute("SELECT 1 FROM domains WHERE domain = ?",
+                           (domain,)).fetchone() is None:
+            return None
+        return [row[0] for row in self.db.execute(
+            "SELECT mx_host FROM domain_mxs WHERE domain = ? ORDER BY mx_host",
+            (domain,))]
+
+    def latest(self, mx_host):
+        """Return the most recent StoredObservation of @mx_host, or None."""
+        row = self.db.execute(
+            "SELECT %s FROM observations o LEFT JOIN chains c "
+            "ON c.id = o.chain_id WHERE o.mx_host = ? "
+            "ORDER BY o.scanned_at DESC, o.id DESC LIMIT 1"
+            % _OBSERVATION_COLUMNS, (mx_host,)).fetchone()
+        return _row_to_observation(row) if row is not None else None
+
+    def history(self, mx_host):
+        """Return (latest StoredObservation or None, failure streak).
+
+        The streak is the number of failed probes of @mx_host since its last
+        successful one.
+        """
+        latest = self.latest(mx_host)
+        if latest is None:
+            return None, 0
+        last_success = self.db.execute(
+            "SELECT MAX(scanned_at) FROM observations "
+            "WHERE mx_host = ? AND error IS NULL", (mx_host,)).fetchone()[0]
+        streak = self.db.execute(
+            "SELECT COUNT(*) FROM observations WHERE mx_host = ? "
+            "AND error IS NOT NULL AND scanned_at > ?",
+            (mx_host, last_success if last_success is not None else -1)
+        ).fetchone()[0]
+        return latest, streak
+
+    def domain_observations(self, domain):
+        """Return {mx_host: latest StoredObservation or None} for @domain."""
+        return dict((mx_host, self.latest(mx_host))
+                    for mx_host in self.domain_mxs(domain) or [])
+
+    def chain(self, chain_id):
+        """Return the DER certificates of a stored chain, leaf first."""
+        row = self.db.execute("SELECT der FROM chains WHERE id = ?",
+                              (chain_id,)).fetchone()
+        return unpack_chain(row[0]) if row is not None else []
+
+    def merge(self, path):
+        """Copy everything recorded in the store at @path into this one.
+
+        Observations are appended (skipping any already present, so merging
+        twice is harmless) with their chains de-duplicated by digest.  A
+        domain takes whichever MX set was resolved most recently; on a tie
+        the one already here is kept.  Merging the same stores in any order
+        therefore gives the same latest observation of every MX host.
+        """
+        self.commit()
+        self.db.execute("ATTACH DATABASE ? AS shard", (path,))
+        try:
+            self.db.execute(
+                "INSERT OR IGNORE INTO chains (digest, der, names, not_after) "
+                "SELECT digest, der, names, not_after FROM shard.chains "
+                "ORDER BY id")
+            self.db.execute(
+                "INSERT INTO observations (mx_host, scanned_at, address, "
+                "protocol, cipher, chain_id, valid, error) "
+                "SELECT o.mx_host, o.scanned_at, o.address, o.protocol, "
+                "o.cipher, c.id, o.valid, o.error "
+                "FROM shard.observations o "
+                "LEFT JOIN shard.chains sc ON sc.id = o.chain_id "
+                "LEFT JOIN main.chains c ON c.digest = sc.digest "
+                "WHERE NOT EXISTS (SELECT 1 FROM main.observations m "
+                "WHERE m.mx_host = o.mx_host AND m.scanned_at = o.scanned_at) "
+                "ORDER BY o.scanned_at, o.mx_host")
+            self.db.execute(
+                "CREATE TEMP TABLE newer_domains AS "
+                "SELECT d.domain FROM shard.domains d "
+                "LEFT JOIN main.domains m ON m.domain = d.domain "
+                "WHERE m.domain IS NULL OR d.resolved_at > m.resolved_at")
+            self.db.execute(
+                "DELETE FROM main.domain_mxs WHERE domain IN "
+                "(SELECT domain FROM newer_domains)")
+            self.db.execute(
+                "INSERT INTO main.domain_mxs (domain, mx_host) "
+                "SELECT domain, mx_host FROM shard.domain_mxs WHERE domain IN "
+                "(SELECT domain FROM newer_domains)")
+            self.db.execute(
+                "INSERT OR REPLACE INTO main.domains (domain, resolved_at, "
+                "error) SELECT domain, resolved_at, error FROM shard.domains "
+                "WHERE domain IN (SELECT domain FROM newer_domains)")
+            self.db.execute("DROP TABLE newer_domains")
+            self.commit()
+        finally:
+            self.db.rollback()
+            self.db.execute("DETACH DATABASE shard")
+
+    def revalidate(self, trust_store):
+        """Re-check every stored observation against @trust_store.
+
+        Each observation is judged as of its scan time.  Returns the number
+        of observations whose verdict changed.
+        """
+        chains = {}
+        changed = []
+        for obs_id, chain_id, scanned_at, valid in self.db.execute(
+                "SELECT id, chain_id, scanned_at, valid FROM observations "
+                "WHERE chain_id IS NOT NULL"):
+            if chain_id not in chains:
+                chains[chain_id] = self.chain(chain_id)
+            verdict = trust_store.is_valid(chains[chain_id], scanned_at)
+            if valid is None or bool(valid) != verdict:
+                changed.append((verdict, obs_id))
+        self.db.executemany("UPDATE observations SET valid = ? WHERE id = ?",
+                            changed)
+        self.commit()
+        return len(changed)
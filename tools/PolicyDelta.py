@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Deltas between two versions of policy.json.
+
+policy.json is exactly json.dumps(policy_list, indent=2), keys in document
+order, so the bytes the publisher signed can be rebuilt from the previous
+version plus the entries that changed.  A delta is a JSON object:
+
+  {
+    "delta": "0.1",
+    "base":   {"timestamp": ..., "sha256": <hex digest of the old file>},
+    "target": {"timestamp": ..., "sha256": <hex digest of the new file>},
+    "fields":         {top-level key: new value, or null if removed},
+    "policy-aliases": {alias name: new definition, or null if removed},
+    "policies":       {domain: new entry, or null if removed},
+    "after": {"fields" / "policy-aliases" / "policies":
+              {each added key: the key before it in the new file, or null}}
+  }
+
+Applying it keeps changed keys where they were, drops removed ones and
+places added ones after the key "after" names; the result must hash to
+target.sha256 or the delta is rejected.  make_delta() refuses to write a
+delta that wouldn't rebuild the new file exactly (say, because the list was
+re-sorted), so publishers just skip the delta and clients download the whole
+file.
+
+Deltas aren't signed themselves.  A client checks the rebuilt file against
+the signature on the full policy.json, so a bad delta can only make it fall
+back to downloading that file.
+
+Publishers serve each delta as deltas/<base sha256>.json, next to
+policy.json:
+
+  python tools/PolicyDelta.py old/policy.json policy.json --out-dir deltas
+"""
+import argparse
+import collections
+import hashlib
+import json
+import os
+
+DELTA_VERSION = "0.1"
+SECTIONS = ("policy-aliases", "policies")
+
+
+class DeltaError(ValueError):
+    """The delta doesn't apply to the file, or doesn't rebuild its target."""
+
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _load(data):
+    return json.loads(data.decode("utf-8"),
+                      object_pairs_hook=collections.OrderedDict)
+
+
+def dump(policy_list):
+    """Serialize @policy_list the way policy.json is published."""
+    return json.dumps(policy_list, indent=2).encode("utf-8")
+
+
+def _diff(old, new):
+    """Return (changes, after) taking mapping @old to @new."""
+    changes = collections.OrderedDict()
+    after = collections.OrderedDict()
+    previous = None
+    for key, value in new.items():
+        if key not in old:
+            after[key] = previous
+        if old.get(key) != value:
+            changes[key] = value
+        previous = key
+    for key in old:
+        if key not in new:
+            changes[key] = None
+    return changes, after
+
+
+def _apply(old, changes, after):
+    followers = collections.defaultdict(list)
+    for key, previous in after.items():
+        if key in old or changes.get(key) is None:
+            raise DeltaError("bad position for %r" % key)
+        followers[previous].append(key)
+    new = collections.OrderedDict()
+    # Each added key goes straight after the key it follows, and keys added
+    # after it straight after that.
+    stack = [key for key in old if changes.get(key, True) is not None]
+    stack.extend(followers.pop(None, ()))
+    stack.reverse()
+    while stack:
+        key = stack.pop()
+        new[key] = changes[key] if key in changes else old[key]
+        stack.extend(reversed(followers.pop(key, ())))
+    if followers:
+        # They follow a key that was removed.
+        raise DeltaError("added keys don't fit into the base file")
+    return new
+
+
+def make_delta(old_data, new_data):
+    """Return the delta taking file contents @old_data to @new_data.
+
+    Raises DeltaError if applying the delta wouldn't give @new_data byte
+    for byte.
+    """
+    old, new = _load(old_data), _load(new_data)
+    delta = collections.OrderedDict([
+        ("delta", DELTA_VERSION),
+        ("base", collections.OrderedDict([
+            ("timestamp", old.get("timestamp")),
+            ("sha256", sha256(old_data))])),
+        ("target", collections.OrderedDict([
+            ("timestamp", new.get("timestamp")),
+            ("sha256", sha256(new_data))])),
+    ])
+    # Sections are diffed on their own; at the top level they are only
+    # placeholders, so that new fields can be placed relative to them.
+    fields, after = _diff(
+        collections.OrderedDict((k, None if k in SECTIONS else v)
+                                for k, v in old.items()),
+        collections.OrderedDict((k, None if k in SECTIONS else v)
+                                for k, v in new.items()))
+    delta["fields"] = fields
+    delta["after"] = collections.OrderedDict([("fields", after)])
+    for section in SECTIONS:
+        delta[section], delta["after"][section] = _diff(
+            old.get(section, {}), new.get(section, {}))
+    apply_delta(old_data, delta)
+    return delta
+
+
+def apply_delta(base_data, delta):
+    """Return the file contents @delta builds from @base_data.
+
+    Raises DeltaError if @delta isn't for @base_data or doesn't rebuild
+    what it says it does.
+    """
+    try:
+        if delta["delta"] != DELTA_VERSION:
+            raise DeltaError("unsupported delta version %r" % delta["delta"])
+        if delta["base"]["sha256"] != sha256(base_data):
+            raise DeltaError("delta is for a different base file")
+        base = _load(base_data)
+        sections = {}
+        for section in SECTIONS:
+            sections[section] = _apply(base.get(section, {}), delta[section],
+                                       delta["after"][section])
+        new = _apply(base, delta["fields"], delta["after"]["fields"])
+        for section in SECTIONS:
+            if section in new:
+                new[section] = sections[section]
+            elif sections[section]:
+                raise DeltaError("%s has no place in the file" % section)
+        target_sha256 = delta["target"]["sha256"]
+    except (KeyError, TypeError, AttributeError) as e:
+        raise DeltaError("malformed delta: %r" % e)
+    data = dump(new)
+    if sha256(data) != target_sha256:
+        raise DeltaError("delta does not rebuild its target file")
+    return data
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Write the delta between two versions of policy.json")
+    parser.add_argument("old", help="the previous policy.json")
+    parser.add_argument("new", help="the policy.json being published")
+    parser.add_argument("--out-dir", default=".",
+                        help="where to write <old sha256>.json (default: "
+                        "%(default)s)")
+    args = parser.parse_args(argv)
+    with open(args.old, "rb") as f:
+        old_data = f.read()
+    with open(args.new, "rb") as f:
+        new_data = f.read()
+    delta = make_delta(old_data, new_data)
+    path = os.path.join(args.out_dir, sha256(old_data) + ".json")
+    with open(path, "w") as f:
+        json.dump(delta, f, indent=2)
+    print(path)
+
+
+if __name__ == '__main__':
+    main()
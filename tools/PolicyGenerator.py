@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Generate policy-0.1 entries (see schema/policy-0.1.schema.json) from scan
+results in an ObservationStore.
+
+A domain gets a policy when every one of its MX hosts was last seen offering
+STARTTLS with a certificate chain that validated.  Its `mxs` list is built
+from the names those certificates are good for:
+
+  * an MX host the certificate covers is identified by its own hostname;
+  * an MX host the certificate does not cover is identified by the names in
+    the certificate instead, since that is what a sender will match.
+
+The identities are put in a trie keyed on reversed labels (com -> example ->
+mx1), and the trie is walked from the root.  The first node on each path that
+is either the parent of a wildcard SAN or a branching point (two or more
+children carrying identities) becomes a leading-dot pattern covering
+everything below it, provided it is not itself a public suffix.  Branching
+points above a wildcard are passed over: the certificate already says how
+wide its scope is.  Identities not under
+such a node, and identities sitting on a node that became a pattern (".N"
+does not match N itself), are listed exactly.  Each trie node is visited
+once, so this is linear in the number of labels.
+
+If a domain's MX set, or the patterns generated for it, equal the entries of
+an existing policy alias, the domain refers to that alias instead.  Results
+are memoized by MX set, so the many domains hosted by one provider cost one
+computation.
+"""
+import collections
+import datetime
+import functools
+
+from publicsuffix import PublicSuffixList
+
+POLICY_VERSION = "0.1"
+AUTHOR = "Electronic Frontier Foundation https://eff.org"
+# How long a generated list stays valid; see "expires" in the schema.
+LIFETIME = datetime.timedelta(days=14)
+
+
+class _Node(object):
+    __slots__ = ("children", "identity", "wildcard", "scoped")
+
+    def __init__(self):
+        self.children = {}
+        # An exact name ends here.
+        self.identity = False
+        # A certificate holds a wildcard SAN "*.<this node>".
+        self.wildcard = False
+        # This node or one below it is a wildcard.
+        self.scoped = False
+
+
+def matches(pattern, name):
+    """Whether @name satisfies an `mxs` entry, as a sender would check it."""
+    if pattern.startswith("."):
+        return name.endswith(pattern)
+    return name == pattern
+
+
+def cert_matches(cert_name, hostname):
+    """Whether a certificate name (possibly "*.parent") covers @hostname."""
+    if cert_name.startswith("*."):
+        return hostname.partition(".")[2] == cert_name[2:]
+    return cert_name == hostname
+
+
+def synthesize_mxs(identities, wildcards, permitted):
+    """Return the sorted `mxs` patterns for a set of names.
+
+    @identities are exact names, @wildcards the parents of wildcard SANs and
+    @permitted(name) says whether ".name" is narrow enough to emit.
+    """
+    root = _Node()
+    for names, flag in ((identities, "identity"), (wildcards, "wildcard")):
+        for name in names:
+            node = root
+            for label in reversed(name.split(".")):
+                child = node.children.get(label)
+                if child is None:
+                    child = node.children[label] = _Node()
+                node = child
+                node.scoped = node.scoped or flag == "wildcard"
+            setattr(node, flag, True)
+
+    patterns = []
+    stack = [(root, "")]
+    while stack:
+        node, name = stack.pop()
+        if node.identity:
+            patterns.append(name)
+        if name and permitted(name) and (node.wildcard or (
+                len(node.children) >= 2 and not node.scoped)):
+            patterns.append("." + name)
+            continue
+        for label, child in node.children.items():
+            stack.append((child, label + "." + name if name else label))
+    return sorted(patterns)
+
+
+class PolicyGenerator(object):
+    """Build policy-list entries for scanned domains.
+
+    @store is the ObservationStore to read.  @aliases is the "policy-aliases"
+    object of an existing list; domains matching one of them refer to it.
+    New policies are given @mode.
+    """
+
+    def __init__(self, store, aliases=None, mode="testing",
+                 public_suffix_list=None):
+        self.store = store
+        self.aliases = aliases or {}
+        self.mode = mode
+        self.public_suffix_list = public_suffix_list or PublicSuffixList()
+        # frozenset of mxs entries -> alias name, and the same for just the
+        # exact (non-suffix) entries of each alias.
+        self._alias_patterns = {}
+        self._alias_hosts = {}
+        for name, policy in sorted(self.aliases.items()):
+            mxs = policy.get("mxs", [])
+            self._alias_patterns.setdefault(frozenset(mxs), name)
+            exact = frozenset(mx for mx in mxs if not mx.startswith("."))
+            if exact:
+                self._alias_hosts.setdefault(exact, name)
+        self._identities = {}
+        self._policies = {}
+        self.permitted = functools.lru_cache(maxsize=None)(self._permitted)
+
+    def _permitted(self, name):
+        # get_public_suffix() returns the registrable domain, so a name is at
+        # or below one exactly when a child of it belongs to it.
+        registrable = self.public_suffix_list.get_public_suffix("x." + name)
+        return name == registrable or name.endswith("." + registrable)
+
+    def identities(self, mx_host):
+        """Return (exact names, wildcard parents) identifying @mx_host.
+
+        None if @mx_host's latest probe failed or its chain did not validate.
+        """
+        if mx_host in self._identities:
+            return self._identities[mx_host]
+        observation = self.store.latest(mx_host)
+        result = None
+        if observation is not None and observation.error is None \
+                and observation.valid:
+            covering = [name for name in observation.names
+                        if cert_matches(name, mx_host)]
+            names = covering or observation.names
+            exact = frozenset(name for name in names
+                              if not name.startswith("*."))
+            wildcards = frozenset(name[2:] for name in names
+                                  if name.startswith("*."))
+            if covering:
+                # The hostname itself is the identity; a wildcard only tells
+                # us its parent may be generalised.
+                exact = frozenset([mx_host])
+            result = (exact, wildcards)
+        self._identities[mx_host] = result
+        return result
+
+    def policy_for_mxs(self, mx_hosts):
+        """Return the policy object for a domain served by @mx_hosts, or None.
+        """
+        key = frozenset(mx_hosts)
+        if key not in self._policies:
+            self._policies[key] = self._policy_for_mxs(key)
+        return self._policies[key]
+
+    def _policy_for_mxs(self, mx_hosts):
+        exact, wildcards = set(), set()
+        for mx_host in mx_hosts:
+            identified = self.identities(mx_host)
+            if identified is None:
+                return None
+            exact.update(identified[0])
+            wildcards.update(identified[1])
+        alias = self._alias_hosts.get(mx_hosts)
+        if alias is None:
+            mxs = synthesize_mxs(exact, wildcards, self.permitted)
+            if not self._covers(mxs, mx_hosts):
+                return None
+            alias = self._alias_patterns.get(frozenset(mxs))
+            if alias is None:
+                return collections.OrderedDict(
+                    [("mode", self.mode), ("mxs", mxs)])
+        return {"policy-alias": alias}
+
+    def _covers(self, mxs, mx_hosts):
+        # Every MX host must present at least one name the patterns accept,
+        # or mail to it would be refused under enforce.
+        for mx_host in mx_hosts:
+            exact, wildcards = self.identities(mx_host)
+            if not any(matches(pattern, name) for pattern in mxs
+                       for name in exact) and \
+                    not any("." + parent in mxs for parent in wildcards):
+                return False
+        return True
+
+    def policy_for(self, domain):
+        """Return the policy object for @domain, or None if it has none."""
+        mx_hosts = self.store.domain_mxs(domain)
+        if not mx_hosts:
+            return None
+        return self.policy_for_mxs(mx_hosts)
+
+    def policies(self, domains):
+        """Return an ordered {domain: policy} for those of @domains that
+        qualify, sorted by domain."""
+        policies = collections.OrderedDict()
+        for domain in sorted(set(domains)):
+            policy = self.policy_for(domain)
+            if policy is not None:
+                policies[domain] = policy
+        return policies
+
+    def document(self, domains, author=AUTHOR, now=None):
+        """Return a complete policy-0.1 list for @domains."""
+        if now is None:
+            now = datetime.datetime.now(datetime.timezone.utc)
+        return collections.OrderedDict([
+            ("timestamp", now.isoformat()),
+            ("expires", (now + LIFETIME).isoformat()),
+            ("version", POLICY_VERSION),
+            ("author", author),
+            ("policy-aliases", self.aliases),
+            ("policies", self.policies(domains)),
+        ])
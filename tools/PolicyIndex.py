@@ -0,0 +1,581 @@
+#!/usr/bin/env python3
+"""
+Read-only lookup index over a STARTTLS policy list.
+
+Every consumer of policy.json needs the same three things: the policy for a
+recipient domain, with any "policy-alias" reference resolved; whether an MX
+hostname satisfies that policy's `mxs` patterns; and, going the other way,
+which domains an MX hostname may serve.  PolicyIndex builds all of that once:
+
+  * recipient domains go in a dict, so policy_for() is one hash lookup;
+  * aliases are resolved at build time, and every domain that uses an alias
+    shares one Policy object;
+  * each Policy keeps its exact and leading-dot patterns apart, so
+    Policy.allows() does one membership test per label of the MX hostname;
+  * every pattern of every policy goes into a trie keyed on reversed labels
+    (net -> yahoodns -> am0), so domains_for_mx() walks the MX hostname's
+    labels once, whatever the size of the list.
+
+The index is never modified after it is built; to pick up a new list, build
+a new index and swap it in.
+
+A built index can also be compiled to a binary file (PolicyIndex.compile(),
+or `PolicyIndex.py policy.json policy.idx`).  from_file() recognises one and
+returns a MappedPolicyIndex, which answers the same queries straight out of
+an mmap of the file: opening it costs the same whatever the size of the
+list, and every process that opens it shares one copy of the pages.
+"""
+import argparse
+import array
+import datetime
+import gc
+import json
+import mmap
+import re
+import struct
+import sys
+import zlib
+
+from AtomicWrite import atomic_write
+
+MODES = ("testing", "enforce")
+
+_DATE_TIME = re.compile(
+    r"(?P<year>\d{4})-(?P<month>\d\d)-(?P<day>\d\d)"
+    r"T(?P<hour>\d\d):(?P<minute>\d\d):(?P<second>\d\d)"
+    r"(?:\.(?P<fraction>\d+))?"
+    r"(?:Z|(?P<sign>[+-])(?P<tz_hour>\d\d):(?P<tz_minute>\d\d))?$")
+
+
+class PolicyError(ValueError):
+    """The policy list is malformed in a way the index can't represent."""
+
+
+def normalize(name):
+    """Lower-case @name and drop any trailing dot."""
+    return name.lower().rstrip(".")
+
+
+def parse_time(value):
+    """Parse a policy list timestamp: epoch seconds, or a string in the
+    schema's format, yyyy-MM-dd'T'HH:mm:ss with any number of fractional
+    digits and "Z" or a +HH:MM offset (UTC if it has neither).
+
+    Raises PolicyError if @value is neither.
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    match = _DATE_TIME.match(value) if isinstance(value, str) else None
+    if match is None:
+        raise PolicyError("invalid timestamp %r" % (value,))
+    fields = match.group("year", "month", "day", "hour", "minute", "second")
+    offset = datetime.timedelta(0)
+    if match.group("sign"):
+        offset = datetime.timedelta(hours=int(match.group("tz_hour")),
+                                    minutes=int(match.group("tz_minute")))
+        if match.group("sign") == "-":
+            offset = -offset
+    try:
+        when = datetime.datetime(*map(int, fields),
+                                 tzinfo=datetime.timezone(offset))
+    except ValueError as e:
+        raise PolicyError("invalid timestamp %r: %s" % (value, e))
+    fraction = match.group("fraction")
+    return when.timestamp() + (float("0." + fraction) if fraction else 0.0)
+
+
+def _small_set(items):
+    # Most policies list one to three patterns.  Scanning a tuple that short
+    # is as quick as hashing, and a million small frozensets cost hundreds of
+    # megabytes more than the tuples.
+    items = tuple(sorted(set(items)))
+    return frozenset(items) if len(items) > 4 else items
+
+
+class Policy(object):
+    """One policy: @mode, the tuple of `mxs` patterns, and the name of the
+    alias it came from (None if it was given inline)."""
+
+    __slots__ = ("mode", "mxs", "alias", "_exact", "_suffixes")
+
+    def __init__(self, mode, mxs, alias=None):
+        self.mode = mode
+        self.mxs = tuple(mxs)
+        self.alias = alias
+        patterns = [normalize(mx) for mx in self.mxs]
+        self._exact = _small_set(p for p in patterns if not p.startswith("."))
+        self._suffixes = _small_set(p for p in patterns if p.startswith("."))
+
+    def allows(self, mx_host):
+        """Whether @mx_host matches one of this policy's `mxs` patterns.
+
+        ".example.net" matches any name below example.net, however deep, but
+        not example.net itself.
+        """
+        mx_host = normalize(mx_host)
+        if mx_host in self._exact:
+            return True
+        dot = mx_host.find(".")
+        while dot != -1:
+            if mx_host[dot:] in self._suffixes:
+                return True
+            dot = mx_host.find(".", dot + 1)
+        return False
+
+    def __eq__(self, other):
+        return isinstance(other, Policy) and \
+            (self.mode, self.mxs, self.alias) == \
+            (other.mode, other.mxs, other.alias)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.mode, self.mxs, self.alias))
+
+    def __repr__(self):
+        return "Policy(%r, %r, alias=%r)" % (self.mode, list(self.mxs),
+                                            self.alias)
+
+
+class _Node(object):
+    __slots__ = ("children", "exact", "suffix")
+
+    def __init__(self):
+        # label -> _Node; None until the node gets a child, since most nodes
+        # are leaves.
+        self.children = None
+        # Ids of the policies with an exact / leading-dot pattern for the
+        # name this node spells.
+        self.exact = ()
+        self.suffix = ()
+
+
+class PolicyIndex(object):
+    """An immutable, query-optimized policy list.
+
+    Built from the parsed JSON of a policy-0.1 list; see from_file() and
+    from_json().  Raises PolicyError if a domain refers to an alias that
+    doesn't exist, a policy has no usable mode, or two domains are the same
+    once normalized.
+    """
+
+    def __init__(self, policy_list):
+        # Building allocates millions of small objects and no cycles, so the
+        # cyclic collector would only rescan the growing index over and over.
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            self._build(policy_list)
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+    def _build(self, policy_list):
+        self.version = policy_list.get("version")
+        self.timestamp = policy_list.get("timestamp")
+        self.expires = policy_list.get("expires")
+        aliases = {}
+        for name, definition in policy_list.get("policy-aliases", {}).items():
+            aliases[name] = self._make_policy(definition, name, alias=name)
+
+        self._domains = {}
+        # Distinct policies, and the domains using each, by policy id.
+        self._policies = []
+        self._policy_domains = []
+        ids = {}
+        for domain, definition in policy_list.get("policies", {}).items():
+            if "policy-alias" in definition:
+                alias = definition["policy-alias"]
+                if alias not in aliases:
+                    raise PolicyError("%s refers to unknown policy alias %r"
+                                      % (domain, alias))
+                policy = aliases[alias]
+            else:
+                policy = self._make_policy(definition, domain)
+            policy_id = ids.get(id(policy))
+            if policy_id is None:
+                policy_id = ids[id(policy)] = len(self._policies)
+                self._policies.append(policy)
+                self._policy_domains.append([])
+            name = normalize(domain)
+            if name in self._domains:
+                raise PolicyError("%s is the same domain as %s, which already "
+                                  "has a policy" % (domain, name))
+            self._domains[name] = policy
+            self._policy_domains[policy_id].append(name)
+        self._policies = tuple(self._policies)
+        self._policy_domains = tuple(frozenset(domains)
+                                     for domains in self._policy_domains)
+
+        self._root = _Node()
+        for policy_id, policy in enumerate(self._policies):
+            for pattern in policy._exact:
+                node = self._insert(pattern)
+                node.exact += (policy_id,)
+            for pattern in policy._suffixes:
+                node = self._insert(pattern[1:])
+                node.suffix += (policy_id,)
+
+    @staticmethod
+    def _make_policy(definition, name, alias=None):
+        mode = definition.get("mode", "testing")
+        if mode not in MODES:
+            raise PolicyError("%s has unknown mode %r" % (name, mode))
+        return Policy(mode, definition.get("mxs", ()), alias)
+
+    def _insert(self, name):
+        node = self._root
+        for label in reversed(name.split(".")):
+            if node.children is None:
+                node.children = {}
+            child = node.children.get(label)
+            if child is None:
+                child = node.children[label] = _Node()
+            node = child
+        return node
+
+    @classmethod
+    def from_json(cls, text):
+        return cls(json.loads(text))
+
+    @classmethod
+    def from_file(cls, path):
+        """Load the policy list at @path, either JSON or compiled."""
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) == MAGIC:
+                return MappedPolicyIndex(path)
+            f.seek(0)
+            return cls(json.loads(f.read().decode("utf-8")))
+
+    def __len__(self):
+        return len(self._domains)
+
+    def __contains__(self, domain):
+        return normalize(domain) in self._domains
+
+    def domains(self):
+        """Return an iterator over every recipient domain with a policy."""
+        return iter(self._domains)
+
+    def policy_for(self, domain):
+        """Return the Policy for recipient @domain, or None."""
+        return self._domains.get(normalize(domain))
+
+    def mx_allowed(self, domain, mx_host):
+        """Whether @mx_host satisfies the policy of recipient @domain.
+
+        False if @domain has no policy; policy_for() tells the cases apart.
+        """
+        policy = self._domains.get(normalize(domain))
+        return policy is not None and policy.allows(mx_host)
+
+    def policies_for_mx(self, mx_host):
+        """Return the Policies whose `mxs` patterns match @mx_host."""
+        labels = normalize(mx_host).split(".")
+        ids = set()
+        node = self._root
+        for depth, label in enumerate(reversed(labels)):
+            if node.children is None:
+                break
+            node = node.children.get(label)
+            if node is None:
+                break
+            # A suffix pattern only matches names strictly below it.
+            if depth < len(labels) - 1:
+                ids.update(node.suffix)
+            else:
+                ids.update(node.exact)
+        return [self._policies[policy_id] for policy_id in sorted(ids)]
+
+    def domains_for_mx(self, mx_host):
+        """Return the frozenset of recipient domains @mx_host may serve."""
+        labels = normalize(mx_host).split(".")
+        domains = frozenset()
+        node = self._root
+        for depth, label in enumerate(reversed(labels)):
+            if node.children is None:
+                break
+            node = node.children.get(label)
+            if node is None:
+                break
+            ids = node.suffix if depth < len(labels) - 1 else node.exact
+            for policy_id in ids:
+                domains = domains.union(self._policy_domains[policy_id])
+        return domains
+
+    def compile(self, path):
+        """Write this index to @path in the format MappedPolicyIndex reads.
+
+        Processes that have the old file mapped keep reading the old list.
+        """
+        atomic_write(path, _compile(self))
+
+
+# The compiled format.  All integers are unsigned, little-endian and 32 bits;
+# offsets are from the start of the file.
+#
+#   header    MAGIC and the fields of HEADER, in order
+#   strings   the metadata as JSON, then every domain and `mxs` pattern as
+#             one length byte plus its bytes, then each policy as
+#             "mode\0alias\0mx\0mx..." (alias empty if none)
+#   policies  per policy id: (offset, length) of its string
+#   groups    per policy id: (first, count) of its domains in members
+#   members   the offset of every domain string, grouped by policy id
+#   idlists   per `mxs` pattern: count, then the ids of the policies using it
+#   domains   hash table of (crc32, domain offset, policy id)
+#   patterns  hash table of (crc32, pattern offset, idlist offset)
+#
+# The hash tables use linear probing, have a power of two slots and are at
+# most half full; an empty slot has offset 0, which no string can have.
+MAGIC = b"STPLIDX1"
+HEADER = ("domain_count", "policy_count", "meta_offset", "meta_length",
+          "policies", "groups", "members", "domains", "domain_slots",
+          "patterns", "pattern_slots", "size")
+_HEADER = struct.Struct("<%dI" % len(HEADER))
+_SLOT = struct.Struct("<III")
+_PAIR = struct.Struct("<II")
+
+
+def _hash_table(entries, count):
+    """Lay out (key bytes, key offset, value) @entries as a hash table."""
+    slots = 1
+    while slots < 2 * count:
+        slots *= 2
+    mask = slots - 1
+    table = array.array("I", bytes(12 * slots))
+    for key, offset, value in entries:
+        h = zlib.crc32(key)
+        i = h & mask
+        while table[3 * i + 1]:
+            i = (i + 1) & mask
+        table[3 * i:3 * i + 3] = array.array("I", (h, offset, value))
+    return table, slots
+
+
+def _compile(index):
+    strings = bytearray(b"\0")
+
+    def add_key(text):
+        key = text.encode("utf-8")
+        if len(key) > 255:
+            raise PolicyError("%r is too long to compile" % text[:64])
+        offset = len(strings)
+        strings.append(len(key))
+        strings.extend(key)
+        return key, offset
+
+    meta = json.dumps({"version": index.version,
+                       "timestamp": index.timestamp,
+                       "expires": index.expires}).encode("utf-8")
+    meta_offset = len(strings)
+    strings.extend(meta)
+
+    domain_entries = []
+    members = array.array("I")
+    groups = array.array("I")
+    for policy_id, domains in enumerate(index._policy_domains):
+        groups.extend((len(members), len(domains)))
+        for domain in sorted(domains):
+            key, offset = add_key(domain)
+            domain_entries.append((key, offset, policy_id))
+            members.append(offset)
+
+    # pattern -> ids of the policies with it, in the trie's terms: an exact
+    # pattern is keyed on itself, a leading-dot pattern on its ".suffix".
+    pattern_ids = {}
+    for policy_id, policy in enumerate(index._policies):
+        for pattern in tuple(policy._exact) + tuple(policy._suffixes):
+            pattern_ids.setdefault(pattern, []).append(policy_id)
+    idlists = array.array("I")
+    pattern_entries = []
+    for pattern in sorted(pattern_ids):
+        key, offset = add_key(pattern)
+        pattern_entries.append((key, offset, len(idlists)))
+        idlists.append(len(pattern_ids[pattern]))
+        idlists.extend(pattern_ids[pattern])
+
+    policies = array.array("I")
+    for policy in index._policies:
+        text = "\0".join((policy.mode, policy.alias or "") + policy.mxs)
+        policies.extend((len(strings), len(text.encode("utf-8"))))
+        strings.extend(text.encode("utf-8"))
+
+    domains, domain_slots = _hash_table(domain_entries, len(domain_entries))
+    patterns, pattern_slots = _hash_table(pattern_entries,
+                                          len(pattern_entries))
+    del domain_entries, pattern_entries
+
+    # Lay the sections out after the header, each 4-byte aligned.
+    header_size = len(MAGIC) + _HEADER.size
+    strings.extend(bytes(-len(strings) % 4))
+    sections = [policies, groups, members, idlists, domains, patterns]
+    offsets = []
+    offset = header_size + len(strings)
+    for section in sections:
+        offsets.append(offset)
+        offset += len(section) * section.itemsize
+    idlists_offset = offsets[3]
+    # idlist offsets in the pattern table are indexes until now.
+    for i in range(pattern_slots):
+        if patterns[3 * i + 1]:
+            patterns[3 * i + 2] = idlists_offset + 4 * patterns[3 * i + 2]
+    # Every string offset is relative to the strings section until now.
+    for table in (domains, patterns):
+        for i in range(1, len(table), 3):
+            if table[i]:
+                table[i] += header_size
+    for i in range(len(members)):
+        members[i] += header_size
+    for i in range(0, len(policies), 2):
+        policies[i] += header_size
+    header = _HEADER.pack(len(index), len(index._policies),
+                          header_size + meta_offset, len(meta),
+                          offsets[0], offsets[1], offsets[2],
+                          offsets[4], domain_slots, offsets[5],
+                          pattern_slots, offset)
+    if sys.byteorder != "little":
+        for section in sections:
+            section.byteswap()
+    return b"".join([MAGIC, header, bytes(strings)] +
+                    [section.tobytes() for section in sections])
+
+
+class MappedPolicyIndex(object):
+    """A PolicyIndex read in place from a compiled file.
+
+    Has the same query methods as PolicyIndex.  Nothing is read up front
+    beyond the header; Policy objects are built the first time they're asked
+    for.  Raises PolicyError if @path isn't a whole compiled index.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            try:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise PolicyError("%s is empty" % path)
+        header_size = len(MAGIC) + _HEADER.size
+        if len(self._map) < header_size or \
+                self._map[:len(MAGIC)] != MAGIC:
+            raise PolicyError("%s is not a compiled policy index" % path)
+        fields = dict(zip(HEADER, _HEADER.unpack_from(self._map,
+                                                      len(MAGIC))))
+        if fields["size"] != len(self._map):
+            raise PolicyError("%s is truncated" % path)
+        self.__dict__.update(("_" + name, value)
+                             for name, value in fields.items())
+        meta = json.loads(self._map[self._meta_offset:self._meta_offset +
+                                    self._meta_length].decode("utf-8"))
+        self.version = meta["version"]
+        self.timestamp = meta["timestamp"]
+        self.expires = meta["expires"]
+        self._cache = {}
+
+    def close(self):
+        self._map.close()
+
+    def _string(self, offset):
+        return self._map[offset + 1:offset + 1 + self._map[offset]] \
+            .decode("utf-8")
+
+    def _find(self, table, slots, key):
+        """Return the value stored for @key in a hash table, or None."""
+        key = key.encode("utf-8")
+        mm = self._map
+        h = zlib.crc32(key)
+        mask = slots - 1
+        i = h & mask
+        while True:
+            slot_hash, offset, value = _SLOT.unpack_from(mm, table + 12 * i)
+            if not offset:
+                return None
+            if slot_hash == h and mm[offset] == len(key) and \
+                    mm[offset + 1:offset + 1 + len(key)] == key:
+                return value
+            i = (i + 1) & mask
+
+    def _policy(self, policy_id):
+        policy = self._cache.get(policy_id)
+        if policy is None:
+            offset, length = _PAIR.unpack_from(self._map,
+                                               self._policies + 8 * policy_id)
+            fields = self._map[offset:offset + length].decode("utf-8") \
+                .split("\0")
+            policy = self._cache[policy_id] = Policy(fields[0], fields[2:],
+                                                     fields[1] or None)
+        return policy
+
+    def _ids(self, pattern):
+        offset = self._find(self._patterns, self._pattern_slots, pattern)
+        if offset is None:
+            return ()
+        count = struct.unpack_from("<I", self._map, offset)[0]
+        return struct.unpack_from("<%dI" % count, self._map, offset + 4)
+
+    def _group(self, policy_id):
+        first, count = _PAIR.unpack_from(self._map,
+                                         self._groups + 8 * policy_id)
+        offsets = struct.unpack_from("<%dI" % count, self._map,
+                                     self._members + 4 * first)
+        return [self._string(offset) for offset in offsets]
+
+    def __len__(self):
+        return self._domain_count
+
+    def __contains__(self, domain):
+        return self._find(self._domains, self._domain_slots,
+                          normalize(domain)) is not None
+
+    def domains(self):
+        """Return an iterator over every recipient domain with a policy."""
+        for i in range(self._domain_count):
+            offset = struct.unpack_from("<I", self._map,
+                                        self._members + 4 * i)[0]
+            yield self._string(offset)
+
+    def policy_for(self, domain):
+        """Return the Policy for recipient @domain, or None."""
+        policy_id = self._find(self._domains, self._domain_slots,
+                               normalize(domain))
+        return None if policy_id is None else self._policy(policy_id)
+
+    def mx_allowed(self, domain, mx_host):
+        """Whether @mx_host satisfies the policy of recipient @domain."""
+        policy = self.policy_for(domain)
+        return policy is not None and policy.allows(mx_host)
+
+    def _mx_ids(self, mx_host):
+        mx_host = normalize(mx_host)
+        ids = set(self._ids(mx_host))
+        # A suffix pattern only matches names strictly below it.
+        dot = mx_host.find(".")
+        while dot != -1:
+            ids.update(self._ids(mx_host[dot:]))
+            dot = mx_host.find(".", dot + 1)
+        return ids
+
+    def policies_for_mx(self, mx_host):
+        """Return the Policies whose `mxs` patterns match @mx_host."""
+        return [self._policy(policy_id)
+                for policy_id in sorted(self._mx_ids(mx_host))]
+
+    def domains_for_mx(self, mx_host):
+        """Return the frozenset of recipient domains @mx_host may serve."""
+        domains = set()
+        for policy_id in self._mx_ids(mx_host):
+            domains.update(self._group(policy_id))
+        return frozenset(domains)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compile a policy list for MappedPolicyIndex")
+    parser.add_argument("policy", help="policy.json to compile")
+    parser.add_argument("output", help="compiled index to write")
+    args = parser.parse_args(argv)
+    PolicyIndex.from_file(args.policy).compile(args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Read a policy list one entry at a time.
+
+json.load() holds the whole document, and then the dicts built from it, in
+memory at once.  PolicyStream reads the file in fixed-size chunks instead
+and decodes one policy at a time, yielding (domain, Policy) pairs with any
+"policy-alias" already resolved.  Memory use is bounded by the chunk size,
+the largest single entry and the aliases, however many policies there are.
+
+Aliases have to be known before the first policy can be resolved.  When
+"policy-aliases" comes before "policies", as in the published list, that
+takes one pass; otherwise a first pass reads just the aliases (decoding
+and dropping each policy on the way) before the second yields the
+policies.
+
+Each alias and policy is checked with PolicyValidator as it is read, and so
+is the top level once the document has been read.  Checks that need the
+whole list at once, such as for domains that differ only in case, aren't
+made.
+"""
+import json
+import re
+
+from PolicyIndex import Policy, PolicyError
+from PolicyValidator import ERROR, PolicyValidator
+
+CHUNK_SIZE = 1 << 16
+# No single policy comes anywhere near this; a value this long means the
+# file isn't what it should be.
+MAX_VALUE = 1 << 24
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_decoder = json.JSONDecoder()
+
+
+class _Tokens(object):
+    """JSON values and punctuation from a text file, a chunk at a time."""
+
+    def __init__(self, f, chunk_size=CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+        # Characters dropped from the front of the buffer so far.
+        self.consumed = 0
+        self.eof = False
+
+    def _fill(self):
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+        self.consumed += self.pos
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+
+    def peek(self):
+        """Return the next non-space character, or "" at the end."""
+        while True:
+            self.pos = _WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer) or self.eof:
+                return self.buffer[self.pos:self.pos + 1]
+            self._fill()
+
+    def expect(self, chars):
+        char = self.peek()
+        if not char or char not in chars:
+            raise PolicyError("expected %s at offset %d, found %r" %
+                              (" or ".join(map(repr, chars)),
+                               self.offset(), char))
+        self.pos += 1
+        return char
+
+    def offset(self):
+        return self.consumed + self.pos
+
+    def value(self):
+        """Decode the next JSON value."""
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError as e:
+                if self.eof:
+                    raise PolicyError("invalid JSON: %s" % e)
+                end = None
+            # A number (or anything else) running to the end of the buffer
+            # might continue in the next chunk.
+            if end is not None and (end < len(self.buffer) or self.eof):
+                self.pos = end
+                return value
+            if len(self.buffer) - self.pos > MAX_VALUE:
+                raise PolicyError("value at offset %d is too long" %
+                                  self.offset())
+            self._fill()
+
+    def members(self):
+        """Iterate over the keys of an object's members, leaving each
+        member's value for the caller to read."""
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            if not isinstance(key, str):
+                raise PolicyError("object key %r is not a string" % key)
+            self.expect(":")
+            yield key
+            if self.expect(",}") == "}":
+                return
+
+
+class PolicyStream(object):
+    """Iterate over the (domain, Policy) pairs of the policy list at @path.
+
+    Problems found are passed to @on_problem; an entry with an error is
+    then skipped.  Without @on_problem, the first error raises PolicyError.
+    The top-level fields (everything but the policies) are in `fields` once
+    iteration is over.
+    """
+
+    def __init__(self, path, validator=None, on_problem=None,
+                 chunk_size=CHUNK_SIZE):
+        self.path = path
+        self.validator = validator or PolicyValidator()
+        self.on_problem = on_problem
+        self.chunk_size = chunk_size
+        self.fields = {}
+        self.aliases = None
+
+    def _report(self, problems):
+        """Report @problems; return whether any of them is an error."""
+        failed = False
+        for problem in problems:
+            if problem.severity == ERROR:
+                failed = True
+                if self.on_problem is None:
+                    raise PolicyError(str(problem))
+            if self.on_problem is not None:
+                self.on_problem(problem)
+        return failed
+
+    def _read_aliases(self, tokens):
+        aliases = {}
+        for name in tokens.members():
+            entry = tokens.value()
+            if not self._report(self.validator.alias_problems(name, entry)):
+                aliases[name] = Policy(entry["mode"], entry["mxs"], name)
+        return aliases
+
+    def _prepass(self):
+        """Read just the aliases."""
+        with open(self.path, encoding="utf-8") as f:
+            tokens = _Tokens(f, self.chunk_size)
+            for key in tokens.members():
+                if key == "policy-aliases":
+                    return self._read_aliases(tokens)
+                if key == "policies" and tokens.peek() == "{":
+                    for _ in tokens.members():
+                        tokens.value()
+                else:
+                    tokens.value()
+        return {}
+
+    def __iter__(self):
+        self.fields = {}
+        self.aliases = None
+        with open(self.path, encoding="utf-8") as f:
+            tokens = _Tokens(f, self.chunk_size)
+            for key in tokens.members():
+                if key == "policy-aliases" and tokens.peek() == "{":
+                    if self.aliases is None:
+                        self.aliases = self._read_aliases(tokens)
+                    else:
+                        # Already read, and checked, by _prepass().
+                        tokens.value()
+                    self.fields[key] = {}
+                elif key == "policies" and tokens.peek() == "{":
+                    if self.aliases is None:
+                        self.aliases = self._prepass()
+                    for domain in tokens.members():
+                        policy = self._policy(domain, tokens.value())
+                        if policy is not None:
+                            yield domain, policy
+                    self.fields[key] = {}
+                else:
+                    self.fields[key] = tokens.value()
+            if tokens.peek():
+                raise PolicyError("unexpected data after the policy list")
+        self._report(self.validator.top_problems(self.fields))
+
+    def _policy(self, domain, entry):
+        if self._report(self.validator.policy_problems(domain, entry,
+                                                       self.aliases)):
+            return None
+        if "policy-alias" in entry:
+            # An alias that failed its own checks was dropped.
+            return self.aliases[entry["policy-alias"]]
+        return Policy(entry["mode"], entry["mxs"])
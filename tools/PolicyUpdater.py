@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+Fetch policy list updates, downloading as little as possible.
+
+A replacement for scripts/update_and_verify.sh that makes the same checks
+(scripts/verify.sh: the signature, and that the new list isn't older than
+the installed one) but:
+
+  * asks for policy.json.asc with If-None-Match / If-Modified-Since, using
+    the validators the server sent last time, and stops there on a 304;
+  * otherwise looks for deltas/<sha256 of the installed policy.json>.json
+    (see PolicyDelta.py) and rebuilds the new policy.json from it;
+  * falls back to downloading policy.json in full, itself conditionally, if
+    there is no delta, it can't be fetched or doesn't apply, or what it
+    rebuilt doesn't verify.
+
+New files are verified in a temporary directory and renamed into place.
+<local dir>/update-state.json keeps the HTTP validators, and a record of
+the installed list as it was verified: the sha256 of it and of its
+signature, and the signature's date and key.  While the installed files
+still hash to what was recorded, verify.sh is handed the recorded date
+instead of running gpgv over them again to find it out.
+
+  python tools/PolicyUpdater.py [--local-dir /etc/starttls-policy]
+"""
+import argparse
+import email.utils
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import urllib.error
+import urllib.request
+
+from AtomicWrite import atomic_write
+from PolicyDelta import DeltaError, apply_delta, sha256
+
+logger = logging.getLogger(__name__)
+
+JSON_FILE = "policy.json"
+SIG_FILE = JSON_FILE + ".asc"
+STATE_FILE = "update-state.json"
+
+REMOTE_DIR = "https://dl.eff.org/starttls-everywhere"
+LOCAL_DIR = "/etc/starttls-policy"
+VERIFY_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), "scripts", "verify.sh")
+
+UNCHANGED = "unchanged"
+DELTA = "delta"
+FULL = "full"
+
+
+class UpdateError(Exception):
+    """The update couldn't be fetched or didn't verify."""
+
+
+class PolicyUpdater(object):
+    """Keep the policy list in @local_dir up to date with @remote."""
+
+    def __init__(self, local_dir=LOCAL_DIR, remote=REMOTE_DIR,
+                 verify_script=VERIFY_SCRIPT, timeout=60):
+        self.local_dir = local_dir
+        self.remote = remote.rstrip("/")
+        self.verify_script = verify_script
+        self.timeout = timeout
+
+    def _local(self, name):
+        return os.path.join(self.local_dir, name)
+
+    def _read_local(self, name):
+        try:
+            with open(self._local(name), "rb") as f:
+                return f.read()
+        except (IOError, OSError):
+            return None
+
+    def load_state(self):
+        data = self._read_local(STATE_FILE)
+        if data is None:
+            return {}
+        try:
+            return json.loads(data.decode("utf-8"))
+        except ValueError:
+            return {}
+
+    def save_state(self, state):
+        self._write_local(STATE_FILE,
+                          json.dumps(state, indent=2).encode("utf-8"))
+
+    def _write_local(self, name, data):
+        atomic_write(self._local(name), data)
+
+    def fetch(self, name, validators=None):
+        """GET @name from the remote directory.
+
+        Returns (body, validators), or (None, @validators) if the server
+        says it hasn't changed since @validators, a dict of the "etag" and
+        "last-modified" it sent before.  Returns (None, None) on a 404.
+        """
+        request = urllib.request.Request(self.remote + "/" + name)
+        if validators:
+            if validators.get("etag"):
+                request.add_header("If-None-Match", validators["etag"])
+            if validators.get("last-modified"):
+                request.add_header("If-Modified-Since",
+                                   validators["last-modified"])
+        try:
+            with urllib.request.urlopen(request,
+                                        timeout=self.timeout) as response:
+                body = response.read()
+                headers = response.headers
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                return None, validators
+            if e.code == 404:
+                return None, None
+            raise UpdateError("fetching %s: %s" % (name, e))
+        except (urllib.error.URLError, OSError) as e:
+            raise UpdateError("fetching %s: %s" % (name, e))
+        validators = {}
+        if headers.get("ETag"):
+            validators["etag"] = headers["ETag"]
+        if headers.get("Last-Modified") and \
+                email.utils.parsedate_tz(headers["Last-Modified"]):
+            validators["last-modified"] = headers["Last-Modified"]
+        return body, validators
+
+    def verified_record(self, state):
+        """Return the state's record of the installed list, if the installed
+        files are still the ones it describes."""
+        record = state.get("verified")
+        if not record:
+            return None
+        policy = self._read_local(JSON_FILE)
+        signature = self._read_local(SIG_FILE)
+        if policy is None or signature is None or \
+                sha256(policy) != record.get("sha256") or \
+                sha256(signature) != record.get("sig_sha256"):
+            return None
+        return record
+
+    def verify(self, policy, signature, record=None):
+        """Check @policy and @signature with verify.sh against the installed
+        list, described by @record if it was verified before.
+
+        Returns the record to keep for them, or None if they fail.
+        """
+        tmp_dir = tempfile.mkdtemp()
+        status_file = os.path.join(tmp_dir, "gpgv.status")
+        try:
+            new_dir = os.path.join(tmp_dir, "new")
+            os.mkdir(new_dir)
+            with open(os.path.join(new_dir, JSON_FILE), "wb") as f:
+                f.write(policy)
+            with open(os.path.join(new_dir, SIG_FILE), "wb") as f:
+                f.write(signature)
+            args = ["sh", self.verify_script, self.local_dir, new_dir,
+                    status_file]
+            if record is not None:
+                args += [str(record["sig_epoch"]), record["fingerprint"]]
+            result = subprocess.run(args, stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT)
+            if result.returncode:
+                logger.warning("verify.sh: %s", result.stdout.decode(
+                    "utf-8", "replace").strip())
+                return None
+            try:
+                with open(status_file) as f:
+                    status = f.read()
+            except (IOError, OSError) as e:
+                logger.warning("verify.sh left no gpgv status: %s", e)
+                return None
+        finally:
+            shutil.rmtree(tmp_dir)
+        for line in status.splitlines():
+            fields = line.split()
+            if fields[:2] == ["[GNUPG:]", "VALIDSIG"] and len(fields) >= 12:
+                return {"sha256": sha256(policy),
+                        "sig_sha256": sha256(signature),
+                        "sig_epoch": int(fields[4]),
+                        "fingerprint": fields[11]}
+        return None
+
+    def _delta(self, installed):
+        try:
+            delta, _ = self.fetch("deltas/%s.json" % sha256(installed))
+        except UpdateError as e:
+            logger.warning("Ignoring delta: %s", e)
+            return None
+        if delta is None:
+            return None
+        try:
+            return apply_delta(installed, json.loads(delta.decode("utf-8")))
+        except (DeltaError, ValueError) as e:
+            logger.warning("Ignoring delta: %s", e)
+            return None
+
+    def update(self):
+        """Bring the local list up to date.
+
+        Returns UNCHANGED, DELTA or FULL, for how the list was brought up to
+        date; raises UpdateError if it couldn't be.
+        """
+        state = self.load_state()
+        installed = self._read_local(JSON_FILE)
+        have_local = installed is not None and \
+            self._read_local(SIG_FILE) is not None
+        if not have_local:
+            state = {}
+
+        signature, sig_validators = self.fetch(SIG_FILE, state.get(SIG_FILE))
+        if signature is None:
+            if sig_validators is None:
+                raise UpdateError("%s not found" % SIG_FILE)
+            logger.info("%s is unchanged", SIG_FILE)
+            return UNCHANGED
+
+        method = None
+        verified = None
+        record = self.verified_record(state)
+        json_validators = state.get(JSON_FILE)
+        if have_local:
+            policy = self._delta(installed)
+            if policy is not None:
+                verified = self.verify(policy, signature, record)
+                method = DELTA if verified else None
+        if method is None:
+            policy, json_validators = self.fetch(JSON_FILE, json_validators)
+            if policy is None:
+                if json_validators is None:
+                    raise UpdateError("%s not found" % JSON_FILE)
+                # Re-signed, but the list itself is the one we have.
+                policy = installed
+            verified = self.verify(policy, signature, record)
+            if not verified:
+                raise UpdateError("%s failed verification" % JSON_FILE)
+            method = FULL
+
+        os.makedirs(self.local_dir, exist_ok=True)
+        self._write_local(JSON_FILE, policy)
+        self._write_local(SIG_FILE, signature)
+        state = {SIG_FILE: sig_validators, "verified": verified}
+        if method == FULL:
+            state[JSON_FILE] = json_validators
+        self.save_state(state)
+        logger.info("Installed %s (%s)", JSON_FILE, method)
+        return method
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Fetch and verify an updated STARTTLS policy list")
+    parser.add_argument("--local-dir", default=LOCAL_DIR,
+                        help="where the list is installed (default: "
+                        "%(default)s)")
+    parser.add_argument("--remote", default=REMOTE_DIR,
+                        help="where it is published (default: %(default)s)")
+    parser.add_argument("--verify-script", default=VERIFY_SCRIPT,
+                        help="default: %(default)s")
+    args = parser.parse_args(argv)
+    logging.basicConfig(stream=sys.stderr, level=logging.INFO,
+                        format="%(message)s")
+    updater = PolicyUpdater(args.local_dir, args.remote, args.verify_script)
+    try:
+        updater.update()
+    except UpdateError as e:
+        logger.error("%s", e)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
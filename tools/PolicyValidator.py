@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+"""
+Validate a STARTTLS policy list against schema/policy-0.1.schema.json, and
+against the rules the schema can't express.
+
+jsonschema.validate() stops at the first error and walks the whole document
+through the generic validator, which on a list of a million domains takes
+minutes.  PolicyValidator instead:
+
+  * builds the jsonschema validators, and compiles the schema's patterns,
+    once, when it is created;
+  * checks the top level of the document with jsonschema, but each policy
+    and alias with a plain-Python check of the same rules, handing only the
+    entries that fail that check to jsonschema for the detailed messages;
+  * reports every problem, each with the JSON Pointer (RFC 6901) of the
+    value it is about, rather than raising on the first;
+  * can check just the entries that changed since a previous, valid version
+    of the list (see changes()).
+
+Beyond the schema it reports, as errors, domains referring to an alias that
+doesn't exist, domains that are the same once case and trailing dots are
+ignored, and an `expires` that isn't after `timestamp`; and, as warnings,
+`mxs` entries that repeat or are already matched by another entry of the
+same policy.
+
+  python tools/PolicyValidator.py policy.json [--previous old-policy.json]
+"""
+import argparse
+import collections
+import json
+import os
+import re
+import sys
+
+import jsonschema
+
+from PolicyIndex import normalize, parse_time
+
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), "schema", "policy-0.1.schema.json")
+
+ERROR = "error"
+WARNING = "warning"
+
+Problem = collections.namedtuple("Problem", ["path", "message", "severity"])
+Problem.__str__ = lambda self: "%s: %s: %s" % (self.severity,
+                                               self.path or "/",
+                                               self.message)
+
+_MISSING = object()
+
+
+def _list_pattern(pattern):
+    """Compile schema @pattern, "^...$", to match a newline-separated list of
+    strings that each match it."""
+    if not (pattern.startswith("^") and pattern.endswith("$")):
+        raise ValueError("unanchored pattern %r" % pattern)
+    body = "(?:%s)" % pattern[1:-1]
+    return re.compile("%s(?:\n%s)*" % (body, body))
+
+
+def _all_match(list_pattern, strings):
+    """Whether @strings is non-empty and every one matches @list_pattern.
+
+    Checking one joined string is a single call into the regex engine
+    however many strings there are.
+    """
+    try:
+        joined = "\n".join(strings)
+    except TypeError:
+        return False
+    # A string with a newline of its own would be taken for two.
+    return bool(strings) and joined.count("\n") == len(strings) - 1 and \
+        list_pattern.fullmatch(joined) is not None
+
+
+def pointer(*parts):
+    """Return the JSON Pointer for the path @parts."""
+    return "".join("/" + str(part).replace("~", "~0").replace("/", "~1")
+                   for part in parts)
+
+
+class PolicyValidator(object):
+    """Checks policy lists against @schema, by default the policy-0.1 schema.
+    """
+
+    def __init__(self, schema=None):
+        if schema is None:
+            with open(SCHEMA_FILE) as f:
+                schema = json.load(f)
+        cls = jsonschema.validators.validator_for(schema)
+        cls.check_schema(schema)
+        self._validator = cls(schema)
+        definitions = schema["definitions"]
+        self._definition = cls(definitions["policyDefinition"])
+        self._reference = cls(definitions["policyAliasReference"])
+
+        properties = definitions["policyDefinition"]["properties"]
+        self._modes = frozenset(properties["mode"]["enum"])
+        self._mxs = _list_pattern(properties["mxs"]["items"]["pattern"])
+        domain_pattern, = schema["properties"]["policies"]["patternProperties"]
+        self._domain = re.compile(domain_pattern)
+        self._domains = _list_pattern(domain_pattern)
+
+    def validate(self, policy_list):
+        """Return every Problem with @policy_list."""
+        return list(self.iter_problems(policy_list))
+
+    def errors(self, policy_list):
+        """Return the Problems with @policy_list that aren't warnings."""
+        return [problem for problem in self.iter_problems(policy_list)
+                if problem.severity == ERROR]
+
+    def changes(self, old, new):
+        """Return the (domains, aliases) of @new to check, given that @old
+        was valid: everything added or changed, plus the domains that refer
+        to an alias that is gone."""
+        old_policies = old.get("policies", {})
+        new_policies = new.get("policies", {})
+        old_aliases = old.get("policy-aliases", {})
+        new_aliases = new.get("policy-aliases", {})
+        domains = [domain for domain, entry in new_policies.items()
+                   if old_policies.get(domain, _MISSING) != entry]
+        aliases = [name for name, entry in new_aliases.items()
+                   if old_aliases.get(name, _MISSING) != entry]
+        removed = set(old_aliases) - set(new_aliases)
+        if removed:
+            seen = set(domains)
+            domains.extend(
+                domain for domain, entry in new_policies.items()
+                if isinstance(entry, dict) and
+                entry.get("policy-alias") in removed and domain not in seen)
+        return domains, aliases
+
+    def iter_changed_problems(self, old, new):
+        """Yield the Problems with @new that weren't already in @old."""
+        domains, aliases = self.changes(old, new)
+        return self.iter_problems(new, domains, aliases)
+
+    def iter_problems(self, policy_list, domains=None, aliases=None):
+        """Yield every Problem with @policy_list.
+
+        If @domains or @aliases is given, only those entries of "policies"
+        or "policy-aliases" are checked; the top level always is.
+        """
+        if not isinstance(policy_list, dict):
+            for problem in self._schema_problems(self._validator,
+                                                 policy_list):
+                yield problem
+            return
+        policies = policy_list.get("policies")
+        alias_definitions = policy_list.get("policy-aliases")
+        # The entries are checked below; here just the fields around them.
+        top = dict(policy_list)
+        if isinstance(policies, dict):
+            top["policies"] = {}
+        if isinstance(alias_definitions, dict):
+            top["policy-aliases"] = {}
+        for problem in self.top_problems(top):
+            yield problem
+
+        if isinstance(alias_definitions, dict):
+            if aliases is None:
+                aliases = alias_definitions
+            for name in aliases:
+                for problem in self.alias_problems(name,
+                                                   alias_definitions[name]):
+                    yield problem
+        else:
+            alias_definitions = {}
+
+        if not isinstance(policies, dict):
+            return
+        if domains is None:
+            domains = policies
+        duplicates = self._duplicates(policies)
+        all_named = _all_match(self._domains, domains)
+        for domain in domains:
+            if duplicates and normalize(domain) in duplicates:
+                others = [other for other in duplicates[normalize(domain)]
+                          if other != domain]
+                yield Problem(pointer("policies", domain), "same domain as "
+                              "%s" % ", ".join(map(repr, others)), ERROR)
+            for problem in self.policy_problems(domain, policies[domain],
+                                                alias_definitions, all_named):
+                yield problem
+
+    def top_problems(self, policy_list):
+        """Return the Problems with the top level of @policy_list, whose
+        "policies" and "policy-aliases" should be left empty."""
+        problems = list(self._schema_problems(self._validator, policy_list))
+        if not any(problem.path in ("/timestamp", "/expires")
+                   for problem in problems) and \
+                "timestamp" in policy_list and "expires" in policy_list:
+            times = {}
+            for name in ("timestamp", "expires"):
+                try:
+                    times[name] = parse_time(policy_list[name])
+                except ValueError as e:
+                    problems.append(Problem("/" + name, str(e), ERROR))
+            if len(times) == 2 and times["expires"] <= times["timestamp"]:
+                problems.append(Problem(
+                    "/expires", "%r is not after timestamp %r" %
+                    (policy_list["expires"], policy_list["timestamp"]),
+                    ERROR))
+        return problems
+
+    def alias_problems(self, name, entry):
+        """Return the Problems with alias @name, defined as @entry."""
+        path = ("policy-aliases", name)
+        problems = []
+        if not name:
+            problems.append(Problem(pointer(*path), "Additional properties "
+                                    "are not allowed ('' was unexpected)",
+                                    ERROR))
+        if self._definition_ok(entry):
+            problems.extend(self._mxs_problems(entry["mxs"], path))
+        else:
+            problems.extend(self._schema_problems(self._definition, entry,
+                                                  path))
+        return problems
+
+    def policy_problems(self, domain, entry, aliases, named=False):
+        """Return the Problems with the policy @entry for @domain, given the
+        names of the @aliases defined.  @named says @domain is already known
+        to be a valid name."""
+        path = ("policies", domain)
+        problems = []
+        if not named and not self._domain.search(domain):
+            # The schema's wording for a key matching no pattern.
+            problems.append(Problem(pointer(*path), "Additional properties "
+                                    "are not allowed (%r was unexpected)"
+                                    % domain, ERROR))
+        if isinstance(entry, dict) and "policy-alias" in entry:
+            if not self._reference_ok(entry):
+                problems.extend(self._schema_problems(self._reference, entry,
+                                                      path))
+            elif entry["policy-alias"] not in aliases:
+                problems.append(Problem(pointer(*path + ("policy-alias",)),
+                                        "unknown policy alias %r"
+                                        % entry["policy-alias"], ERROR))
+        elif self._definition_ok(entry):
+            problems.extend(self._mxs_problems(entry["mxs"], path))
+        else:
+            problems.extend(self._schema_problems(self._definition, entry,
+                                                  path))
+        return problems
+
+    def _definition_ok(self, entry):
+        # The policyDefinition rules, spelled out.
+        if type(entry) is not dict or len(entry) != 2 or \
+                entry.get("mode") not in self._modes:
+            return False
+        mxs = entry.get("mxs")
+        if type(mxs) is not list or not _all_match(self._mxs, mxs):
+            return False
+        return len(mxs) == 1 or len(set(mxs)) == len(mxs)
+
+    def _reference_ok(self, entry):
+        return type(entry) is dict and len(entry) == 1 and \
+            type(entry.get("policy-alias")) is str
+
+    @staticmethod
+    def _schema_problems(validator, instance, path=()):
+        for error in validator.iter_errors(instance):
+            yield Problem(pointer(*path + tuple(error.absolute_path)),
+                          error.message, ERROR)
+
+    @staticmethod
+    def _duplicates(policies):
+        """Map each name that several of @policies' domains normalize to to
+        those domains."""
+        # Two domains can only collide if one of them isn't normalized.
+        by_name = collections.defaultdict(list)
+        for domain in policies:
+            name = domain.lower()
+            if name != domain or name.endswith("."):
+                name = normalize(domain)
+                by_name[name].append(domain)
+        duplicates = {}
+        for name, domains in by_name.items():
+            if name in policies:
+                domains.append(name)
+            if len(domains) > 1:
+                duplicates[name] = sorted(domains)
+        return duplicates
+
+    @staticmethod
+    def _mxs_problems(mxs, path):
+        if len(mxs) == 1:
+            return ()
+        problems = []
+        # The schema's pattern has already ruled out trailing dots.
+        names = [mx.lower() for mx in mxs]
+        seen = {}
+        for i, name in enumerate(names):
+            if name in seen:
+                problems.append(Problem(pointer(*path + ("mxs", i)),
+                                        "%r repeats %r" %
+                                        (mxs[i], mxs[seen[name]]), WARNING))
+            else:
+                seen[name] = i
+        for i, name in enumerate(names):
+            dot = name.find(".", 1)
+            while dot != -1:
+                if name[dot:] in seen:
+                    problems.append(Problem(pointer(*path + ("mxs", i)),
+                                            "%r is already matched by %r" %
+                                            (mxs[i], name[dot:]), WARNING))
+                    break
+                dot = name.find(".", dot + 1)
+        return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Check a STARTTLS policy list")
+    parser.add_argument("policy", help="policy list to check")
+    parser.add_argument("--previous",
+                        help="a valid earlier version of the list; only "
+                        "what changed since is checked")
+    parser.add_argument("--quiet", action="store_true",
+                        help="don't print warnings")
+    parser.add_argument("--stream", action="store_true",
+                        help="read the list an entry at a time, in bounded "
+                        "memory (skips the checks that need the whole list)")
+    args = parser.parse_args(argv)
+    validator = PolicyValidator()
+    failed = []
+
+    def report(problem):
+        if problem.severity == ERROR:
+            failed.append(problem)
+        if problem.severity == ERROR or not args.quiet:
+            print(problem)
+
+    if args.stream:
+        # Imported here as PolicyStream itself builds on this module.
+        from PolicyStream import PolicyStream
+        for _ in PolicyStream(args.policy, validator, report):
+            pass
+        return 1 if failed else 0
+    with open(args.policy) as f:
+        policy_list = json.load(f)
+    if args.previous:
+        with open(args.previous) as f:
+            problems = validator.iter_changed_problems(json.load(f),
+                                                       policy_list)
+    else:
+        problems = validator.iter_problems(policy_list)
+    for problem in problems:
+        report(problem)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,688 @@
+#!/usr/bin/env python3
+"""
+Configure Postfix to use the STARTTLS policy list.
+
+The policy list is written out as a cdb: table (see Cdb.py), which every
+smtp process opens and looks domains up in without reading it whole, as it
+would a texthash: table.  The table is built under a temporary name and
+renamed into place, and isn't rebuilt at all while the policy list is the
+one it was last built from.
+
+  python tools/PostfixConfigGenerator.py policy.json /etc/postfix \
+      /etc/letsencrypt/live/example.com/
+
+Every run is checkpointed (see CheckpointStore.py) in
+<postfix dir>/starttls_everywhere_checkpoints: Postfix is only reloaded if
+the run changed a setting in main.cf, the policy map or the CA file, and
+rollback_checkpoints() restores the files as they were before a run.
+
+Fleet mode configures several Postfix instances (e.g. those postmulti
+manages) in one run: the policy map is built once, the Postfix version
+found once, and the instances are then configured in parallel threads,
+each getting a copy of the same table.  Add --instance for each further
+config directory, or --postmulti to take them from "postmulti -l".
+"""
+import argparse
+import collections
+import concurrent.futures
+import functools
+import hashlib
+import io
+import logging
+import sys
+import subprocess
+import time
+import os, os.path
+
+from AtomicWrite import atomic_write
+from CABundle import CABundle
+from Cdb import CdbWriter, write_cdb
+from CheckpointStore import CheckpointStore
+from PolicyIndex import normalize
+from PolicyStream import PolicyStream
+from PostfixMainCF import MainCF
+from PostfixSocketmap import policy_reply
+
+logger = logging.getLogger(__name__)
+
+POLICY_MAP_TYPE = "cdb"
+# Bump when the entries written for a policy change, so that tables built by
+# an older version are rebuilt even though the list hasn't changed.
+POLICY_MAP_FORMAT = b"1"
+
+CHECKPOINT_DIR = "starttls_everywhere_checkpoints"
+
+POSTCONF = "/usr/sbin/postconf"
+POSTMULTI = "/usr/sbin/postmulti"
+
+InstanceResult = collections.namedtuple(
+    "InstanceResult", ["postfix_dir", "error", "policy_changed",
+                       "ca_changed", "reloaded", "seconds"])
+
+
+class ExistingConfigError(ValueError): pass
+
+
+def policy_map_entries(policy_file):
+    """Yield the (key, value) of each smtp_tls_policy_maps entry for the
+    policy list at @policy_file.
+
+    Raises PolicyError if the list has an error.
+    """
+    for domain, policy in PolicyStream(policy_file):
+        value = policy_reply(policy)
+        if value is not None:
+            yield normalize(domain).encode("utf-8"), value.encode("utf-8")
+
+
+def policy_digest(path):
+    """Return the hash of the policy list at @path, as stamped on the policy
+    map built from it."""
+    digest = hashlib.sha256(POLICY_MAP_FORMAT + b"\0")
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class CompiledPolicy(object):
+    """The policy map for the policy list at @policy_file, built once so it
+    can be installed in any number of Postfix instances."""
+
+    def __init__(self, policy_file):
+        self.policy_file = policy_file
+        self.digest = policy_digest(policy_file)
+        f = io.BytesIO()
+        writer = CdbWriter(f)
+        for key, value in policy_map_entries(policy_file):
+            writer.add(key, value)
+        writer.finish()
+        self.data = f.getvalue()
+
+    def install(self, path):
+        """Write the table to @path, atomically."""
+        atomic_write(path, self.data)
+
+
+@functools.lru_cache(maxsize=None)
+def postfix_version(postconf=POSTCONF):
+    """Return the version of the Postfix whose postconf is @postconf, as a
+    tuple.  Each binary is only asked once."""
+    # Parse Postfix version number (feature support, syntax changes etc.)
+    cmd = subprocess.Popen([postconf, '-d', 'mail_version'],
+                           stdout=subprocess.PIPE)
+    stdout, _ = cmd.communicate()
+    stdout = stdout.decode("utf-8", "replace")
+    if cmd.returncode != 0:
+        raise Exception('PluginError: Unable to determine Postfix version.')
+
+    # grabs version component of string like "mail_version = 2.11.3"
+    mail_version = stdout.split()[2]
+    return tuple([int(i) for i in mail_version.split('.')])
+
+
+def postmulti_instances(postmulti=POSTMULTI):
+    """Return the config directories of the instances postmulti manages."""
+    output = subprocess.check_output([postmulti, "-l"])
+    # Each line is "name group enabled config_directory".
+    return [line.split()[3] for line in output.decode("utf-8").splitlines()
+            if len(line.split()) >= 4]
+
+
+class PostfixConfigGenerator:
+    """Configure the Postfix in @postfix_dir for the policy list at
+    @policy_config."""
+    def __init__(self,
+                 policy_config,
+                 postfix_dir,
+                 fixup=False,
+                 fopen=open,
+                 version=None,
+                 compiled=None,
+                 postconf=POSTCONF,
+                 ca_bundle=None):
+        self.fixup          = fixup
+        self.postfix_dir    = postfix_dir
+        self.policy_config  = policy_config
+        self.policy_file    = os.path.join(postfix_dir,
+                                           "starttls_everywhere_policy")
+        # Postfix opens <name>.cdb for cdb:<name>.
+        self.policy_map     = self.policy_file + "." + POLICY_MAP_TYPE
+        # The hash of the policy list policy_map was built from.
+        self.policy_stamp   = self.policy_file + ".sha256"
+        # A CompiledPolicy of policy_config, if it is already built.
+        self.compiled       = compiled
+        self.policy_changed = False
+        self.ca_file = os.path.join(postfix_dir, "starttls_everywhere_CAfile")
+        # A CABundle, if it is already built.
+        self.ca_bundle      = ca_bundle
+        self.ca_changed     = False
+
+        self.fn = self.find_postfix_cf()
+        self.cf = MainCF.from_file(self.fn, fopen)
+        self.new_cf = ""
+
+        self.checkpoints = CheckpointStore(os.path.join(postfix_dir,
+                                                        CHECKPOINT_DIR))
+        # Everything a run may change.  The stamp goes with the policy map
+        # so that a rolled back map is rebuilt on the next run.
+        self.managed_files = [self.fn, self.policy_map, self.policy_stamp,
+                              self.ca_file]
+        # Whether the last save() or rollback changed the configuration in
+        # effect, which is what restart() reloads for.
+        self.changed = False
+
+        # Set in .prepare() unless running in a test
+        self.postfix_version = version
+        self.postconf = postconf
+
+    def find_postfix_cf(self):
+        "Search far and wide for the correct postfix configuration file"
+        return os.path.join(self.postfix_dir, "main.cf")
+
+    def ensure_cf_var(self, var, ideal, also_acceptable):
+        """
+        Ensure that existing postfix config @var is in the list of @acceptable
+        values; if not, set it to the ideal value.
+        """
+        acceptable = [ideal] + also_acceptable
+
+        values = [parameter.value for parameter in self.cf.occurrences(var)]
+        if not values:
+            self.cf.set(var, ideal)
+        elif len(set(values)) > 1:
+            if self.fixup:
+                self.cf.set(var, ideal)
+            else:
+                raise ExistingConfigError(
+                    "Conflicting existing config values " + repr(
+                        self.cf.occurrences(var))
+                )
+        elif values[0] not in acceptable:
+            if self.fixup:
+                self.cf.set(var, ideal)
+            else:
+                raise ExistingConfigError(
+                    "Existing config has %s=%s"%(var,values[0])
+                )
+
+    def wrangle_existing_config(self):
+        """
+        Try to ensure/mutate that the config file is in a sane state.
+        Fixup means we'll delete existing lines if necessary to get there.
+        """
+        # Check we're currently accepting inbound STARTTLS sensibly
+        self.ensure_cf_var("smtpd_use_tls", "yes", [])
+        # Ideally we use it opportunistically in the outbound direction
+        self.ensure_cf_var("smtp_tls_security_level", "may", ["encrypt","dane"])
+        # Maximum verbosity lets us collect failure information
+        self.ensure_cf_var("smtp_tls_loglevel", "1", [])
+        # Inject a reference to our per-domain policy map
+        policy_cf_entry = POLICY_MAP_TYPE + ":" + self.policy_file
+
+        self.ensure_cf_var("smtp_tls_policy_maps", policy_cf_entry, [])
+        self.ensure_cf_var("smtp_tls_CAfile", self.ca_file, [])
+
+        # Disable SSLv2 and SSLv3. Syntax for `smtp_tls_protocols` changed
+        # between Postfix version 2.5 and 2.6, since we only support => 2.11
+        # we don't use nor support legacy Postfix syntax.
+        # - Server:
+        self.ensure_cf_var("smtpd_tls_protocols", "!SSLv2, !SSLv3", [])
+        self.ensure_cf_var("smtpd_tls_mandatory_protocols", "!SSLv2, !SSLv3", [])
+        # - Client:
+        self.ensure_cf_var("smtp_tls_protocols", "!SSLv2, !SSLv3", [])
+        self.ensure_cf_var("smtp_tls_mandatory_protocols", "!SSLv2, !SSLv3", [])
+
+    def begin_checkpoint(self):
+        """Snapshot the managed files before the first change of a run."""
+        self.checkpoints.begin(self.checkpoints.snapshot(self.managed_files))
+
+    def effective_config(self, state):
+        """Return what of the files in snapshot @state Postfix acts on: the
+        parameters set in main.cf, and the contents of the others."""
+        effective = dict(state)
+        if state.get(self.fn):
+            cf = MainCF(self.checkpoints.read(state[self.fn]).decode(
+                "utf-8", "replace").splitlines(True))
+            effective[self.fn] = sorted(dict(cf.items()).items())
+        # The stamp is only a record of what the policy map was built from.
+        effective.pop(self.policy_stamp, None)
+        return effective
+
+    def maybe_add_config_lines(self):
+        if not self.cf.edits:
+            return
+        logger.info('Setting in {}:'.format(self.fn))
+        for name, value in self.cf.edits:
+            logger.info('{} = {}'.format(name, value))
+        self.new_cf = self.cf.text()
+
+        if not os.access(self.fn, os.W_OK):
+            raise Exception("Can't write to %s, please re-run as root."
+                % self.fn)
+        atomic_write(self.fn, self.new_cf.encode("utf-8"))
+
+    def set_domainwise_tls_policies(self):
+        """Write the policy map, unless it was already built from this
+        version of the policy list.  Returns whether it was written."""
+        if self.compiled is not None:
+            digest = self.compiled.digest
+        else:
+            digest = policy_digest(self.policy_config)
+        try:
+            with open(self.policy_stamp) as f:
+                unchanged = f.read().strip() == digest and \
+                    os.path.exists(self.policy_map)
+        except (IOError, OSError):
+            unchanged = False
+        if unchanged:
+            logger.info('{} is up to date'.format(self.policy_map))
+            self.policy_changed = False
+            return False
+        if self.compiled is not None:
+            self.compiled.install(self.policy_map)
+        else:
+            write_cdb(self.policy_map, policy_map_entries(self.policy_config))
+        # Only once the map is in place, so the stamp never vouches for a
+        # map that wasn't written.
+        atomic_write(self.policy_stamp, (digest + "\n").encode("ascii"))
+        logger.info('Wrote {}'.format(self.policy_map))
+        self.policy_changed = True
+        return True
+
+    ### Let's Encrypt client IPlugin ###
+    # https://github.com/letsencrypt/letsencrypt/blob/master/letsencrypt/plugins/common.py#L35
+
+    def prepare(self):
+        """Prepare the plugin.
+        Finish up any additional initialization.
+        :raises .PluginError:
+            when full initialization cannot be completed.
+        :raises .MisconfigurationError:
+            when full initialization cannot be completed. Plugin will
+            be displayed on a list of available plugins.
+        :raises .NoInstallationError:
+            when the necessary programs/files cannot be located. Plugin
+            will NOT be displayed on a list of available plugins.
+        :raises .NotSupportedError:
+            when the installation is recognized, but the version is not
+            currently supported.
+        :rtype tuple:
+        """
+        # XXX ensure we raise the right kinds of exceptions
+
+        if not self.postfix_version:
+            self.postfix_version = self.get_version()
+
+        if self.postfix_version < (2, 11, 0):
+            raise Exception(
+                'NotSupportedError: Postfix version is too old -- test.'
+            )
+
+        # Postfix has changed support for TLS features, supported protocol versions
+        # KEX methods, ciphers et cetera over the years. We sort out version dependend
+        # differences here and pass them onto other configuration functions.
+        # see:
+        #  http://www.postfix.org/TLS_README.html
+        #  http://www.postfix.org/FORWARD_SECRECY_README.html
+
+        # Postfix == 2.2:
+        # - TLS support introduced via 3rd party patch, see:
+        #   http://www.postfix.org/TLS_LEGACY_README.html
+        
+        # Postfix => 2.2:
+        # - built-in TLS support added
+        # - Support for PFS introduced
+        # - Support for (E)DHE params >= 1024bit (need to be generated), default 1k
+
+        # Postfix => 2.5:
+        # - Syntax to specify mandatory protocol version changes:
+        #   *  < 2.5: `smtpd_tls_mandatory_protocols = TLSv1`
+        #   * => 2.5: `smtpd_tls_mandatory_protocols = !SSLv2, !SSLv3`
+        # - Certificate fingerprint verification added
+
+        # Postfix => 2.6:
+        # - Support for ECDHE NIST P-256 curve (enable `smtpd_tls_eecdh_grade = strong`)
+        # - Support for configurable cipher-suites and protocol versions added, pre-2.6 
+        #   releases always set EXPORT, options: `smtp_tls_ciphers` and `smtp_tls_protocols`
+        # - `smtp_tls_eccert_file` and `smtp_tls_eckey_file` config. options added
+        
+        # Postfix => 2.8:
+        # - Override Client suite preference w. `tls_preempt_cipherlist = yes`
+        # - Elliptic curve crypto. support enabled by default
+        
+        # Postfix => 2.9:
+        # - Public key fingerprint support added
+        # - `permit_tls_clientcerts`, `permit_tls_all_clientcerts` and
+        #   `check_ccert_access` config. options added
+
+        # Postfix <= 2.9.5:
+        # - BUG: Public key fingerprint is computed incorrectly
+
+        # Postfix => 3.1:
+        # - Built-in support for TLS management and DANE added, see:
+        #   http://www.postfix.org/postfix-tls.1.html
+
+    def get_version(self):
+        """Return the mail version of Postfix.
+
+        Version is returned as a tuple. (e.g. '2.11.3' is (2, 11, 3))
+
+        :returns: version
+        :rtype: tuple
+
+        :raises .PluginError:
+            Unable to find Postfix version.
+        """
+        return postfix_version(self.postconf)
+
+    def more_info(self):
+        """Human-readable string to help the user.
+        Should describe the steps taken and any relevant info to help the user
+        decide which plugin to use.
+        :rtype str:
+        """
+        return (
+            "Configures Postfix to try to authenticate mail servers, use "
+            "installed certificates and disable weak ciphers and protocols.{0}"
+            "Server root: {root}{0}"
+            "Version: {version}".format(
+                os.linesep,
+                root=self.postfix_dir,
+                version='.'.join([str(i) for i in self.postfix_version]))
+        )
+
+
+    ### Let's Encrypt client IInstaller ###
+    # https://github.com/letsencrypt/letsencrypt/blob/master/letsencrypt/interfaces.py#L232
+
+    def get_all_names(self):
+        """Returns all names that may be authenticated.
+        :rtype: `list` of `str`
+        """
+        var_names = ('myhostname', 'mydomain', 'myorigin')
+        names_found = set()
+        for found_var, found_value in self.cf.items():
+            if found_var in var_names:
+                names_found.add(found_value)
+        name_list = list(names_found)
+        name_list.sort()
+        return name_list
+
+    def deploy_cert(self, domain, _cert_path, key_path, _chain_path, fullchain_path):
+        """Deploy certificate.
+        :param str domain: domain to deploy certificate file
+        :param str cert_path: absolute path to the certificate file
+        :param str key_path: absolute path to the private key file
+        :param str chain_path: absolute path to the certificate chain file
+        :param str fullchain_path: absolute path to the certificate fullchain
+            file (cert plus chain)
+        :raises .PluginError: when cert cannot be deployed
+        """
+        self.begin_checkpoint()
+        self.wrangle_existing_config()
+        self.ensure_cf_var("smtpd_tls_cert_file", fullchain_path, [])
+        self.ensure_cf_var("smtpd_tls_key_file", key_path, [])
+        self.set_domainwise_tls_policies()
+        self.update_CAfile()
+
+    def enhance(self, domain, enhancement, options=None):
+        """Perform a configuration enhancement.
+        :param str domain: domain for which to provide enhancement
+        :param str enhancement: An enhancement as defined in
+            :const:`~letsencrypt.constants.ENHANCEMENTS`
+        :param options: Flexible options parameter for enhancement.
+            Check documentation of
+            :const:`~letsencrypt.constants.ENHANCEMENTS`
+            for expected options for each enhancement.
+        :raises .PluginError: If Enhancement is not supported, or if
+            an error occurs during the enhancement.
+        """
+
+    def supported_enhancements(self):
+        """Returns a list of supported enhancements.
+        :returns: supported enhancements which should be a subset of
+            :const:`~letsencrypt.constants.ENHANCEMENTS`
+        :rtype: :class:`list` of :class:`str`
+        """
+
+    def get_all_certs_keys(self):
+        """Retrieve all certs and keys set in configuration.
+        :returns: tuples with form `[(cert, key, path)]`, where:
+            - `cert` - str path to certificate file
+            - `key` - str path to associated key file
+            - `path` - file path to configuration file
+        :rtype: list
+        """
+        cert_materials = {'smtpd_tls_key_file': None,
+                          'smtpd_tls_cert_file': None,
+                         }
+        for found_var in cert_materials:
+            cert_materials[found_var] = self.cf.get(found_var)
+
+        if not all(cert_materials.values()):
+            cert_material_tuples = []
+        else:
+            cert_material_tuples = [(cert_materials['smtpd_tls_cert_file'],
+                                     cert_materials['smtpd_tls_key_file'],
+                                     self.fn),]
+        return cert_material_tuples
+
+    def save(self, title=None, temporary=False):
+        """Saves all changes to the configuration files.
+        Both title and temporary are needed because a save may be
+        intended to be permanent, but the save is not ready to be a full
+        checkpoint. If an exception is raised, it is assumed a new
+        checkpoint was not created.
+        :param str title: The title of the save. If a title is given, the
+            configuration will be saved as a new checkpoint and put in a
+            timestamped directory. `title` has no effect if temporary is true.
+        :param bool temporary: Indicates whether the changes made will
+            be quickly reversed in the future (challenges)
+        :raises .PluginError: when save is unsuccessful
+        """
+        self.begin_checkpoint()
+        self.maybe_add_config_lines()
+        if temporary:
+            # Still pending, for recovery_routine() to undo.
+            return
+        after = self.checkpoints.snapshot(self.managed_files)
+        before = self.checkpoints.finish(after, title)
+        self.changed = self.effective_config(before) != \
+            self.effective_config(after)
+        if not self.changed:
+            logger.info('No effective change to the configuration')
+
+    def rollback_checkpoints(self, rollback=1):
+        """Revert `rollback` number of configuration checkpoints.
+        :raises .PluginError: when configuration cannot be fully reverted
+        """
+        restored = self.checkpoints.rollback(rollback)
+        for path in restored:
+            logger.info('Restored {}'.format(path))
+        self.changed = self.changed or bool(restored)
+
+    def recovery_routine(self):
+        """Revert configuration to most recent finalized checkpoint.
+        Remove all changes (temporary and permanent) that have not been
+        finalized. This is useful to protect against crashes and other
+        execution interruptions.
+        :raises .errors.PluginError: If unable to recover the configuration
+        """
+        restored = self.checkpoints.recover()
+        for path in restored:
+            logger.info('Restored {}'.format(path))
+        self.changed = self.changed or bool(restored)
+
+    def view_config_changes(self):
+        """Display all of the LE config changes.
+        :raises .PluginError: when config changes cannot be parsed
+        """
+        for checkpoint in reversed(self.checkpoints.checkpoints()):
+            changed = sorted(path for path in checkpoint["after"]
+                             if checkpoint["before"].get(path) !=
+                             checkpoint["after"][path])
+            print("%s %s: %s" % (
+                time.strftime("%Y-%m-%d %H:%M:%S",
+                              time.localtime(checkpoint["time"])),
+                checkpoint["title"] or "(untitled)", ", ".join(changed)))
+
+    def config_test(self):
+        """Make sure the configuration is valid.
+        :raises .MisconfigurationError: when the config is not in a usable state
+        """
+        if os.geteuid() != 0:
+            rc = os.system('sudo /usr/sbin/postfix check')
+        else:
+            rc = os.system('/usr/sbin/postfix check')
+        if rc != 0:
+            raise Exception('MisconfigurationError: Postfix failed self-check.')
+
+    def restart(self, force=False):
+        """Restart or refresh the server content.
+        Skipped, unless @force is set, if the configuration in effect hasn't
+        changed.  Returns whether Postfix was reloaded.
+        :raises .PluginError: when server cannot be restarted
+        """
+        if not (self.changed or force):
+            logger.info('Not reloading postfix in {}: nothing changed'.format(
+                self.postfix_dir))
+            return False
+        logger.info('Reloading postfix config in {}...'.format(
+            self.postfix_dir))
+        # "-c" picks the instance, which "service postfix reload" can't.
+        cmd = ["postfix", "-c", self.postfix_dir, "reload"]
+        if os.geteuid() != 0:
+            cmd.insert(0, "sudo")
+        rc = subprocess.call(cmd)
+        if rc != 0:
+            raise Exception('PluginError: cannot restart postfix')
+        self.changed = False
+        return True
+
+    def update_CAfile(self):
+        """Install the CA bundle as ca_file, unless it already is.  Returns
+        whether it was written."""
+        if self.ca_bundle is None:
+            self.ca_bundle = CABundle.from_directory()
+        self.ca_changed = self.ca_bundle.install(self.ca_file)
+        logger.info('{} {}'.format(
+            self.ca_file, "updated" if self.ca_changed else "is up to date"))
+        return self.ca_changed
+
+
+def configure_instance(policy_file, postfix_dir, cert_paths,
+                       version=None, compiled=None, reload=True,
+                       ca_bundle=None):
+    """Configure the Postfix instance in @postfix_dir with the certificate
+    files @cert_paths, (cert, key, chain, fullchain).
+
+    Returns an InstanceResult; errors are reported in it, not raised.
+    """
+    start = time.perf_counter()
+    error = None
+    pcgen = None
+    reloaded = False
+    try:
+        pcgen = PostfixConfigGenerator(policy_file, postfix_dir, fixup=True,
+                                       version=version, compiled=compiled,
+                                       ca_bundle=ca_bundle)
+        pcgen.prepare()
+        pcgen.deploy_cert("example.com", *cert_paths)
+        pcgen.save()
+        if reload:
+            reloaded = pcgen.restart()
+    except Exception as e:
+        error = str(e) or repr(e)
+    return InstanceResult(postfix_dir, error,
+                          pcgen is not None and pcgen.policy_changed,
+                          pcgen is not None and pcgen.ca_changed,
+                          reloaded, time.perf_counter() - start)
+
+
+def configure_fleet(policy_file, postfix_dirs, cert_paths, workers=None,
+                    postconf=POSTCONF, reload=True, ca_bundle=None):
+    """Configure every Postfix instance in @postfix_dirs, up to @workers at
+    a time, building the policy map and CA bundle and finding the version
+    only once.
+
+    Returns an InstanceResult per instance, in the order given.
+    """
+    compiled = CompiledPolicy(policy_file)
+    if ca_bundle is None:
+        ca_bundle = CABundle.from_directory()
+    version = postfix_version(postconf)
+    workers = workers or min(32, len(postfix_dirs)) or 1
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        futures = [executor.submit(configure_instance, policy_file,
+                                   postfix_dir, cert_paths, version,
+                                   compiled, reload, ca_bundle)
+                   for postfix_dir in postfix_dirs]
+        return [future.result() for future in futures]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Configure Postfix to use the STARTTLS policy list")
+    parser.add_argument("policy", help="the policy list, policy.json")
+    parser.add_argument("postfix_dir", help="Postfix config directory, e.g. "
+                        "/etc/postfix")
+    parser.add_argument("le_lineage", help="Let's Encrypt lineage, e.g. "
+                        "/etc/letsencrypt/live/example.com/")
+    parser.add_argument("--instance", action="append", default=[],
+                        metavar="DIR", help="configure the Postfix instance "
+                        "in DIR too (may be given more than once)")
+    parser.add_argument("--postmulti", action="store_true",
+                        help="configure every instance postmulti lists too")
+    parser.add_argument("--workers", type=int,
+                        help="instances configured at once (default: all, "
+                        "up to 32)")
+    parser.add_argument("--postconf", default=POSTCONF,
+                        help="default: %(default)s")
+    args = parser.parse_args(argv)
+    logging.basicConfig(stream=sys.stderr, level=logging.DEBUG,
+                        format="%(message)s")
+    le_lineage = args.le_lineage
+    pieces = [os.path.join(le_lineage, f) for f in (
+        "cert.pem", "privkey.pem", "chain.pem", "fullchain.pem")]
+    if not os.path.isdir(le_lineage) or not all(os.path.isfile(p) for p in pieces) :
+        parser.error("Let's Encrypt directory %s does not appear to contain "
+                     "a valid lineage" % le_lineage)
+    postfix_dirs = [args.postfix_dir] + args.instance
+    if args.postmulti:
+        postfix_dirs.extend(postmulti_instances())
+    # Each directory once, in the order first given.
+    postfix_dirs = list(collections.OrderedDict.fromkeys(
+        os.path.normpath(postfix_dir) for postfix_dir in postfix_dirs))
+    if len(postfix_dirs) == 1:
+        pcgen = PostfixConfigGenerator(args.policy, postfix_dirs[0],
+                                       fixup=True, postconf=args.postconf)
+        pcgen.prepare()
+        pcgen.deploy_cert("example.com", *pieces)
+        pcgen.save()
+        pcgen.restart()
+        return 0
+
+    # Each instance logs the same steps; just report how each went.
+    logger.setLevel(logging.WARNING)
+    start = time.perf_counter()
+    results = configure_fleet(args.policy, postfix_dirs, pieces,
+                              args.workers, args.postconf)
+    for result in results:
+        if result.error:
+            print("%s: failed in %.3fs: %s" % (result.postfix_dir,
+                                               result.seconds, result.error))
+        else:
+            print("%s: ok in %.3fs (policy map %s, CA file %s, %s)" % (
+                result.postfix_dir, result.seconds,
+                "updated" if result.policy_changed else "unchanged",
+                "updated" if result.ca_changed else "unchanged",
+                "reloaded" if result.reloaded else "not reloaded"))
+    failed = sum(1 for result in results if result.error)
+    print("%d of %d instances configured in %.3fs" % (
+        len(results) - failed, len(results), time.perf_counter() - start))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
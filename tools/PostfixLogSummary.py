@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+"""
+Detect delivery problems in Postfix logs that may be caused by the policy
+list.
+
+Reads the mail log (--log, by default /var/log/mail.log, or - for stdin)
+and reports, per policy (the recipient domains an MX host serves), how its
+TLS connections were verified, and which MX hosts mail was deferred to for a
+TLS-related reason.
+
+The log is parsed as a pipeline of generators over raw bytes:
+
+  * lines that don't mention TLS at all, nearly all of them, are dropped with
+    one substring test;
+  * the rest are matched against a single pattern for both kinds of event,
+    connections established and deferrals;
+  * only matching lines have their timestamp parsed, and parsed timestamps
+    are memoized, so a busy second is parsed once;
+  * MX host names are interned, and the policy domains each one serves are
+    looked up in the PolicyIndex once and then kept in an LRU cache, so
+    attributing an event costs the same however long the list is.
+
+tests/postfix_log_benchmark.py measures it on a synthetic log.
+
+How far the log has been read is checkpointed in the --checkpoint file, so
+each run reads only what the log gained since the last one, following it
+through rotation (see LogReader); standard input is read whole, every time.
+With --follow it keeps reading as the log grows, printing each TLS deferral
+as it happens:
+
+  python tools/PostfixLogSummary.py policy.json --log /var/log/mail.log
+  python tools/PostfixLogSummary.py policy.json --follow
+"""
+import argparse
+import collections
+import functools
+import logging
+import re
+import sys
+import time
+
+from LogReader import LogReader
+from PolicyIndex import PolicyIndex
+
+logger = logging.getLogger(__name__)
+
+TIME_FORMAT = "%b %d %H:%M:%S"
+MAIL_LOG = "/var/log/mail.log"
+CHECKPOINT_FILE = "/var/lib/starttls-everywhere/mail-log-checkpoint.json"
+
+MX_CACHE_SIZE = 4096
+
+CONNECTED = "connected"
+DEFERRED = "deferred"
+
+# TODO: There's more to be learned from postfix logs!  Here's one sample
+# observed during failures from the sender vagrant vm:
+
+# Jun  6 00:21:31 precise32 postfix/smtpd[3648]: connect from localhost[127.0.0.1]
+# Jun  6 00:21:34 precise32 postfix/smtpd[3648]: lost connection after STARTTLS from localhost[127.0.0.1]
+# Jun  6 00:21:34 precise32 postfix/smtpd[3648]: disconnect from localhost[127.0.0.1]
+# Jun  6 00:21:56 precise32 postfix/master[3001]: reload -- version 2.9.6, configuration /etc/postfix
+# Jun  6 00:22:01 precise32 postfix/pickup[3674]: AF3B6480475: uid=0 from=<root>
+# Jun  6 00:22:01 precise32 postfix/cleanup[3680]: AF3B6480475: message-id=<20140606002201.AF3B6480475@sender.example.com>
+# Jun  6 00:22:01 precise32 postfix/qmgr[3673]: AF3B6480475: from=<root@sender.example.com>, size=576, nrcpt=1 (queue active)
+# Jun  6 00:22:01 precise32 postfix/smtp[3682]: SSL_connect error to valid-example-recipient.com[192.168.33.7]:25: -1
+# Jun  6 00:22:01 precise32 postfix/smtp[3682]: warning: TLS library problem: 3682:error:140740BF:SSL routines:SSL23_CLIENT_HELLO:no protocols available:s23_clnt.c:381:
+# Jun  6 00:22:01 precise32 postfix/smtp[3682]: AF3B6480475: to=<vagrant@valid-example-recipient.com>, relay=valid-example-recipient.com[192.168.33.7]:25, delay=0.06, delays=0.03/0.03/0/0, dsn=4.7.5, status=deferred (Cannot start TLS: handshake failure)
+#
+# Also:
+# Oct 10 19:12:13 sender postfix/smtp[1711]: 62D3F481249: to=<vagrant@valid-example-recipient.com>, relay=valid-example-recipient.com[192.168.33.7]:25, delay=0.07, delays=0.03/0.01/0.03/0, dsn=4.7.4, status=deferred (TLS is required, but was not offered by host valid-example-recipient.com[192.168.33.7])
+
+# Both kinds of event, in one pattern.  A typical connection looks like:
+# Jun 12 06:24:14 sender postfix/smtp[9045]: Untrusted TLS connection established to valid-example-recipient.com[192.168.33.7]:25: TLSv1.1 with cipher AECDH-AES256-SHA (256/256 bits)
+# and the validation (Anonymous, Untrusted, Trusted or Verified) tells how
+# the certificate was checked.  A message deferred for a TLS-related reason
+# is the other sample above.
+EVENT_RE = re.compile(
+    br"(?P<validation>[A-Za-z]+) TLS connection established to "
+    br"(?P<mx>[^[\s]*)"
+    br"|relay=(?P<relay>[^[ ]*).* status=deferred.*TLS")
+
+TLSEvent = collections.namedtuple("TLSEvent",
+                                  ["timestamp", "kind", "mx", "validation"])
+
+
+@functools.lru_cache(maxsize=1024)
+def parse_timestamp(stamp):
+    """Parse the syslog timestamp @stamp, e.g. b"Jun 12 06:24:14"."""
+    return time.strptime(stamp.decode("ascii", "replace"), TIME_FORMAT)
+
+
+@functools.lru_cache(maxsize=MX_CACHE_SIZE)
+def _name(raw):
+    """The interned, lowercased str of the host name @raw."""
+    return sys.intern(raw.decode("ascii", "replace").lower())
+
+
+@functools.lru_cache(maxsize=64)
+def _validation(raw):
+    """The interned str of the validation word @raw, e.g. b"Trusted"."""
+    return sys.intern(raw.decode("ascii", "replace"))
+
+
+class LogParser(object):
+    """Turns mail log lines into TLSEvents.
+
+    An event whose line doesn't start with a timestamp in TIME_FORMAT (say,
+    from a syslog writing RFC 3339 ones) has a timestamp of None.  It is
+    skipped only if there is an earliest_timestamp, since it can't be
+    compared with it.
+
+    After a pass over the log, last_timestamp is the timestamp of its last
+    line, matching or not, and unparsed counts the events without one.
+    """
+
+    def __init__(self, earliest_timestamp=None):
+        self.earliest_timestamp = earliest_timestamp
+        self.last_timestamp = None
+        self.unparsed = 0
+
+    def events(self, lines):
+        """Yield a TLSEvent for each event in the byte strings @lines that is
+        at or after earliest_timestamp."""
+        earliest = self.earliest_timestamp
+        search = EVENT_RE.search
+        skipped = 0
+        line = None
+        for line in lines:
+            if b"TLS" not in line:
+                continue
+            match = search(line)
+            if match is None:
+                continue
+            try:
+                timestamp = parse_timestamp(line[:15])
+            except ValueError:
+                timestamp = None
+                self.unparsed += 1
+            if earliest is not None:
+                if timestamp is None:
+                    skipped += 1
+                    continue
+                if timestamp < earliest:
+                    continue
+            mx = match.group("mx")
+            if mx is not None:
+                yield TLSEvent(timestamp, CONNECTED, _name(mx),
+                               _validation(match.group("validation")))
+            else:
+                yield TLSEvent(timestamp, DEFERRED,
+                               _name(match.group("relay")), None)
+        if line is not None:
+            try:
+                self.last_timestamp = parse_timestamp(line[:15])
+            except ValueError:
+                pass
+        if skipped:
+            logger.warning("Skipped %d TLS events whose lines don't start "
+                           "with a %s timestamp", skipped, TIME_FORMAT)
+
+
+class MXDomains(object):
+    """The policy domains each MX host serves according to @index, as one
+    interned string, for the last @maxsize hosts looked up.
+
+    A log names the same few hundred MX hosts over and over, so each is
+    only walked through the index once.
+    """
+
+    def __init__(self, index, maxsize=MX_CACHE_SIZE):
+        self.index = index
+        self.lookup = functools.lru_cache(maxsize=maxsize)(self._lookup)
+
+    def _lookup(self, mx_host):
+        return sys.intern(", ".join(sorted(
+            self.index.domains_for_mx(mx_host))))
+
+
+def attribute(events, mx_domains):
+    """Yield (event, domains) for each of @events, with the policy domains
+    its MX host serves according to the MXDomains @mx_domains."""
+    lookup = mx_domains.lookup
+    for event in events:
+        yield event, lookup(event.mx)
+
+
+def summarize(attributed):
+    """Return (counts, tls_deferred, seen_trusted) for the attributed events.
+
+    counts maps the domains of each policy to a count of connections by
+    validation, plus "all"; tls_deferred counts deferrals by MX host.
+    """
+    seen_trusted = False
+    counts = collections.defaultdict(lambda: collections.defaultdict(int))
+    tls_deferred = collections.defaultdict(int)
+    for event, domains in attributed:
+        if event.kind == DEFERRED:
+            tls_deferred[event.mx] += 1
+            continue
+        if event.validation in ("Trusted", "Verified"):
+            seen_trusted = True
+        if domains:
+            counts[domains][event.validation] += 1
+            counts[domains]["all"] += 1
+    return counts, tls_deferred, seen_trusted
+
+
+def get_counts(input, index, earliest_timestamp, mx_domains=None):
+    """Summarize the log lines (bytes) @input; returns (counts, tls_deferred,
+    seen_trusted, the timestamp of the last line).
+
+    MX hosts are attributed through @mx_domains, by default a new MXDomains
+    for the PolicyIndex @index.
+    """
+    if mx_domains is None:
+        mx_domains = MXDomains(index)
+    parser = LogParser(earliest_timestamp)
+    counts, tls_deferred, seen_trusted = summarize(
+        attribute(parser.events(input), mx_domains))
+    return (counts, tls_deferred, seen_trusted, parser.last_timestamp)
+
+
+def print_summary(counts):
+    for domains, validations in counts.items():
+        for validation, validation_count in validations.items():
+            if validation == "all":
+                continue
+            print(domains, validation,
+                  validation_count / validations["all"], "of",
+                  validations["all"])
+
+
+def follow(reader, index, interval):
+    """Print each TLS deferral as it is logged, until interrupted."""
+    mx_domains = MXDomains(index)
+    parser = LogParser()
+    try:
+        for event, domains in attribute(
+                parser.events(reader.follow(interval)), mx_domains):
+            if event.kind != DEFERRED:
+                continue
+            when = ("%s: " % time.strftime(TIME_FORMAT, event.timestamp)
+                    if event.timestamp is not None else "")
+            print("%smail to %s was deferred due to TLS problems%s" %
+                  (when, event.mx,
+                   " (policy for %s)" % domains if domains else ""),
+                  flush=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        reader.save()
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description='Detect delivery problems'
+        ' in Postfix log files that may be caused by security policies')
+    arg_parser.add_argument('-c', action="store_true", dest="cron",
+                            default=False)
+    arg_parser.add_argument("policy_file", nargs='?', default="policy.json",
+                            help="STARTTLS policy list")
+    arg_parser.add_argument("--log", default=MAIL_LOG,
+                            help="the mail log, or - for standard input, "
+                            "read whole (default: %(default)s)")
+    arg_parser.add_argument("--checkpoint", default=CHECKPOINT_FILE,
+                            help="where to remember how far the log has "
+                            "been read (default: %(default)s)")
+    arg_parser.add_argument("-f", "--follow", action="store_true",
+                            help="keep reading the log as it grows, "
+                            "printing each TLS deferral")
+    arg_parser.add_argument("--interval", type=float, default=1.0,
+                            help="seconds between reads with --follow")
+
+    args = arg_parser.parse_args(argv)
+    index = PolicyIndex.from_file(args.policy_file)
+
+    if args.log == "-":
+        if args.follow:
+            arg_parser.error("--follow needs a log file")
+        reader = None
+        lines = sys.stdin.buffer
+    else:
+        reader = LogReader(args.log, args.checkpoint)
+        if args.follow:
+            follow(reader, index, args.interval)
+            return 0
+        lines = reader.lines()
+    (counts, tls_deferred, seen_trusted, _) = get_counts(lines, index, None)
+    if reader is not None:
+        reader.save()
+        reader.close()
+
+    # If not running in cron, print an overall summary of log lines seen
+    # from known hosts.
+    if not args.cron:
+        print_summary(counts)
+        if not seen_trusted:
+            print('No Trusted connections seen! Probably need to install a '
+                  'CAfile.')
+
+    if len(tls_deferred) > 0:
+        print("Some mail was deferred due to TLS problems:")
+        for (k, v) in tls_deferred.items():
+            print("%s: %s" % (k, v))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
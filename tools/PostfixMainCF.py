@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+A parsed Postfix main.cf that can be edited without disturbing its layout.
+
+main.cf is read in one pass into its parameters, each with the span of
+lines it takes up, and an index from parameter name to those parameters.
+Per postconf(5), a logical line starts with non-whitespace text and a line
+that starts with whitespace continues it; empty lines and lines whose first
+non-whitespace character is "#" are ignored, even between a line and its
+continuations.  When a parameter is given more than once, the last one
+counts.
+
+Edits are queued with set() and applied together by text(), which copies
+every line it doesn't touch as it was: each parameter set is commented out
+where it was, and the new settings are appended in one block at the end.
+"""
+import collections
+
+ADDED_HEADER = ["#",
+                "# New config lines added by STARTTLS Everywhere",
+                "#"]
+REMOVED_HEADER = "# Line removed by STARTTLS Everywhere\n"
+
+Parameter = collections.namedtuple("Parameter",
+                                   ["name", "value", "start", "end"])
+
+
+def _is_ignored(line):
+    stripped = line.strip()
+    return not stripped or stripped.startswith("#")
+
+
+class MainCF(object):
+    """main.cf, given as its @lines, each with its line ending."""
+
+    def __init__(self, lines):
+        self.lines = list(lines)
+        # The Parameters in file order, and the indexes of each name's.
+        self.parameters = []
+        self._index = collections.defaultdict(list)
+        self._edits = collections.OrderedDict()
+        self._parse()
+
+    @classmethod
+    def from_file(cls, path, fopen=open):
+        with fopen(path) as f:
+            return cls(f.readlines())
+
+    def _parse(self):
+        start = None
+        parts = []
+        last = None
+        for num, line in enumerate(self.lines):
+            if _is_ignored(line):
+                continue
+            if line[0] in " \t" and start is not None:
+                parts.append(line.strip())
+                last = num
+                continue
+            self._add(start, last, parts)
+            start = last = num
+            parts = [line.strip()]
+        self._add(start, last, parts)
+
+    def _add(self, start, end, parts):
+        if start is None:
+            return
+        name, sep, value = " ".join(parts).partition("=")
+        name = name.strip()
+        if not sep or not name or " " in name:
+            # Not a parameter setting; left as it is.
+            return
+        self._index[name].append(len(self.parameters))
+        self.parameters.append(Parameter(name, value.strip(), start, end))
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def get(self, name, default=None):
+        """Return the value Postfix uses for @name, or @default."""
+        indexes = self._index.get(name)
+        if not indexes:
+            return default
+        return self.parameters[indexes[-1]].value
+
+    def occurrences(self, name):
+        """Return every Parameter setting @name, in file order."""
+        return [self.parameters[i] for i in self._index.get(name, ())]
+
+    def items(self):
+        """Iterate over the (name, value) of every parameter setting."""
+        for parameter in self.parameters:
+            yield parameter.name, parameter.value
+
+    def set(self, name, value):
+        """Queue setting @name to @value, replacing every setting of it."""
+        self._edits[name] = value
+
+    @property
+    def edits(self):
+        """The (name, value) of each queued edit, in order."""
+        return list(self._edits.items())
+
+    def text(self):
+        """Return main.cf with the queued edits applied."""
+        if not self._edits:
+            return "".join(self.lines)
+        # Per line: None if it stays, else whether it starts a parameter.
+        removed = [None] * len(self.lines)
+        for name in self._edits:
+            for parameter in self.occurrences(name):
+                for num in range(parameter.start, parameter.end + 1):
+                    removed[num] = num == parameter.start
+        out = []
+        for num, line in enumerate(self.lines):
+            if removed[num] is None:
+                out.append(line)
+                continue
+            if removed[num]:
+                out.append(REMOVED_HEADER)
+            out.append("# " + line)
+        if out and not out[-1].endswith("\n"):
+            out.append("\n")
+        out.extend(line + "\n" for line in ADDED_HEADER)
+        out.extend("%s = %s\n" % edit for edit in self._edits.items())
+        return "".join(out)
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+Postfix socketmap server for smtp_tls_policy_maps.
+
+Instead of writing the policy list out as a texthash: map (which needs a
+Postfix reload, after which every smtp process re-reads the whole file), run
+this daemon and point Postfix at it:
+
+  smtp_tls_policy_maps = socketmap:unix:/var/spool/postfix/private/starttls:starttls
+
+Queries are answered from an in-memory PolicyIndex.  A domain whose policy is
+in enforce mode gets "secure match=<its mxs patterns>"; domains in testing
+mode, domains not on the list, and every domain once the list has expired
+get NOTFOUND, which leaves Postfix on its default (opportunistic) TLS policy.
+
+The policy file is checked for changes every --check-interval seconds (and
+on SIGHUP).  A changed file is parsed off the event loop and the new index
+swapped in with one assignment, so queries never see a half-loaded list and
+Postfix never needs a reload.  If the new file can't be loaded, the old
+index keeps serving.
+
+The protocol is described in socketmap_table(5): each request is a netstring
+"<name> <key>", each reply a netstring "OK <value>", "NOTFOUND ", "TEMP
+<reason>", "TIMEOUT <reason>" or "PERM <reason>".
+"""
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import sys
+import time
+
+from PolicyIndex import PolicyIndex, parse_time
+
+logger = logging.getLogger(__name__)
+
+# socketmap_table(5): "The maximum length of a request or reply is 100000".
+MAX_NETSTRING = 100000
+
+
+class NetstringError(ValueError):
+    pass
+
+
+def netstring(data):
+    return b"%d:%s," % (len(data), data)
+
+
+async def read_netstring(reader):
+    """Return the payload of the next netstring, or None at end of stream."""
+    try:
+        header = await reader.readuntil(b":")
+    except asyncio.IncompleteReadError as e:
+        if e.partial:
+            raise NetstringError("truncated netstring length")
+        return None
+    except asyncio.LimitOverrunError:
+        raise NetstringError("netstring length too long")
+    length = header[:-1]
+    if not length.isdigit() or len(length) > len(str(MAX_NETSTRING)):
+        raise NetstringError("bad netstring length %r" % length[:16])
+    length = int(length)
+    if length > MAX_NETSTRING:
+        raise NetstringError("netstring of %d bytes is too long" % length)
+    data = await reader.readexactly(length + 1)
+    if data[-1:] != b",":
+        raise NetstringError("netstring not terminated by a comma")
+    return data[:-1]
+
+
+def policy_reply(policy):
+    """Return the smtp_tls_policy_maps value for @policy, or None."""
+    if policy is None or policy.mode != "enforce" or not policy.mxs:
+        return None
+    return "secure match=" + ":".join(policy.mxs)
+
+
+class PolicyMap(object):
+    """A loaded policy list and its ready-made replies."""
+
+    def __init__(self, index, stat=None):
+        self.index = index
+        # (st_dev, st_ino, st_size, st_mtime_ns) of the file it came from
+        self.stat = stat
+        self.expires = None
+        if index.expires is not None:
+            self.expires = parse_time(index.expires)
+        self.expired = False
+        # Policy -> encoded reply.  Domains sharing an alias share an entry.
+        self._replies = {}
+
+    def lookup(self, key, now):
+        """Return the reply payload for recipient domain @key at time @now."""
+        if self.expires is not None and now >= self.expires:
+            if not self.expired:
+                self.expired = True
+                logger.error("The policy list expired at %s; falling back "
+                             "to opportunistic TLS for every domain",
+                             self.index.expires)
+            return b"NOTFOUND "
+        policy = self.index.policy_for(key)
+        if policy is None:
+            return b"NOTFOUND "
+        reply = self._replies.get(policy)
+        if reply is None:
+            value = policy_reply(policy)
+            reply = b"OK " + value.encode("ascii") if value is not None \
+                else b"NOTFOUND "
+            self._replies[policy] = reply
+        return reply
+
+
+def _file_stat(path):
+    st = os.stat(path)
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def load(path):
+    """Load the policy list at @path into a PolicyMap."""
+    stat = _file_stat(path)
+    return PolicyMap(PolicyIndex.from_file(path), stat)
+
+
+class SocketmapProtocol(asyncio.Protocol):
+    """One Postfix connection, answering each query as it arrives.
+
+    Postfix keeps its connections open and sends one query at a time, so the
+    common case is a single whole netstring per data_received() call; that
+    case is parsed without copying into the buffer.
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+        self.buffer = b""
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        buffer = self.buffer + data if self.buffer else data
+        replies = []
+        start = 0
+        while True:
+            colon = buffer.find(b":", start, start + 8)
+            if colon == -1:
+                if len(buffer) - start >= 8:
+                    return self.fail(replies, "bad netstring length")
+                break
+            length = buffer[start:colon]
+            if not length.isdigit():
+                return self.fail(replies, "bad netstring length %r"
+                                 % length[:16])
+            length = int(length)
+            if length > MAX_NETSTRING:
+                return self.fail(replies, "netstring of %d bytes is too long"
+                                 % length)
+            end = colon + 1 + length
+            if len(buffer) <= end:
+                break
+            if buffer[end] != 0x2c:  # ","
+                return self.fail(replies,
+                                 "netstring not terminated by a comma")
+            replies.append(netstring(
+                self.server.respond(buffer[colon + 1:end])))
+            start = end + 1
+        self.buffer = buffer[start:]
+        if replies:
+            self.transport.write(b"".join(replies))
+
+    def fail(self, replies, reason):
+        # Framing is lost; all we can do is say so and hang up.
+        replies.append(netstring(b"PERM " + reason.encode()))
+        self.transport.write(b"".join(replies))
+        self.transport.close()
+
+
+class SocketmapServer(object):
+    """Answer socketmap queries for @map_name from the policy at @path.
+
+    @check_interval is how often, in seconds, the file is checked for
+    changes.  @clock gives the time the list's expiry is checked against.
+    """
+
+    def __init__(self, path, map_name="starttls", check_interval=5,
+                 clock=time.time):
+        self.path = path
+        self.map_name = map_name.encode("ascii")
+        self.check_interval = check_interval
+        self.clock = clock
+        self.policy_map = load(path)
+        self.reloads = 0
+        self._reloading = None
+
+    def protocol(self):
+        return SocketmapProtocol(self)
+
+    def respond(self, request):
+        name, _, key = request.partition(b" ")
+        if name != self.map_name:
+            return b"PERM unknown map " + name[:64]
+        try:
+            key = key.decode("ascii")
+        except UnicodeDecodeError:
+            return b"NOTFOUND "
+        return self.policy_map.lookup(key, self.clock())
+
+    async def reload(self):
+        """Re-read the policy file if it changed since it was loaded."""
+        if self._reloading is not None:
+            return await self._reloading
+        self._reloading = asyncio.ensure_future(self._reload())
+        try:
+            return await self._reloading
+        finally:
+            self._reloading = None
+
+    async def _reload(self):
+        try:
+            if _file_stat(self.path) == self.policy_map.stat:
+                return False
+            loop = asyncio.get_running_loop()
+            policy_map = await loop.run_in_executor(None, load, self.path)
+        except (OSError, ValueError) as e:
+            logger.error("Keeping the current policy list; can't load %s: %s",
+                         self.path, e)
+            return False
+        self.policy_map = policy_map
+        self.reloads += 1
+        logger.info("Loaded %d policies from %s", len(policy_map.index),
+                    self.path)
+        return True
+
+    async def watch(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            await self.reload()
+
+    async def serve(self, listen):
+        """Serve on @listen ("unix:/path" or "inet:host:port") forever."""
+        loop = asyncio.get_running_loop()
+        kind, _, address = listen.partition(":")
+        if kind == "unix":
+            if os.path.exists(address):
+                os.unlink(address)
+            server = await loop.create_unix_server(self.protocol, address)
+        elif kind == "inet":
+            host, _, port = address.rpartition(":")
+            server = await loop.create_server(self.protocol, host, int(port))
+        else:
+            raise ValueError("listen address must be unix:PATH or "
+                             "inet:HOST:PORT, not %r" % listen)
+        loop.add_signal_handler(
+            signal.SIGHUP, lambda: asyncio.ensure_future(self.reload()))
+        watcher = asyncio.ensure_future(self.watch())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            watcher.cancel()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Answer Postfix smtp_tls_policy_maps socketmap queries "
+        "from a STARTTLS policy list")
+    parser.add_argument("--policy", default="/etc/starttls-policy/policy.json",
+                        help="verified policy list, as JSON or compiled by "
+                        "PolicyIndex.py (default: %(default)s)")
+    parser.add_argument("--listen",
+                        default="unix:/var/spool/postfix/private/starttls",
+                        help="unix:PATH or inet:HOST:PORT "
+                        "(default: %(default)s)")
+    parser.add_argument("--map-name", default="starttls",
+                        help="socketmap name Postfix queries "
+                        "(default: %(default)s)")
+    parser.add_argument("--check-interval", type=float, default=5,
+                        help="seconds between checks of --policy for changes "
+                        "(default: %(default)s)")
+    args = parser.parse_args(argv)
+    logging.basicConfig(stream=sys.stderr, level=logging.INFO,
+                        format="%(asctime)s %(levelname)s %(message)s")
+    server = SocketmapServer(args.policy, args.map_name, args.check_interval)
+    try:
+        asyncio.run(server.serve(args.listen))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Decide which MX hosts a scan needs to probe again.
+
+A full rescan re-probes every host, although most of them present the same
+certificate as last night.  RescanScheduler looks at what the ObservationStore
+already holds for a host and only schedules it when
+
+  * it has never been probed,
+  * its latest successful observation is older than @max_age,
+  * its certificate chain expires within @expiry_window, or
+  * its latest probe failed and its retry backoff has run out.
+
+Hosts that keep failing are retried after @retry_after, doubling with each
+consecutive failure up to @max_retry_after, so that dead or tarpitting hosts
+don't dominate every scan.
+"""
+import time
+
+DAY = 24 * 60 * 60
+
+
+class RescanScheduler(object):
+    """Pick the MX hosts whose stored observations are due a refresh.
+
+    All durations are in seconds.  @clock returns the current time as a Unix
+    timestamp, matching the store's scanned_at.
+    """
+
+    def __init__(self, max_age=7 * DAY, expiry_window=14 * DAY,
+                 retry_after=60 * 60, max_retry_after=7 * DAY,
+                 clock=time.time):
+        self.max_age = max_age
+        self.expiry_window = expiry_window
+        self.retry_after = retry_after
+        self.max_retry_after = max_retry_after
+        self.clock = clock
+
+    def backoff(self, failures):
+        """Return how long to wait after @failures consecutive failures."""
+        if failures <= 0:
+            return 0
+        # Cap the exponent too, so a host failing for years can't overflow.
+        delay = self.retry_after * 2 ** min(failures - 1, 32)
+        return min(delay, self.max_retry_after)
+
+    def next_probe(self, store, mx_host):
+        """Return the time at which @mx_host is next due to be probed."""
+        latest, failures = store.history(mx_host)
+        if latest is None:
+            return 0
+        if latest.error is not None:
+            return latest.scanned_at + self.backoff(failures)
+        due = latest.scanned_at + self.max_age
+        if latest.not_after is not None:
+            # A certificate near (or past) expiry is worth watching for its
+            # renewal, but no more often than a failing host is retried.
+            due = min(due, max(latest.not_after - self.expiry_window,
+                               latest.scanned_at + self.retry_after))
+        return due
+
+    def due(self, store, mx_hosts):
+        """Return those of @mx_hosts that should be probed now, in order."""
+        now = self.clock()
+        return [mx_host for mx_host in mx_hosts
+                if self.next_probe(store, mx_host) <= now]
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Single-connection STARTTLS probe.
+
+Each MX gets one TCP connection: read the banner, EHLO, STARTTLS, then run the
+TLS handshake in-process and record the negotiated protocol, the cipher and
+the peer's certificate chain in DER.  Nothing is verified here; the chain is
+captured as sent so that it can be validated (and re-validated) later.
+"""
+import asyncio
+import collections
+import contextlib
+import socket
+import ssl
+import sys
+
+SMTP_PORT = 25
+
+Observation = collections.namedtuple(
+    "Observation", ["mx_host", "address", "protocol", "cipher", "chain"])
+
+
+class SMTPReplyError(Exception):
+    """An SMTP server answered with an unexpected reply code."""
+    def __init__(self, code, lines):
+        Exception.__init__(self, code, " ".join(lines))
+        self.code = code
+        self.lines = lines
+
+
+# Everything probe() raises for a host that could not be captured.
+PROBE_ERRORS = (SMTPReplyError, OSError, asyncio.TimeoutError)
+
+
+def describe_failure(mx_host, error):
+    """Return the human-readable reason a probe of @mx_host failed."""
+    if isinstance(error, SMTPReplyError):
+        # In order to talk to some hosts, you need to run this from a host that
+        # has a reverse DNS entry. AWS instances all have reverse DNS, as an
+        # example.
+        if error.code == 554:
+            return " ".join(error.lines)
+        elif error.code:
+            return "No STARTTLS support on %s %s" % (mx_host, error.code)
+        return "No STARTTLS support on %s" % mx_host
+    if isinstance(error, ssl.SSLError):
+        return "TLS handshake with %s failed: %s" % (mx_host, error)
+    if isinstance(error, asyncio.TimeoutError):
+        return "Connection to %s timed out" % mx_host
+    return "Connection to %s failed: %s" % (mx_host, error.strerror or error)
+
+
+def capture_context():
+    """An SSLContext that will complete a handshake with anything.
+
+    We want to record what a server offers, including old protocol versions
+    and weak ciphers, rather than fail the handshake on it.
+    """
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    context.minimum_version = ssl.TLSVersion.MINIMUM_SUPPORTED
+    context.set_ciphers("ALL:@SECLEVEL=0")
+    return context
+
+_capture_context = None
+
+
+async def read_reply(reader):
+    """Read one (possibly multi-line) SMTP reply.
+
+    Returns (code, lines) where lines have the code and separator stripped.
+    """
+    lines = []
+    while True:
+        line = await reader.readline()
+        if not line:
+            raise ConnectionError("connection closed by server")
+        line = line.decode("latin-1").rstrip("\r\n")
+        lines.append(line[4:])
+        if line[3:4] != "-":
+            break
+    try:
+        code = int(line[:3])
+    except ValueError:
+        raise SMTPReplyError(0, lines)
+    return code, lines
+
+
+async def command(reader, writer, cmd, expect):
+    writer.write(cmd.encode("ascii") + b"\r\n")
+    await writer.drain()
+    code, lines = await read_reply(reader)
+    if code != expect:
+        raise SMTPReplyError(code, lines)
+    return lines
+
+
+def _untimed(phase):
+    return contextlib.nullcontext()
+
+
+async def starttls_dialogue(reader, writer, ehlo_name, timeout=None,
+                            span=_untimed):
+    """Read the greeting, EHLO and issue STARTTLS.
+
+    @timeout bounds the whole dialogue; @span(phase) is entered around each
+    of the "banner", "ehlo" and "starttls" steps (see ScanMetrics.span).
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout if timeout is not None else None
+
+    def remaining():
+        return max(deadline - loop.time(), 0) if deadline is not None \
+            else None
+
+    with span("banner"):
+        code, lines = await asyncio.wait_for(read_reply(reader), remaining())
+        if code != 220:
+            raise SMTPReplyError(code, lines)
+    with span("ehlo"):
+        extensions = await asyncio.wait_for(
+            command(reader, writer, "EHLO " + ehlo_name, 250), remaining())
+        if not any(ext.upper().split()[:1] == ["STARTTLS"]
+                   for ext in extensions[1:]):
+            raise SMTPReplyError(None, ["STARTTLS extension not supported"])
+    with span("starttls"):
+        await asyncio.wait_for(command(reader, writer, "STARTTLS", 220),
+                               remaining())
+
+
+def peer_chain(ssl_object):
+    """Return the certificate chain the peer sent, leaf first, as DER.
+
+    SSLObject.get_unverified_chain() is public from Python 3.13.  Python 3.10
+    to 3.12 have the same method on the _ssl object underneath, which is used
+    there; anywhere else, only the leaf is returned.
+    """
+    if sys.version_info >= (3, 13):
+        chain = ssl_object.get_unverified_chain()
+    elif sys.version_info >= (3, 10):
+        chain = ssl_object._sslobj.get_unverified_chain()
+    else:
+        chain = None
+    if not chain:
+        leaf = ssl_object.getpeercert(binary_form=True)
+        return [leaf] if leaf else []
+    # 3.13 returns DER; before, _ssl.Certificate objects, whose public
+    # encoding is PEM.
+    return [cert if isinstance(cert, bytes)
+            else ssl.PEM_cert_to_DER_cert(cert.public_bytes())
+            for cert in chain]
+
+
+async def probe(mx_host, address=None, port=SMTP_PORT, timeout=10,
+                ehlo_name=None, metrics=None):
+    """Negotiate STARTTLS with @mx_host and return an Observation.
+
+    @address, if given, is connected to instead of resolving @mx_host; the
+    hostname is still sent as SNI.  @timeout applies to the TCP connect, the
+    SMTP dialogue and the TLS handshake separately.  If @metrics (a
+    ScanMetrics) is given, each phase is timed into it.  Raises one of
+    PROBE_ERRORS if the host could not be captured.
+    """
+    global _capture_context
+    if _capture_context is None:
+        _capture_context = capture_context()
+    span = metrics.span if metrics is not None else _untimed
+    loop = asyncio.get_running_loop()
+    with span("connect"):
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(address or mx_host, port), timeout)
+    try:
+        await starttls_dialogue(reader, writer,
+                                ehlo_name or socket.getfqdn(), timeout, span)
+        with span("handshake"):
+            transport = await loop.start_tls(
+                writer.transport, writer.transport.get_protocol(),
+                _capture_context, server_hostname=mx_host,
+                ssl_handshake_timeout=timeout)
+        try:
+            ssl_object = transport.get_extra_info("ssl_object")
+            return Observation(
+                mx_host=mx_host,
+                address=transport.get_extra_info("peername")[0],
+                protocol=ssl_object.version(),
+                cipher=ssl_object.cipher()[0],
+                chain=peer_chain(ssl_object))
+        finally:
+            transport.close()
+    finally:
+        writer.close()
+
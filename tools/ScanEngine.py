@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Concurrent STARTTLS scanning for CheckSTARTTLS.
+
+CheckSTARTTLS.collect() probes one MX at a time, so a large domain list is
+bounded by its slowest (or tarpitting) hosts.  ScanEngine runs the same probe
+as asyncio tasks.  A global limit caps how many probes are in flight, and a
+per-address limit keeps any single destination IP from seeing more than a few
+of our connections at once.
+
+Every domain's MX records are resolved first (see MXResolver), and each
+distinct MX host is probed once however many domains use it.  Domains, their
+MX sets and every probe result are recorded in an ObservationStore, which is
+what PolicyGenerator reads.
+
+Given a RescanScheduler, only the MX hosts whose stored results are due a
+refresh are probed.  The hosts a scan plans to probe are queued in the store
+before any probe starts and leave the queue as their results are recorded, so
+a scan that is interrupted is finished off by the next one.
+
+A scan can be split across machines with @shard: each worker still resolves
+every domain, but only probes the MX hosts that shard_of() assigns to it, so
+an MX shared by many domains is probed by exactly one worker.  The workers'
+stores are combined with ObservationStore.merge().
+
+Each probe is timed phase by phase into a ScanMetrics, which can be written
+out as a Prometheus text file every @metrics_interval seconds while the scan
+runs.
+"""
+import asyncio
+import hashlib
+import socket
+import sys
+
+import dns.exception
+
+from MXResolver import MXResolver
+from ScanMetrics import ScanMetrics
+from STARTTLSProbe import SMTP_PORT, PROBE_ERRORS, describe_failure, probe
+
+
+def log(message):
+    # stdout carries the generated configuration, so progress goes to stderr.
+    print(message, file=sys.stderr)
+
+
+def shard_of(mx_host, count):
+    """Return which of @count shards probes @mx_host.
+
+    This must agree between processes and machines, so it can't use hash().
+    """
+    digest = hashlib.sha256(mx_host.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % count
+
+
+class ScanEngine(object):
+    """Probe the MX hosts of many mail domains concurrently.
+
+    @concurrency bounds the number of probes in flight overall and @per_ip
+    the number in flight against any one destination address.  @timeout
+    applies to each network step (connect, SMTP dialogue, TLS handshake).
+    @resolver is an MXResolver; by default one using the system resolver.
+    @scheduler, a RescanScheduler, limits probes to hosts that are due; by
+    default every MX host is probed.  Timings are collected in @metrics (a
+    new ScanMetrics by default) and, if @metrics_file is set, written there
+    in Prometheus format every @metrics_interval seconds and at the end.
+    @shard, an (index, count) pair, restricts probes to that shard's hosts.
+    """
+
+    def __init__(self, store, concurrency=100, per_ip=2, timeout=10,
+                 port=SMTP_PORT, resolver=None, scheduler=None, metrics=None,
+                 metrics_file=None, metrics_interval=15, shard=None):
+        self.store = store
+        self.concurrency = concurrency
+        self.per_ip = per_ip
+        self.timeout = timeout
+        self.port = port
+        self.resolver = resolver or MXResolver()
+        self.scheduler = scheduler
+        self.metrics = metrics or ScanMetrics()
+        self.metrics_file = metrics_file
+        self.metrics_interval = metrics_interval
+        self.shard = shard
+        self.ehlo_name = socket.getfqdn()
+        self._global_limit = None
+        self._address_limits = {}
+
+    def run(self, domains):
+        """Scan every mail domain in @domains, blocking until all finish."""
+        asyncio.run(self.scan(domains))
+
+    async def scan(self, domains):
+        """Scan every mail domain in @domains.
+
+        All MX lookups are done up front, and each distinct MX host is probed
+        once; the store maps its result to every domain that uses it.  Hosts
+        left queued by an interrupted scan are probed first.
+        """
+        # A domain listed twice is still looked up and recorded once.
+        domains = list(dict.fromkeys(domains))
+        # Created here so that they belong to the running event loop.
+        self._global_limit = asyncio.Semaphore(self.concurrency)
+        self._address_limits = {}
+        for mail_domain in domains:
+            log("Checking domain %s" % mail_domain)
+        mx_to_domains, failures = await self.resolver.map_domains(domains)
+        domain_to_mxs = dict((mail_domain, []) for mail_domain in domains)
+        for mx_host, mail_domains in mx_to_domains.items():
+            for mail_domain in mail_domains:
+                domain_to_mxs[mail_domain].append(mx_host)
+        for mail_domain, mx_hosts in domain_to_mxs.items():
+            error = failures.get(mail_domain)
+            if error is not None:
+                log("MX lookup for %s failed: %s" % (mail_domain, error))
+                error = str(error)
+            self.store.record_domain(mail_domain, mx_hosts, error)
+        resumed = self.store.queued()
+        if resumed:
+            log("Resuming %d probes from an interrupted scan" % len(resumed))
+        mx_hosts = list(mx_to_domains)
+        if self.shard is not None:
+            index, count = self.shard
+            mx_hosts = [mx_host for mx_host in mx_hosts
+                        if shard_of(mx_host, count) == index]
+            log("%d of %d MX hosts in shard %d/%d"
+                % (len(mx_hosts), len(mx_to_domains), index, count))
+        if self.scheduler is not None:
+            candidates = len(mx_hosts)
+            mx_hosts = self.scheduler.due(self.store, mx_hosts)
+            log("%d of %d MX hosts due for a probe"
+                % (len(mx_hosts), candidates))
+        mx_hosts = list(dict.fromkeys(resumed + mx_hosts))
+        self.store.enqueue(mx_hosts)
+        exporter = None
+        if self.metrics_file:
+            exporter = asyncio.ensure_future(self.export_metrics())
+        try:
+            await asyncio.gather(*[self.scan_mx(mx_host)
+                                   for mx_host in mx_hosts])
+        finally:
+            if exporter is not None:
+                exporter.cancel()
+                self.metrics.write_prometheus(self.metrics_file)
+        self.store.commit()
+
+    async def export_metrics(self):
+        while True:
+            await asyncio.sleep(self.metrics_interval)
+            self.metrics.write_prometheus(self.metrics_file)
+
+    def address_limit(self, address):
+        limit = self._address_limits.get(address)
+        if limit is None:
+            limit = self._address_limits[address] = asyncio.Semaphore(
+                self.per_ip)
+        return limit
+
+    async def scan_mx(self, mx_host):
+        clock = self.metrics.clock
+        start = clock()
+        try:
+            with self.metrics.span("dns"):
+                address = (await self.resolver.addresses(mx_host))[0]
+        except dns.exception.DNSException as e:
+            log("Address lookup for %s failed: %s" % (mx_host, e))
+            self.store.record_failure(mx_host, "address lookup failed: %s" % e)
+            self.metrics.host_done(False, clock() - start)
+            return
+        resolved = clock()
+        # Take the per-address slot first so that probes queued behind a busy
+        # provider don't sit on global slots other hosts could be using.
+        async with self.address_limit(address):
+            async with self._global_limit:
+                # Time spent queued for a slot isn't the host's doing.
+                start += clock() - resolved
+                try:
+                    observation = await probe(mx_host, address, self.port,
+                                              self.timeout, self.ehlo_name,
+                                              self.metrics)
+                except PROBE_ERRORS as e:
+                    reason = describe_failure(mx_host, e)
+                    log(reason)
+                    self.store.record_failure(mx_host, reason, address=address)
+                    self.metrics.host_done(False, clock() - start)
+                    return
+        self.metrics.host_done(True, clock() - start)
+        self.store.record_observation(observation)
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Per-phase timing and error accounting for STARTTLS scans.
+
+Every probe is split into phases:
+
+  dns        resolving the MX host's address
+  connect    the TCP connect
+  banner     waiting for the 220 greeting
+  ehlo       EHLO and its reply
+  starttls   STARTTLS and its reply
+  handshake  the TLS handshake
+
+Each phase a probe completes is added to a histogram for that phase, and a
+phase that fails is counted under an error class (timeout, refused, tls,
+smtp_554...).  ScanMetrics.summary() gives the totals as a dict for a JSON
+report at the end of a run, and write_prometheus() writes them in the
+Prometheus text exposition format, replacing the file atomically so that a
+node_exporter textfile collector never reads a partial one.
+"""
+import asyncio
+import collections
+import contextlib
+import errno
+import ssl
+import time
+
+from AtomicWrite import atomic_write
+from STARTTLSProbe import SMTPReplyError
+
+PHASES = ("dns", "connect", "banner", "ehlo", "starttls", "handshake")
+
+# Upper bounds, in seconds, of the histogram buckets.  Connects to nearby
+# hosts take milliseconds; tarpits hold a probe until the timeout.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def error_class(error):
+    """Return a short, low-cardinality label for why a phase failed."""
+    if isinstance(error, asyncio.TimeoutError):
+        return "timeout"
+    if isinstance(error, SMTPReplyError):
+        return "smtp_%s" % error.code if error.code else "no_starttls"
+    if isinstance(error, ssl.SSLError):
+        return "tls"
+    if isinstance(error, ConnectionRefusedError):
+        return "refused"
+    if isinstance(error, ConnectionResetError):
+        return "reset"
+    if isinstance(error, OSError) and error.errno in (errno.EHOSTUNREACH,
+                                                      errno.ENETUNREACH):
+        return "unreachable"
+    if isinstance(error, ConnectionError):
+        return "closed"
+    if type(error).__module__.startswith("dns."):
+        return "dns"
+    return "other"
+
+
+def _bound(seconds):
+    # JSON has no infinity.
+    return "+Inf" if seconds == float("inf") else seconds
+
+
+class Histogram(object):
+    """Cumulative-bucket histogram of durations in seconds."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            i = len(self.buckets)
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Estimate the @q quantile as the upper bound of its bucket.
+
+        Returns None for an empty histogram and infinity if it falls in the
+        overflow bucket.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def cumulative(self):
+        """Yield (upper bound, observations <= bound), ending with +Inf."""
+        seen = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            seen += count
+            yield bound, seen
+
+
+class ScanMetrics(object):
+    """Phase timings, error counts and host outcomes for one scan."""
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.started = clock()
+        self.phases = collections.OrderedDict(
+            (phase, Histogram()) for phase in PHASES)
+        # (phase, error class) -> count
+        self.errors = collections.Counter()
+        # "ok" / "failed" -> count
+        self.hosts = collections.Counter()
+        # Time each host took, not counting waits for a free slot.
+        self.host_seconds = Histogram()
+
+    @contextlib.contextmanager
+    def span(self, phase):
+        """Time the enclosed block as @phase, counting it if it raises."""
+        start = self.clock()
+        try:
+            yield
+        except Exception as e:
+            self.errors[(phase, error_class(e))] += 1
+            raise
+        self.phases[phase].observe(self.clock() - start)
+
+    def host_done(self, ok, seconds=None):
+        """Count a finished host, and how long it took if @seconds is given."""
+        self.hosts["ok" if ok else "failed"] += 1
+        if seconds is not None:
+            self.host_seconds.observe(seconds)
+
+    def summary(self):
+        """Return the metrics as a JSON-serializable dict."""
+        phases = collections.OrderedDict()
+        for phase, histogram in self.phases.items():
+            phases[phase] = collections.OrderedDict([
+                ("count", histogram.count),
+                ("sum_seconds", round(histogram.sum, 6)),
+                ("p50_seconds", _bound(histogram.quantile(0.5))),
+                ("p90_seconds", _bound(histogram.quantile(0.9))),
+                ("p99_seconds", _bound(histogram.quantile(0.99))),
+            ])
+        errors = collections.OrderedDict()
+        for (phase, cls), count in sorted(self.errors.items()):
+            errors.setdefault(phase, collections.OrderedDict())[cls] = count
+        return collections.OrderedDict([
+            ("elapsed_seconds", round(self.clock() - self.started, 3)),
+            ("hosts", dict(self.hosts)),
+            ("host_p50_seconds", _bound(self.host_seconds.quantile(0.5))),
+            ("host_p99_seconds", _bound(self.host_seconds.quantile(0.99))),
+            ("phases", phases),
+            ("errors", errors),
+        ])
+
+    def prometheus(self):
+        """Return the metrics in the Prometheus text exposition format."""
+        lines = [
+            "# HELP starttls_scan_phase_seconds Time spent in each probe "
+            "phase.",
+            "# TYPE starttls_scan_phase_seconds histogram",
+        ]
+        for phase, histogram in self.phases.items():
+            for bound, count in histogram.cumulative():
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                lines.append('starttls_scan_phase_seconds_bucket'
+                             '{phase="%s",le="%s"} %d' % (phase, le, count))
+            lines.append('starttls_scan_phase_seconds_sum{phase="%s"} %r'
+                         % (phase, histogram.sum))
+            lines.append('starttls_scan_phase_seconds_count{phase="%s"} %d'
+                         % (phase, histogram.count))
+        lines += [
+            "# HELP starttls_scan_errors_total Probe phases that failed, by "
+            "error class.",
+            "# TYPE starttls_scan_errors_total counter",
+        ]
+        for (phase, cls), count in sorted(self.errors.items()):
+            lines.append('starttls_scan_errors_total{phase="%s",class="%s"} %d'
+                         % (phase, cls, count))
+        lines += [
+            "# HELP starttls_scan_hosts_total MX hosts probed, by outcome.",
+            "# TYPE starttls_scan_hosts_total counter",
+        ]
+        for result in ("ok", "failed"):
+            lines.append('starttls_scan_hosts_total{result="%s"} %d'
+                         % (result, self.hosts[result]))
+        lines += [
+            "# HELP starttls_scan_host_seconds Time spent on each MX host.",
+            "# TYPE starttls_scan_host_seconds histogram",
+        ]
+        for bound, count in self.host_seconds.cumulative():
+            le = "+Inf" if bound == float("inf") else repr(float(bound))
+            lines.append('starttls_scan_host_seconds_bucket{le="%s"} %d'
+                         % (le, count))
+        lines.append("starttls_scan_host_seconds_sum %r"
+                     % self.host_seconds.sum)
+        lines.append("starttls_scan_host_seconds_count %d"
+                     % self.host_seconds.count)
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """Atomically replace @path with the current metrics."""
+        atomic_write(path, self.prometheus().encode("utf-8"))